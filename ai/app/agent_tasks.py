@@ -0,0 +1,88 @@
+"""
+Registry of in-flight agent pipelines.
+
+- One pipeline per user: a new /chat cancels the user's previous one
+- A global semaphore caps how many pipelines run at once (MAX_CONCURRENT_AGENTS)
+- Admission control: once MAX_QUEUED_AGENTS are waiting for a slot, new
+  requests are refused so /chat can answer 429 with Retry-After
+Task state is exported through the agent_tasks_* metrics.
+"""
+
+import asyncio
+import os
+from . import metrics
+
+MAX_CONCURRENT_AGENTS = int(os.getenv("MAX_CONCURRENT_AGENTS", "16"))
+MAX_QUEUED_AGENTS = int(os.getenv("MAX_QUEUED_AGENTS", "64"))
+AGENT_RETRY_AFTER_SECONDS = int(os.getenv("AGENT_RETRY_AFTER_SECONDS", "5"))
+
+
+class AgentRegistry:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_AGENTS, max_queued: int = MAX_QUEUED_AGENTS):
+        self.max_queued = max_queued
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tasks = {}
+
+    def is_saturated(self, user_id: str) -> bool:
+        """True if a new pipeline for this user would overflow the queue.
+
+        A user replacing their own pipeline doesn't add load, so is always admitted.
+        """
+        previous = self._tasks.get(user_id)
+        if previous is not None and not previous.done():
+            return False
+        return self.queued >= self.max_queued
+
+    def cancel(self, user_id: str) -> bool:
+        """Cancel the user's in-flight pipeline, if any."""
+        previous = self._tasks.pop(user_id, None)
+        if previous is None or previous.done():
+            return False
+        previous.cancel()
+        metrics.AGENT_TASKS_SUPERSEDED.inc()
+        return True
+
+    def start(self, user_id: str, coro) -> asyncio.Task:
+        """Run ``coro`` once a slot is free, superseding the user's previous pipeline."""
+        self.cancel(user_id)
+        task = asyncio.create_task(self._run(coro))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda t: self._forget(user_id, t))
+        return task
+
+    def _forget(self, user_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    async def _run(self, coro) -> None:
+        outcome = "cancelled"
+        self.queued += 1
+        metrics.AGENT_TASKS_QUEUED.inc()
+        waiting = True
+        try:
+            async with self._semaphore:
+                self.queued -= 1
+                metrics.AGENT_TASKS_QUEUED.dec()
+                waiting = False
+                metrics.AGENT_TASKS_RUNNING.inc()
+                try:
+                    await coro
+                    outcome = "completed"
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    outcome = "failed"
+                    raise
+                finally:
+                    metrics.AGENT_TASKS_RUNNING.dec()
+        finally:
+            if waiting:
+                # Cancelled before getting a slot; the coroutine never started
+                self.queued -= 1
+                metrics.AGENT_TASKS_QUEUED.dec()
+                coro.close()
+            metrics.AGENT_TASKS_FINISHED.labels(outcome=outcome).inc()
+
+
+registry = AgentRegistry()
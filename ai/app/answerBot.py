@@ -1,4 +1,5 @@
 from langchain_mistralai import ChatMistralAI
+from . import metrics
 
 system_message = """
 You are a helpful fitness assistant.
@@ -20,9 +21,21 @@ llm = ChatMistralAI(
 
 # input: (role, content) list
 # role must alternate between "human" and "ai" starting with "human" ending with "ai"
-def chat(messages: list[tuple[str, str]]):
+async def chat(messages: list[tuple[str, str]]):
     messages.insert(0, ("system", system_message))
 
-    ai_msg = llm.invoke(messages)
+    ai_msg = await llm.ainvoke(messages)
+    metrics.record_llm_usage(llm.model, ai_msg)
     #print(ai_msg.content)
-    return ai_msg.content
\ No newline at end of file
+    return ai_msg.content
+
+
+# same input as chat(); yields text deltas as the model generates them
+async def stream_chat(messages: list[tuple[str, str]]):
+    messages.insert(0, ("system", system_message))
+
+    async for chunk in llm.astream(messages):
+        # usage arrives on the final chunk
+        metrics.record_llm_usage(llm.model, chunk)
+        if chunk.content:
+            yield chunk.content
\ No newline at end of file
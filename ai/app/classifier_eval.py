@@ -0,0 +1,94 @@
+"""
+Offline evaluation of the fast-path classifiers against the LLM classifiers.
+
+Reads prompts (one per line) and, for every prompt, records the LLM label and
+the centroid prediction of both the guardrail and the router. For each
+threshold it reports:
+- local:     fraction of prompts the fast path may decide (confident, and a
+             label the classifier accepts locally: the guardrail only refuses)
+- agreement: fraction of those local decisions that match the LLM label
+
+"local" is an upper bound. At runtime the LLM call is always started and
+only cancelled when the query embedding finishes first, so how many local
+decisions actually win depends on the two latencies; see the
+fast_classifier_decisions_total metric.
+
+Usage (from ai/):
+    python -m app.classifier_eval prompts.txt
+    python -m app.classifier_eval prompts.txt --thresholds 0.02 0.05 0.1
+
+Use prompts that are not in fast_classifier's example lists, otherwise the
+agreement is flattering.
+"""
+
+import argparse
+import asyncio
+from . import fast_classifier
+from . import question_guardrail
+from . import rag
+from . import rag_director
+
+
+async def collect(prompts: list[str]) -> dict:
+    """Label every prompt with the LLMs and score it against the centroids."""
+    vectors = await rag.embeddings.aembed_documents(prompts)
+    results = {}
+    for name, classifier, llm_classify, accepted in (
+        ("guardrail", fast_classifier.guardrail, question_guardrail.check_guardrails, question_guardrail.FAST_PATH_LABELS),
+        ("router", fast_classifier.router, rag_director.get_rag_direction, None),
+    ):
+        await classifier.load()
+        rows = []
+        for prompt, vector in zip(prompts, vectors):
+            # No query vector: always the LLM path
+            llm_label = await llm_classify(prompt)
+            label, confidence, _ = classifier.predict(vector, threshold=0.0)
+            if accepted is not None and label not in accepted:
+                # Never decided locally, whatever the margin
+                confidence = float("-inf")
+            rows.append((prompt, llm_label, label, confidence))
+        results[name] = rows
+    return results
+
+
+def report(results: dict, thresholds: list[float]) -> None:
+    for name, rows in results.items():
+        print(f"\n=== {name} ({len(rows)} prompts) ===")
+        print(f"{'threshold':>10} {'local':>8} {'agreement':>10} {'count':>6} {'wrong':>6}")
+        for threshold in thresholds:
+            local = [row for row in rows if row[3] >= threshold]
+            wrong = [row for row in local if row[1] != row[2]]
+            share = len(local) / len(rows) if rows else 0.0
+            agreement = 1 - len(wrong) / len(local) if local else 0.0
+            print(f"{threshold:>10.3f} {share:>8.1%} {agreement:>10.1%} {len(local):>6} {len(wrong):>6}")
+
+        # Disagreements at the configured threshold, to guide new examples
+        disagreements = [
+            row for row in rows
+            if row[3] >= fast_classifier.FAST_CLASSIFIER_THRESHOLD and row[1] != row[2]
+        ]
+        if disagreements:
+            print(f"\nDisagreements at FAST_CLASSIFIER_THRESHOLD={fast_classifier.FAST_CLASSIFIER_THRESHOLD}:")
+            for prompt, llm_label, label, confidence in disagreements:
+                print(f"  llm={llm_label:<15} local={label:<15} margin={confidence:.3f}  {prompt}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("prompts", help="text file with one prompt per line")
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+",
+        default=[0.0, 0.02, 0.05, 0.08, 0.12, fast_classifier.FAST_CLASSIFIER_THRESHOLD],
+        help="margin thresholds to report",
+    )
+    args = parser.parse_args()
+
+    with open(args.prompts, encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip()]
+
+    results = asyncio.run(collect(prompts))
+    report(results, sorted(set(args.thresholds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 import os
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 from dotenv import load_dotenv
+from pgvector.psycopg import register_vector, register_vector_async
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 load_dotenv()
 
@@ -12,12 +17,41 @@ if not DATABASE_URL:
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+# Rows per executemany chunk for bulk UPDATEs (embedding saves, backfills)
+BULK_WRITE_CHUNK_SIZE = int(os.getenv("BULK_WRITE_CHUNK_SIZE", "500"))
+# Exercises/workouts fetched per query when streaming a user's history; each
+# page is read in its own short session, so no cursor stays open while the
+# caller embeds it
+STREAM_PAGE_SIZE = int(os.getenv("STREAM_PAGE_SIZE", "100"))
+
+# psycopg 3 for both engines: pgvector's adapter sends NumPy vectors in binary
+# format, and executemany is pipelined
+ENGINE_URL = make_url(DATABASE_URL).set(drivername="postgresql+psycopg")
+
 engine = create_engine(
-    DATABASE_URL,
+    ENGINE_URL,
     pool_pre_ping=True,  # re-validates connections before use; handles Neon idle drops
     pool_recycle=300,    # recycle connections every 5 min to avoid stale handles
 )
 
+# Async engine for the /chat path, so queries don't block the event loop
+async_engine = create_async_engine(
+    ENGINE_URL,
+    pool_pre_ping=True,
+    pool_recycle=300,
+)
+
+
+# Vectors travel as float32 NumPy arrays in both directions
+@event.listens_for(engine, "connect")
+def _register_vector(dbapi_connection, connection_record):
+    register_vector(dbapi_connection)
+
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def _register_vector_async(dbapi_connection, connection_record):
+    dbapi_connection.run_async(register_vector_async)
+
 @contextmanager
 def get_session():
     session = Session(engine)
@@ -28,3 +62,15 @@ def get_session():
         raise
     finally:
         session.close()
+
+
+@asynccontextmanager
+async def get_async_session():
+    session = AsyncSession(async_engine)
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -0,0 +1,138 @@
+"""
+Memoized guardrail and routing decisions.
+
+Both classifiers run at temperature 0, so their label is a function of the
+model, the classifier's prompt template, the user prompt and the previous
+human turns. Decisions are cached under a sha256 of those (after
+whitespace/case normalization) in two tiers:
+- memory:   per-process LRU + TTL (cache.TTLCache)
+- postgres: optional, shared by every worker (08_ClassifierDecisions.sql),
+            enabled with DECISION_CACHE_PERSISTENT=true; expired rows are
+            deleted by a background sweep, not on the write path
+
+Each classifier has its own switch (GUARDRAIL_DECISION_CACHE,
+ROUTER_DECISION_CACHE).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from sqlmodel import text
+from . import db
+from . import metrics
+from . import tracing
+from .cache import TTLCache
+from .rag import normalize_prompt
+
+GUARDRAIL_DECISION_CACHE = os.getenv("GUARDRAIL_DECISION_CACHE", "true").lower() == "true"
+ROUTER_DECISION_CACHE = os.getenv("ROUTER_DECISION_CACHE", "true").lower() == "true"
+DECISION_CACHE_SIZE = int(os.getenv("DECISION_CACHE_SIZE", "2048"))
+DECISION_CACHE_TTL_SECONDS = float(os.getenv("DECISION_CACHE_TTL_SECONDS", "3600"))
+DECISION_CACHE_PERSISTENT = os.getenv("DECISION_CACHE_PERSISTENT", "false").lower() == "true"
+DECISION_CACHE_PERSISTENT_TTL_SECONDS = float(os.getenv("DECISION_CACHE_PERSISTENT_TTL_SECONDS", "604800"))
+# Expired persistent rows are deleted in the background at most this often per classifier
+DECISION_CACHE_SWEEP_SECONDS = float(os.getenv("DECISION_CACHE_SWEEP_SECONDS", "3600"))
+
+
+def decision_key(model: str, prompt: str, context: list = [], template: str = "") -> str:
+    """Hash of the inputs the classifier actually sees: model, classifier prompt template,
+    user prompt and human turns. Editing the template changes every key, so labels
+    persisted under an older classifier prompt are never served."""
+    human_turns = [normalize_prompt(message) for role, message in context or [] if role == "human"]
+    payload = json.dumps([model, template, normalize_prompt(prompt), human_turns])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DecisionCache:
+    def __init__(self, classifier: str, model: str, template: str = "", enabled: bool = True,
+                 persistent: bool = DECISION_CACHE_PERSISTENT):
+        """Two-tier cache of one classifier's labels; ``template`` is its LLM prompt."""
+        self.classifier = classifier
+        self.model = model
+        self.template = template
+        self.enabled = enabled
+        self.persistent = persistent
+        self.memory = TTLCache(maxsize=DECISION_CACHE_SIZE, ttl=DECISION_CACHE_TTL_SECONDS)
+        self._last_sweep = None
+        self._sweep_task = None
+
+    async def get(self, prompt: str, context: list = []) -> str | None:
+        """Cached label for this prompt and context, or None."""
+        if not self.enabled:
+            return None
+
+        key = decision_key(self.model, prompt, context, self.template)
+        label = self.memory.get(key)
+        if label is not None:
+            metrics.DECISION_CACHE_HITS.labels(classifier=self.classifier, tier="memory").inc()
+            return label
+
+        if self.persistent:
+            try:
+                label = await self._load(key)
+            except Exception as e:
+                tracing.log(f"[decision_cache] {self.classifier}: lookup failed: {e}")
+            if label is not None:
+                self.memory.set(key, label)
+                metrics.DECISION_CACHE_HITS.labels(classifier=self.classifier, tier="postgres").inc()
+                return label
+
+        metrics.DECISION_CACHE_MISSES.labels(classifier=self.classifier).inc()
+        return None
+
+    async def set(self, prompt: str, context: list, label: str) -> None:
+        if not self.enabled:
+            return
+
+        key = decision_key(self.model, prompt, context, self.template)
+        self.memory.set(key, label)
+        if self.persistent:
+            try:
+                await self._store(key, label)
+            except Exception as e:
+                tracing.log(f"[decision_cache] {self.classifier}: store failed: {e}")
+            self._schedule_sweep()
+
+    async def _load(self, key: str) -> str | None:
+        async with db.get_async_session() as session:
+            result = await session.execute(text("""
+                SELECT label
+                FROM classifier_decisions
+                WHERE classifier = :classifier AND key_sha256 = :key
+                AND created_at > now() - make_interval(secs => :ttl)
+            """), {"classifier": self.classifier, "key": key, "ttl": DECISION_CACHE_PERSISTENT_TTL_SECONDS})
+            return result.scalar_one_or_none()
+
+    async def _store(self, key: str, label: str) -> None:
+        async with db.get_async_session() as session:
+            await session.execute(text("""
+                INSERT INTO classifier_decisions (classifier, key_sha256, label)
+                VALUES (:classifier, :key, :label)
+                ON CONFLICT (classifier, key_sha256)
+                DO UPDATE SET label = EXCLUDED.label, created_at = now()
+            """), {"classifier": self.classifier, "key": key, "label": label})
+            await session.commit()
+
+    def _schedule_sweep(self) -> None:
+        """Start a background sweep of expired rows (at most once per DECISION_CACHE_SWEEP_SECONDS)."""
+        now = time.monotonic()
+        if self._last_sweep is not None and now - self._last_sweep < DECISION_CACHE_SWEEP_SECONDS:
+            return
+        if self._sweep_task is not None and not self._sweep_task.done():
+            return
+        self._last_sweep = now
+        self._sweep_task = asyncio.create_task(self._sweep())
+
+    async def _sweep(self) -> None:
+        try:
+            async with db.get_async_session() as session:
+                await session.execute(text("""
+                    DELETE FROM classifier_decisions
+                    WHERE classifier = :classifier
+                    AND created_at < now() - make_interval(secs => :ttl)
+                """), {"classifier": self.classifier, "ttl": DECISION_CACHE_PERSISTENT_TTL_SECONDS})
+                await session.commit()
+        except Exception as e:
+            tracing.log(f"[decision_cache] {self.classifier}: sweep failed: {e}")
@@ -0,0 +1,142 @@
+"""
+Batching engine for embed_documents.
+
+Texts are split into batches by an estimated token budget, a configurable
+number of batches run concurrently behind a shared token-bucket rate limiter,
+429 responses are retried with exponential backoff, and each finished batch is
+yielded straight away so callers can save it before the next one arrives.
+A failure therefore only loses the batches still in flight, and memory stays
+bounded by EMBED_CONCURRENCY batches.
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+from . import embedding_cache
+from . import metrics
+
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "8000"))
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "128"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "2"))
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", "300000"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    def __init__(self, tokens_per_minute: int):
+        """Thread-safe token bucket refilled continuously at tokens_per_minute."""
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """Block until ``tokens`` can be spent."""
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_seconds = (tokens - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+# Shared by every pipeline in the process, so exercises and workouts together
+# stay under the provider's rate limit
+rate_limiter = TokenBucket(EMBED_TOKENS_PER_MINUTE)
+
+
+def split_batches(items, max_tokens: int = EMBED_BATCH_MAX_TOKENS, max_items: int = EMBED_BATCH_MAX_ITEMS):
+    """Lazily group (id, text) items into batches under the token and size limits."""
+    batch = []
+    batch_tokens = 0
+    for item in items:
+        tokens = estimate_tokens(item[1])
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status == 429 or "429" in str(error)
+
+
+def _embed_batch(client, batch):
+    """Embed one batch, backing off on 429s. Returns [(vector, id, text), ...].
+
+    Texts already in the content-hash cache are not sent to the provider.
+    """
+    texts = [embedding_text for _, embedding_text in batch]
+    vectors = [None] * len(texts)
+    if embedding_cache.EMBEDDING_CACHE_ENABLED:
+        hashes = [embedding_cache.text_hash(embedding_text) for embedding_text in texts]
+        cached = embedding_cache.lookup(client.model, hashes)
+        vectors = [cached.get(h) for h in hashes]
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        missing_tokens = sum(estimate_tokens(t) for t in missing_texts)
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            rate_limiter.acquire(missing_tokens)
+            try:
+                new_vectors = np.asarray(client.embed_documents(missing_texts), dtype=np.float32)
+                metrics.EMBEDDING_TOKENS.labels(model=client.model).inc(missing_tokens)
+                break
+            except Exception as e:
+                if not _is_rate_limited(e) or attempt == EMBED_MAX_RETRIES:
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                print(f"  ⏳ Rate limited, retrying batch of {len(missing)} in {delay:.1f}s")
+                time.sleep(delay)
+
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+
+        if embedding_cache.EMBEDDING_CACHE_ENABLED:
+            embedding_cache.store(client.model, [(hashes[i], vectors[i]) for i in missing])
+
+    return [
+        (vector, item_id, embedding_text)
+        for vector, (item_id, embedding_text) in zip(vectors, batch)
+    ]
+
+
+def embed_batches(client, items, concurrency: int = EMBED_CONCURRENCY):
+    """Embed (id, text) items, yielding each finished batch as [(vector, id, text), ...].
+
+    Batches are yielded in completion order, not input order.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed-batch") as pool:
+        in_flight = set()
+        for batch in split_batches(items):
+            if len(in_flight) >= concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(pool.submit(_embed_batch, client, batch))
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
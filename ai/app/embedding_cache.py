@@ -0,0 +1,54 @@
+"""
+Persistent embedding cache keyed by (model name, sha256 of text).
+
+Backed by the embedding_cache table (06_EmbeddingCache.sql) and checked before
+every embed_documents call, so unchanged content is never re-embedded.
+"""
+
+import hashlib
+import os
+from sqlmodel import text
+from . import db
+from . import metrics
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+
+
+def text_hash(embedding_text: str) -> str:
+    return hashlib.sha256(embedding_text.encode("utf-8")).hexdigest()
+
+
+def lookup(model: str, hashes: list[str]) -> dict:
+    """Return {text_sha256: vector} for the hashes already cached for this model."""
+    if not hashes:
+        return {}
+
+    with db.get_session() as session:
+        result = session.execute(text("""
+            SELECT text_sha256, embedding
+            FROM embedding_cache
+            WHERE model = :model AND text_sha256 = ANY(:hashes)
+        """), {"model": model, "hashes": hashes})
+        cached = {row.text_sha256: row.embedding for row in result}
+
+    hits = sum(1 for h in hashes if h in cached)
+    metrics.EMBEDDING_CACHE_HITS.labels(model=model).inc(hits)
+    metrics.EMBEDDING_CACHE_MISSES.labels(model=model).inc(len(hashes) - hits)
+    return cached
+
+
+def store(model: str, entries: list[tuple]) -> None:
+    """Cache (text_sha256, vector) pairs; existing entries are left untouched."""
+    if not entries:
+        return
+
+    with db.get_session() as session:
+        session.execute(text("""
+            INSERT INTO embedding_cache (model, text_sha256, embedding)
+            VALUES (:model, :text_sha256, CAST(:embedding AS vector))
+            ON CONFLICT (model, text_sha256) DO NOTHING
+        """), [
+            {"model": model, "text_sha256": text_sha256, "embedding": vector}
+            for text_sha256, vector in entries
+        ])
+        session.commit()
@@ -3,21 +3,107 @@ Kafka consumer that processes embedding requests for workouts and exercises.
 
 This service:
 1. Listens for 'workout-logged' events from Kafka
-2. Receives user_id in each message
-3. Calls the batched embedding pipelines for that user
-4. Processes one user at a time as messages arrive
+2. Receives a versioned JSON event naming the changed rows (see _process_message);
+   a bare user_id is still accepted from older producers
+3. Merges each user's events while the user waits for (or is busy on) the pool
+4. Re-embeds exactly the changed rows by primary key, then scans the user's
+   remaining unembedded rows if the freshness watermark says there are any
+   (always, for bare user_id messages), on a pool of WORKER_CONCURRENCY
+   threads
+5. Refreshes the user's training aggregates for the STATS route (user_stats.py,
+   SQL only, so before embedding) and weekly/monthly summary embeddings
+   (summary_embeddings.py)
+6. Commits each partition's offsets manually, up to its first message that is
+   not saved yet
+
+There is no batch barrier: a user is handed to the pool as soon as a thread is
+free and that user is not already running, so one slow user holds one thread
+instead of stalling everyone else's commits. A user is never run twice at
+once; events that arrive meanwhile are merged into its next run (the message
+key is the userId, so all of a user's events land on the same partition).
+A failed run is retried after WORKER_RETRY_BACKOFF_SECONDS. After
+WORKER_MAX_ATTEMPTS failures its messages are logged, counted and committed
+past, so a poison message cannot block its partition forever.
+
+When WORKER_MAX_PENDING_USERS users are waiting or running, the assigned
+partitions are paused. The consumer keeps polling to stay in the group but
+fetches nothing until the backlog drains. On a rebalance the runs of revoked
+partitions are finished and committed before they are handed over.
 """
 
+import contextvars
 import json
+import os
 import sys
-from confluent_kafka import Consumer, KafkaError
-from . import exercise_embeddings, workout_embeddings
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
+from prometheus_client import start_http_server
+from . import exercise_embeddings, summary_embeddings, workout_embeddings
+from . import freshness
+from . import metrics
+from . import tracing
+from . import user_stats
 
 # Kafka configuration
 KAFKA_BROKER = "kafka:9092"
 KAFKA_TOPIC = "workout-logged"
 KAFKA_GROUP = "embedding-worker-group"
 
+# Consumption: up to WORKER_BATCH_SIZE messages per poll, waiting at most
+# WORKER_BATCH_WINDOW_SECONDS while idle (WORKER_TICK_SECONDS while runs are
+# in flight, so finished users are committed and replaced promptly)
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "100"))
+WORKER_BATCH_WINDOW_SECONDS = float(os.getenv("WORKER_BATCH_WINDOW_SECONDS", "2.0"))
+WORKER_TICK_SECONDS = float(os.getenv("WORKER_TICK_SECONDS", "0.05"))
+# Distinct users embedded in parallel
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+# Users waiting or running before the partitions are paused
+WORKER_MAX_PENDING_USERS = int(os.getenv("WORKER_MAX_PENDING_USERS", str(4 * WORKER_CONCURRENCY)))
+# Pause before a failed user is retried
+WORKER_RETRY_BACKOFF_SECONDS = float(os.getenv("WORKER_RETRY_BACKOFF_SECONDS", "5.0"))
+# Failed runs of a user's messages before they are skipped
+WORKER_MAX_ATTEMPTS = int(os.getenv("WORKER_MAX_ATTEMPTS", "5"))
+
+# Port for the worker's Prometheus exporter
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
+
+# Newest workout-logged schema this worker understands
+MESSAGE_VERSION = 1
+
+
+class EmbeddingRequest:
+    def __init__(self, user_id, workout_ids=(), workout_exercise_ids=(), full_scan=False, deleted_workout_ids=()):
+        """What to embed for one user; merged across the events waiting for that user"""
+        self.user_id = user_id
+        self.workout_ids = set(workout_ids)
+        self.workout_exercise_ids = set(workout_exercise_ids)
+        # Nothing left to embed, but the aggregates they counted towards change
+        self.deleted_workout_ids = set(deleted_workout_ids)
+        # Legacy / id-less events: scan the user's unembedded rows instead
+        self.full_scan = full_scan
+    
+    def merge(self, other):
+        self.workout_ids |= other.workout_ids
+        self.workout_exercise_ids |= other.workout_exercise_ids
+        self.deleted_workout_ids |= other.deleted_workout_ids
+        self.full_scan = self.full_scan or other.full_scan
+
+
+class UserRun:
+    def __init__(self, request, partition):
+        """A user's merged request and the offsets of the messages it covers"""
+        self.request = request
+        self.partition = partition  # (topic, partition)
+        self.offsets = []
+        self.attempts = 0
+        self.not_before = 0.0  # time.monotonic() before which a failed run is not retried
+        self.future = None
+    
+    def merge(self, other):
+        self.request.merge(other.request)
+        self.offsets.extend(other.offsets)
+
 
 class EmbeddingConsumer:
     def __init__(self, broker=KAFKA_BROKER, topic=KAFKA_TOPIC, group=KAFKA_GROUP):
@@ -29,98 +115,318 @@ class EmbeddingConsumer:
             'bootstrap.servers': broker,
             'group.id': group,
             'auto.offset.reset': 'earliest',
-            'enable.auto.commit': True,
+            'enable.auto.commit': False,  # committed after embeddings are saved
         })
         
-        self.consumer.subscribe([topic])
+        self.pool = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY, thread_name_prefix="embed-user")
+        self.waiting = {}      # (partition, user_id) -> UserRun not started yet
+        self.running = {}      # user_id -> UserRun on the pool
+        self.outstanding = {}  # partition -> offsets received but not saved yet
+        self.next_offset = {}  # partition -> offset after the newest one received
+        self.committed = {}    # partition -> last committed offset
+        self.paused = False
+        
+        self.consumer.subscribe([topic], on_assign=self._on_assign, on_revoke=self._on_revoke, on_lost=self._on_lost)
         print(f"✓ Connected to Kafka broker: {broker}")
         print(f"✓ Listening on topic: {topic}")
     
     def run(self):
-        """Main loop: consume messages and process embeddings"""
+        """Main loop: receive messages, hand users to the pool, commit what is saved"""
         print("=== Embedding Worker Started ===\n")
         
         try:
             while True:
-                msg = self.consumer.poll(timeout=1.0)
-                
-                if msg is None:
-                    continue
+                busy = self.running or self.waiting
+                messages = self.consumer.consume(
+                    num_messages=WORKER_BATCH_SIZE,
+                    timeout=WORKER_TICK_SECONDS if busy else WORKER_BATCH_WINDOW_SECONDS,
+                )
                 
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        continue
-                    else:
-                        print(f"✗ Kafka error: {msg.error()}")
-                        continue
-                
-                # Process message
-                self._process_message(msg)
+                for msg in messages:
+                    self._receive(msg)
+                self._collect()
+                self._dispatch()
+                self._commit()
+                self._apply_backpressure()
         
         except KeyboardInterrupt:
             print("\n=== Embedding Worker Stopped ===")
         finally:
+            self.pool.shutdown(wait=True)
+            self._collect()
+            self._commit(asynchronous=False)
             self.consumer.close()
     
+    def _receive(self, msg):
+        """Track a message's offset and merge it into its user's waiting run"""
+        if msg.error():
+            if msg.error().code() != KafkaError._PARTITION_EOF:
+                print(f"✗ Kafka error: {msg.error()}")
+            return
+        
+        partition = (msg.topic(), msg.partition())
+        self.outstanding.setdefault(partition, set()).add(msg.offset())
+        self.next_offset[partition] = max(self.next_offset.get(partition, 0), msg.offset() + 1)
+        
+        request = self._process_message(msg)
+        if request is None:
+            metrics.WORKER_MESSAGES_SKIPPED.labels(reason="invalid").inc()
+            self._done(partition, [msg.offset()])
+            return
+        
+        run = UserRun(request, partition)
+        run.offsets.append(msg.offset())
+        key = (partition, request.user_id)
+        if key in self.waiting:
+            self.waiting[key].merge(run)
+        else:
+            self.waiting[key] = run
+    
+    def _dispatch(self):
+        """Start waiting users that are not already running, while threads are free"""
+        now = time.monotonic()
+        for key, run in list(self.waiting.items()):
+            if len(self.running) >= WORKER_CONCURRENCY:
+                return
+            user_id = key[1]
+            if user_id in self.running or run.not_before > now:
+                continue
+            
+            del self.waiting[key]
+            # Each user runs in its own context so it gets its own request id in the logs
+            run.future = self.pool.submit(contextvars.copy_context().run, self._process_user, run.request)
+            self.running[user_id] = run
+    
+    def _collect(self):
+        """Settle finished runs: mark them saved, or schedule a retry, or give up"""
+        for user_id, run in list(self.running.items()):
+            if not run.future.done():
+                continue
+            del self.running[user_id]
+            if run.partition not in self.outstanding:
+                # Partition lost while the user ran; its new owner redoes the messages
+                continue
+            
+            if run.future.result():
+                self._done(run.partition, run.offsets)
+                continue
+            
+            run.attempts += 1
+            if run.attempts >= WORKER_MAX_ATTEMPTS:
+                # Poison message: let the rest of the partition through
+                print(f"✗ Skipping {len(run.offsets)} messages for user {user_id} "
+                      f"after {run.attempts} failed attempts (offsets {sorted(run.offsets)} of {run.partition})")
+                metrics.WORKER_MESSAGES_SKIPPED.labels(reason="max_attempts").inc(len(run.offsets))
+                self._done(run.partition, run.offsets)
+                continue
+            
+            print(f"✗ Embedding failed for user {user_id} (attempt {run.attempts}/{WORKER_MAX_ATTEMPTS}), "
+                  f"retrying in {WORKER_RETRY_BACKOFF_SECONDS}s")
+            run.not_before = time.monotonic() + WORKER_RETRY_BACKOFF_SECONDS
+            key = (run.partition, user_id)
+            newer = self.waiting.pop(key, None)
+            if newer is not None:
+                run.merge(newer)
+            self.waiting[key] = run
+    
+    def _done(self, partition, offsets):
+        if partition in self.outstanding:
+            self.outstanding[partition].difference_update(offsets)
+    
+    def _commit(self, asynchronous=True):
+        """Commit every partition up to its first message that is not saved yet"""
+        offsets = []
+        for partition, outstanding in self.outstanding.items():
+            position = min(outstanding) if outstanding else self.next_offset[partition]
+            if position != self.committed.get(partition):
+                offsets.append(TopicPartition(*partition, position))
+                self.committed[partition] = position
+        
+        if not offsets:
+            return
+        with tracing.span(metrics.WORKER_STAGE_SECONDS, "commit"):
+            try:
+                self.consumer.commit(offsets=offsets, asynchronous=asynchronous)
+            except KafkaException as e:
+                # Not fatal: the messages are redelivered and re-embedded
+                print(f"✗ Offset commit failed: {e}")
+    
+    def _apply_backpressure(self):
+        """Pause fetching while too many users are waiting or running"""
+        backlog = len(self.waiting) + len(self.running)
+        if backlog >= WORKER_MAX_PENDING_USERS and not self.paused:
+            self.consumer.pause(self.consumer.assignment())
+            self.paused = True
+        elif backlog < WORKER_MAX_PENDING_USERS and self.paused:
+            # Only what is assigned now; partitions revoked meanwhile are not ours
+            self.consumer.resume(self.consumer.assignment())
+            self.paused = False
+    
+    def _on_assign(self, consumer, partitions):
+        if self.paused:
+            consumer.pause(partitions)
+    
+    def _on_revoke(self, consumer, partitions):
+        """Finish and commit the revoked partitions' runs before handing them over"""
+        revoked = {(tp.topic, tp.partition) for tp in partitions}
+        wait([run.future for run in self.running.values() if run.partition in revoked])
+        self._collect()
+        self._commit(asynchronous=False)
+        self._forget(revoked)
+    
+    def _on_lost(self, consumer, partitions):
+        """Partitions taken away without a chance to commit: drop their state"""
+        self._forget({(tp.topic, tp.partition) for tp in partitions})
+    
+    def _forget(self, partitions):
+        for key in [key for key in self.waiting if key[0] in partitions]:
+            del self.waiting[key]
+        for partition in partitions:
+            self.outstanding.pop(partition, None)
+            self.next_offset.pop(partition, None)
+            self.committed.pop(partition, None)
+    
     def _process_message(self, msg):
-        """Extract user_id from message and process embeddings"""
+        """Parse a workout-logged event into an EmbeddingRequest; None if malformed
+        
+        v1 payload:
+            {"version": 1, "user_id": 7, "workout_ids": [..],
+             "workout_exercise_ids": [..], "change": "created" | "updated" | "deleted"}
+        Legacy payload: the bare user_id, e.g. "7"
+        """
         try:
             # Parse message
             message_value = msg.value().decode('utf-8')
-            user_id = int(message_value)
+            payload = json.loads(message_value)
+            
+            # Legacy producers send only the user id
+            if isinstance(payload, int):
+                return EmbeddingRequest(payload, full_scan=True)
+            
+            if not isinstance(payload, dict):
+                raise ValueError(f"unexpected payload {message_value!r}")
             
-            print(f"\n📨 Received embedding request for user {user_id}")
+            version = payload.get("version", 1)
+            if version > MESSAGE_VERSION:
+                print(f"⚠️  Message version {version} is newer than {MESSAGE_VERSION}, reading known fields only")
             
-            # Process embeddings for this user
-            self._generate_embeddings(user_id)
+            user_id = int(payload["user_id"])
+            workout_ids = [int(i) for i in payload.get("workout_ids") or []]
+            workout_exercise_ids = [int(i) for i in payload.get("workout_exercise_ids") or []]
             
-            print(f"✓ Completed embedding generation for user {user_id}\n")
+            if payload.get("change") == "deleted":
+                # Deleted rows take their embeddings with them
+                return EmbeddingRequest(user_id, deleted_workout_ids=workout_ids)
+            
+            return EmbeddingRequest(
+                user_id,
+                workout_ids,
+                workout_exercise_ids,
+                full_scan=not workout_ids and not workout_exercise_ids,
+            )
+        
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"✗ Invalid workout-logged message: {e}")
+            return None
+    
+    def _process_user(self, request):
+        """Process embeddings for one user; returns False if it failed"""
+        user_id = request.user_id
+        tracing.set_request_id()
+        try:
+            tracing.log(f"📨 Processing embedding request for user {user_id}")
+            with tracing.span(metrics.WORKER_STAGE_SECONDS, "user"):
+                # SQL only; first, so a failing embedding call can't leave STATS stale
+                with tracing.span(metrics.WORKER_STAGE_SECONDS, "stats"):
+                    self._update_stats(request)
+                self._generate_embeddings(request)
+                with tracing.span(metrics.WORKER_STAGE_SECONDS, "summaries"):
+                    self._update_summaries(request)
+            tracing.log(f"✓ Completed embedding generation for user {user_id}\n")
+            return True
         
-        except json.JSONDecodeError as e:
-            print(f"✗ Failed to parse message: {e}")
-        except ValueError as e:
-            print(f"✗ Invalid user_id format: {e}")
         except Exception as e:
-            print(f"✗ Error processing message: {e}")
+            tracing.log(f"✗ Error processing user {user_id}: {e}")
             import traceback
             traceback.print_exc()
+            return False
     
-    def _generate_embeddings(self, user_id):
+    def _generate_embeddings(self, request):
         """Call the batched embedding pipelines for a user"""
+        user_id = request.user_id
         try:
-            # Get unembedded exercises for this user
-            exercises = exercise_embeddings.get_unembedded_exercises(user_id)
-            if exercises:
-                print(f"  📊 Processing {len(exercises)} exercises")
-                # Format exercises into text
-                formatted_exercises = exercise_embeddings.format_exercises(exercises)
-                # Generate embeddings (batched API call)
-                exercise_embeddings_result = exercise_embeddings.make_exercise_embeddings(formatted_exercises)
-                # Save to database
-                exercise_embeddings.save_exercise_embeddings(exercise_embeddings_result)
-            
-            # Get unembedded workouts for this user
-            workouts = workout_embeddings.get_unembedded_workouts(user_id)
-            if workouts:
-                print(f"  📊 Processing {len(workouts)} workouts")
-                # Format workouts into text
-                formatted_workouts = workout_embeddings.format_workouts(workouts)
-                # Generate embeddings (batched API call)
-                workout_embeddings_result = workout_embeddings.make_workout_embeddings(formatted_workouts)
-                # Save to database
-                workout_embeddings.save_workout_embeddings(workout_embeddings_result)
-            
-            if not exercises and not workouts:
-                print(f"  ℹ️  No unembedded items for user {user_id}")
+            exercise_count = 0
+            workout_count = 0
+            
+            by_ids = bool(request.workout_ids or request.workout_exercise_ids)
+            
+            with tracing.span(metrics.WORKER_STAGE_SECONDS, "exercises"):
+                if by_ids:
+                    # Re-embed exactly the changed rows by primary key, embedded or not
+                    exercise_count += exercise_embeddings.update_embeddings_by_ids(
+                        user_id, request.workout_exercise_ids, request.workout_ids
+                    )
+            
+            with tracing.span(metrics.WORKER_STAGE_SECONDS, "workouts"):
+                if by_ids:
+                    workout_count += workout_embeddings.update_embeddings_by_ids(
+                        user_id, request.workout_ids, request.workout_exercise_ids
+                    )
+            
+            # /chat embeds at most INLINE_EMBED_LIMIT rows inline, so older rows
+            # (or rows whose event was lost) are drained here once the listed
+            # ids are done
+            if request.full_scan:
+                backlog = {"exercises_pending": True, "workouts_pending": True}
+            else:
+                backlog = freshness.get_watermark_blocking(user_id)
+            
+            with tracing.span(metrics.WORKER_STAGE_SECONDS, "backlog"):
+                if backlog["exercises_pending"]:
+                    # Stream, embed and save every unembedded row for this user
+                    exercise_count += exercise_embeddings.update_embeddings(user_id)
+                if backlog["workouts_pending"]:
+                    workout_count += workout_embeddings.update_embeddings(user_id)
+            
+            if exercise_count:
+                tracing.log(f"  📊 Processed {exercise_count} exercises")
+            if workout_count:
+                tracing.log(f"  📊 Processed {workout_count} workouts")
+            
+            if not exercise_count and not workout_count:
+                tracing.log(f"  ℹ️  Nothing to embed for user {user_id}")
         
         except Exception as e:
-            print(f"  ✗ Error generating embeddings: {e}")
+            tracing.log(f"  ✗ Error generating embeddings: {e}")
             raise
+    
+    def _update_stats(self, request):
+        """Refresh the user's aggregates for the workouts this request touched"""
+        if request.full_scan:
+            # No ids to go by: recompute the user's whole history
+            user_stats.rebuild(request.user_id)
+            return
+        
+        workout_ids = request.workout_ids | request.deleted_workout_ids
+        if workout_ids or request.workout_exercise_ids:
+            user_stats.update_workouts(request.user_id, workout_ids, request.workout_exercise_ids)
+    
+    def _update_summaries(self, request):
+        """Re-embed the weekly/monthly summaries holding the workouts this request touched"""
+        if request.full_scan:
+            summary_embeddings.rebuild_summaries(request.user_id)
+            return
+        
+        workout_ids = request.workout_ids | request.deleted_workout_ids
+        if workout_ids or request.workout_exercise_ids:
+            summary_embeddings.update_summaries(request.user_id, workout_ids, request.workout_exercise_ids)
 
 
 def main():
     """Entry point for the embedding worker"""
     try:
+        start_http_server(WORKER_METRICS_PORT)
+        print(f"✓ Metrics exporter listening on port {WORKER_METRICS_PORT}")
         consumer = EmbeddingConsumer()
         consumer.run()
     except Exception as e:
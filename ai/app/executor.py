@@ -0,0 +1,27 @@
+"""
+Bounded thread pool for work that stays synchronous.
+
+The embedding pipelines are shared with embedding_worker and remain blocking,
+so the async /chat path hands them to this pool instead of running them on the
+event loop (or on asyncio's unbounded-by-default to_thread executor).
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SYNC_POOL_SIZE = int(os.getenv("SYNC_POOL_SIZE", "8"))
+
+_pool = ThreadPoolExecutor(max_workers=SYNC_POOL_SIZE, thread_name_prefix="ai-sync")
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run a blocking callable on the bounded pool and await its result.
+
+    The caller's contextvars (e.g. the request id) are visible inside ``func``.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_pool, functools.partial(context.run, func, *args, **kwargs))
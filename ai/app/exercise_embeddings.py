@@ -1,14 +1,61 @@
+from itertools import groupby
 from sqlmodel import Session, SQLModel, text
 from . import db
+from . import embedding_batcher
+from . import metrics
+from . import vector_cache
 from langchain_mistralai import MistralAIEmbeddings
 
 embeddings = MistralAIEmbeddings(
     model="mistral-embed",
 )
 
-def get_unembedded_exercises(id: int):
+def get_unembedded_exercises(id: int, limit: int | None = None):
+    """Stream a user's unembedded workout exercises, one dict at a time.
+
+    When ``limit`` is given only the ``limit`` newest rows (by id) are returned,
+    which keeps the inline refresh on the /chat path bounded.
+    """
+    newest_filter = ""
+    params = {"user_id": id}
+    if limit is not None:
+        newest_filter = """AND we.id IN (
+                                                SELECT we2.id
+                                                FROM workout_exercises we2
+                                                JOIN workouts w2 ON we2.workout_id = w2.id
+                                                WHERE we2.embeddings IS NULL
+                                                AND w2.user_id = :user_id
+                                                ORDER BY we2.id DESC
+                                                LIMIT :limit)"""
+        params["limit"] = limit
+
+    yield from _stream_exercises(f"""we.embeddings IS NULL
+                                            AND w.user_id = :user_id
+                                            {newest_filter}""", params)
+
+
+def _stream_exercises(where: str, params: dict):
+    """Fetch the matching exercises a page at a time and group them.
+
+    Only the ids are read up front. Each page of db.STREAM_PAGE_SIZE exercises
+    is then fetched and its session closed before anything is yielded, so a
+    slow embedding call never holds a cursor (and a second pooled connection)
+    open. Memory stays bounded by one page no matter how long the history is.
+    """
+    with db.get_session() as session:
+        ids = session.execute(text(f"""SELECT we.id
+                                            FROM workout_exercises we
+                                            JOIN workouts w ON we.workout_id = w.id
+                                            WHERE {where}
+                                            ORDER BY we.id"""), params).scalars().all()
+
+    for start in range(0, len(ids), db.STREAM_PAGE_SIZE):
+        yield from _fetch_exercises(ids[start:start + db.STREAM_PAGE_SIZE])
+
+
+def _fetch_exercises(workout_exercise_ids: list[int]):
     with db.get_session() as session:
-        result = session.execute(text("""SELECT
+        rows = session.execute(text("""SELECT
                                                 we.id AS workout_exercise_id,
                                                 e.name AS exercise_name,
                                                 we.note,
@@ -25,38 +72,37 @@ def get_unembedded_exercises(id: int):
                                             LEFT JOIN entries en ON we.id = en.workout_exercise_id
                                             LEFT JOIN entry_metrics em ON en.id = em.entry_id
                                             LEFT JOIN metric_definitions md ON em.metric_id = md.id
-                                            WHERE we.embeddings IS NULL
-                                            AND w.user_id = :user_id
-                                            ORDER BY we.id, en.entry_index;"""), {"user_id": id})
-        rows = result.fetchall()
-
-    workouts = {}
-    for row in rows:
-        we_id = row.workout_exercise_id
-        if we_id not in workouts:
-            workouts[we_id] = {
-                'workout_exercise_id': we_id,
-                'exercise_name': row.exercise_name,
-                'note': row.note,
-                'workout_date': row.workout_date,
-                'entries': {}
-            }
-        
-        if row.entry_id and row.entry_id not in workouts[we_id]['entries']:
-            workouts[we_id]['entries'][row.entry_id] = {
-                'entry_index': row.entry_index,
-                'metrics': []
-            }
-        
-        if row.metric_key:
-            workouts[we_id]['entries'][row.entry_id]['metrics'].append({
-                'key': row.metric_key,
-                'value_number': row.value_number,
-                'value_text': row.value_text,
-                'unit': row.unit
-            })
-    
-    return list(workouts.values())
+                                            WHERE we.id = ANY(:workout_exercise_ids)
+                                            ORDER BY we.id, en.entry_index;"""),
+                               {"workout_exercise_ids": workout_exercise_ids}).fetchall()
+
+    for we_id, exercise_rows in groupby(rows, key=lambda row: row.workout_exercise_id):
+        exercise = None
+        for row in exercise_rows:
+            if exercise is None:
+                exercise = {
+                    'workout_exercise_id': we_id,
+                    'exercise_name': row.exercise_name,
+                    'note': row.note,
+                    'workout_date': row.workout_date,
+                    'entries': {}
+                }
+
+            if row.entry_id and row.entry_id not in exercise['entries']:
+                exercise['entries'][row.entry_id] = {
+                    'entry_index': row.entry_index,
+                    'metrics': []
+                }
+
+            if row.metric_key:
+                exercise['entries'][row.entry_id]['metrics'].append({
+                    'key': row.metric_key,
+                    'value_number': row.value_number,
+                    'value_text': row.value_text,
+                    'unit': row.unit
+                })
+
+        yield exercise
 
 
 def print_exercises(exercises):
@@ -80,45 +126,37 @@ def print_exercises(exercises):
 
 # (int, str) list
 def format_exercises(exercises):
-    embeddings = []
-    
-    for exercise in exercises:
-        # Build the embedding text
-        embedding_lines = [f"On {exercise['workout_date']} performed {exercise['exercise_name']}"]
-        
-        if exercise['note'] is not None:
-            embedding_lines.append(f"Note: {exercise['note']}")
-        
-        for entry in sorted(exercise['entries'].values(), key=lambda e: e['entry_index']):
-            metrics_str = ", ".join([
-                f"{metric['key']} {metric['value_number']}{' ' + metric['unit'] if metric['unit'] else ''}"
-                for metric in entry['metrics']
-            ])
-            embedding_lines.append(f"  {metrics_str}")
-        
-        # Combine lines into single string
-        embedding_text = "\n".join(embedding_lines)
-        
-        # Add tuple of (workout_exercise_id, embedding_text)
-        embeddings.append((exercise['workout_exercise_id'], embedding_text))
-    
-    return embeddings
+    return [format_exercise(exercise) for exercise in exercises]
 
-def make_exercise_embeddings(formatted_exercises):
-    # Extract texts from (workout_exercise_id, embedding_text) tuples
-    texts = [embedding_text for _, embedding_text in formatted_exercises]
+
+# (int, str)
+def format_exercise(exercise):
+    # Build the embedding text
+    embedding_lines = [f"On {exercise['workout_date']} performed {exercise['exercise_name']}"]
+    
+    if exercise['note'] is not None:
+        embedding_lines.append(f"Note: {exercise['note']}")
     
-    # Get embeddings from LangChain
-    vectors = embeddings.embed_documents(texts)
+    for entry in sorted(exercise['entries'].values(), key=lambda e: e['entry_index']):
+        metrics_str = ", ".join([
+            f"{metric['key']} {metric['value_number']}{' ' + metric['unit'] if metric['unit'] else ''}"
+            for metric in entry['metrics']
+        ])
+        embedding_lines.append(f"  {metrics_str}")
     
-    # Combine vectors with original IDs and texts
-    results = [
-        (vector, workout_exercise_id, embedding_text)
-        for vector, (workout_exercise_id, embedding_text) in zip(vectors, formatted_exercises)
-    ]
+    # Combine lines into single string
+    embedding_text = "\n".join(embedding_lines)
     
-    #print(results[0])
-    return results
+    # Tuple of (workout_exercise_id, embedding_text)
+    return (exercise['workout_exercise_id'], embedding_text)
+
+def make_exercise_embeddings(formatted_exercises):
+    """Embed (workout_exercise_id, embedding_text) tuples batch by batch.
+
+    Yields lists of (vector, workout_exercise_id, embedding_text) as each batch finishes,
+    so callers can save progress incrementally.
+    """
+    yield from embedding_batcher.embed_batches(embeddings, formatted_exercises)
 
 
 def save_exercise_embeddings(exercise_embeddings):
@@ -126,73 +164,91 @@ def save_exercise_embeddings(exercise_embeddings):
     
     Args:
         exercise_embeddings: List of tuples (vector, workout_exercise_id, embedding_text)
-                           where vector is a list of floats
+                           where vector is a float32 NumPy array
     """
     if not exercise_embeddings:
         print("No embeddings to save")
         return
     
-    # Build CASE statements for both embeddings and text
-    embedding_cases = []
-    text_cases = []
-    params = {}
-    
-    for idx, (vector, workout_exercise_id, embedding_text) in enumerate(exercise_embeddings):
-        # Convert vector list to string format for pgvector
-        vector_str = "[" + ",".join(str(v) for v in vector) + "]"
-        vector_key = f"vector_{idx}"
-        text_key = f"text_{idx}"
-        params[vector_key] = vector_str
-        params[text_key] = embedding_text
-        params[f"id_{idx}"] = workout_exercise_id
-        
-        embedding_cases.append(f"WHEN :id_{idx} THEN :{vector_key}")
-        text_cases.append(f"WHEN :id_{idx} THEN :{text_key}")
-    
-    # Build the batch update query
-    ids = [id for _, id, _ in exercise_embeddings]
-    params["ids"] = ids
-    
-    query = f"""UPDATE workout_exercises 
-                SET embeddings = CASE id
-                    {' '.join(embedding_cases)}
-                    ELSE embeddings
-                END,
-                exercise_text = CASE id
-                    {' '.join(text_cases)}
-                    ELSE exercise_text
-                END
-                WHERE id = ANY(:ids)"""
-    
+    # One parameter set per row, sent with executemany in fixed-size chunks;
+    # the statement stays constant no matter how many rows are saved
+    query = """UPDATE workout_exercises
+               SET embeddings = CAST(:embedding AS vector),
+                   exercise_text = :text
+               WHERE id = :id"""
+
+    saved = 0
     try:
         with db.get_session() as session:
-            result = session.execute(text(query), params)
-            session.commit()
-            print(f"Successfully saved {result.rowcount} embeddings")
+            for start in range(0, len(exercise_embeddings), db.BULK_WRITE_CHUNK_SIZE):
+                chunk = exercise_embeddings[start:start + db.BULK_WRITE_CHUNK_SIZE]
+                params = [
+                    {
+                        "embedding": vector,
+                        "text": embedding_text,
+                        "id": workout_exercise_id,
+                    }
+                    for vector, workout_exercise_id, embedding_text in chunk
+                ]
+                session.execute(text(query), params)
+                session.commit()
+                saved += len(chunk)
+            print(f"Successfully saved {saved} embeddings")
     except Exception as e:
-        print(f"Error saving embeddings: {e}")
+        print(f"Error saving embeddings after {saved} rows: {e}")
         raise
 
 
 
-def update_embeddings(id:int) -> None:
+def update_embeddings(id:int, limit: int | None = None) -> int:
+    """Embed a user's unembedded exercises end to end; returns rows saved.
 
+    Pages stream from the database through formatting and batched embedding into
+    the save step, so only a few batches are ever held in memory.
+    """
     print("updating embeddings")
-    exercises = get_unembedded_exercises(id)
+    saved = _embed_and_save(id, get_unembedded_exercises(id, limit))
 
-    print("formatting exercises")
-    formatted_exercises = format_exercises(exercises)
+    if not saved:
+        print("No unembedded exercises")
+    return saved
 
-    print("making embeddings")
-    exercise_embeddings = make_exercise_embeddings(formatted_exercises)
 
-    print("saving embeddings")
-    save_exercise_embeddings(exercise_embeddings)
+def update_embeddings_by_ids(id: int, workout_exercise_ids=(), workout_ids=()) -> int:
+    """Re-embed specific exercises (and every exercise of the given workouts).
 
+    Used for change events: rows are fetched by primary key whether or not
+    they already have embeddings, so edits are picked up without scanning
+    the user's history. Returns rows saved.
+    """
+    if not workout_exercise_ids and not workout_ids:
+        return 0
 
+    exercises = get_exercises_by_ids(id, workout_exercise_ids, workout_ids)
+    return _embed_and_save(id, exercises)
 
 
-    
+def get_exercises_by_ids(id: int, workout_exercise_ids=(), workout_ids=()):
+    """Stream the given workout exercises of a user, embedded or not."""
+    yield from _stream_exercises("""w.user_id = :user_id
+                                            AND (we.id = ANY(:workout_exercise_ids)
+                                                 OR we.workout_id = ANY(:workout_ids))""", {
+        "user_id": id,
+        "workout_exercise_ids": list(workout_exercise_ids),
+        "workout_ids": list(workout_ids),
+    })
 
 
-    
+def _embed_and_save(id: int, exercises) -> int:
+    formatted_exercises = (format_exercise(exercise) for exercise in exercises)
+
+    saved = 0
+    for batch in make_exercise_embeddings(formatted_exercises):
+        save_exercise_embeddings(batch)
+        saved += len(batch)
+        metrics.ROWS_EMBEDDED.labels(kind="exercise").inc(len(batch))
+
+    # No process's hot-user retrieval tier may serve the old vectors
+    if saved:
+        vector_cache.cache.invalidate(id, "exercise", notify=True)
+    return saved
@@ -0,0 +1,212 @@
+"""
+Local fast path for the guardrail and routing classifiers.
+
+Each label has a handful of example prompts. Their embeddings are averaged
+into one unit-length centroid per label (computed once per process, on first
+use), and a query vector is scored against every centroid with a single
+matrix-vector product.
+
+The fast path never delays the LLM: the ministral-3b call is started first
+and the local label only replaces it when the query vector is ready before the
+LLM answers and the best label beats the runner-up by at least
+FAST_CLASSIFIER_THRESHOLD (cosine similarity). The LLM call is then
+cancelled. Off by default (FAST_CLASSIFIER_ENABLED).
+
+Tune the threshold with the offline harness: python -m app.classifier_eval
+"""
+
+import asyncio
+import os
+import numpy as np
+from . import metrics
+from . import rag
+from . import tracing
+
+FAST_CLASSIFIER_ENABLED = os.getenv("FAST_CLASSIFIER_ENABLED", "false").lower() == "true"
+# Minimum margin between the best and second-best centroid similarity
+FAST_CLASSIFIER_THRESHOLD = float(os.getenv("FAST_CLASSIFIER_THRESHOLD", "0.05"))
+
+
+GUARDRAIL_EXAMPLES = {
+    "FITNESS_OK": [
+        "what did I bench last week",
+        "how many sets of squats did I do on monday",
+        "make me a push pull legs plan",
+        "how can I increase my deadlift",
+        "was my last workout harder than the one before",
+        "how much protein should I eat to build muscle",
+        "what muscles do lunges work",
+        "how long should I rest between sets",
+    ],
+    "MEDICAL_ADVICE": [
+        "my knee hurts when I squat, what is wrong with it",
+        "should I take ibuprofen before lifting",
+        "I think I tore my rotator cuff, how do I treat it",
+        "is this chest pain during cardio dangerous",
+        "can I work out with a herniated disc",
+        "what medication helps with muscle cramps",
+        "do I have tendonitis in my elbow",
+        "my back has been numb since deadlifting, is it nerve damage",
+    ],
+    "NON_FITNESS": [
+        "write me a python script to sort a list",
+        "what is the capital of france",
+        "write a poem about the ocean",
+        "explain how the stock market works",
+        "translate this sentence into spanish",
+        "who won the world cup in 2018",
+        "help me write a cover letter",
+        "what is the weather tomorrow",
+    ],
+}
+
+ROUTE_EXAMPLES = {
+    "EXERCISES": [
+        "what did I bench last week",
+        "how much weight did I curl on friday",
+        "show my squat sets from yesterday",
+        "what weight did I use for rows on my last pull day",
+        "how many reps of pull ups did I do last time",
+        "when did I last do leg press",
+        "how has my overhead press weight changed",
+        "which exercises have I done for biceps",
+    ],
+    "WORKOUTS": [
+        "summarize my last workout",
+        "what did I do at the gym on saturday",
+        "what did I do in my last leg day",
+        "how long was my workout on tuesday",
+        "compare my last two gym sessions",
+        "what kind of workouts did I do last week",
+        "how did my workout this morning go",
+        "show my rowing sessions",
+    ],
+    "BOTH": [
+        "how did my bench press fit into my push days this month",
+        "which workouts had my heaviest squats",
+        "look at my sessions and exercises and tell me what to improve",
+        "what exercises do I usually do in my upper body workouts",
+        "review my training history and my best lifts",
+        "in which sessions did I do deadlifts and how heavy",
+    ],
+    "STATS": [
+        "what is my best deadlift",
+        "what is my bench press PR",
+        "how many times did I go to the gym this month",
+        "how consistent have my workouts been",
+        "how much total volume did I lift per week lately",
+        "how many sessions have I done this year",
+        "what is my estimated one rep max on squat",
+        "how many sets of curls have I done in total",
+    ],
+    "NEITHER": [
+        "how long should I rest between sets",
+        "what is progressive overload",
+        "how much protein should I eat",
+        "what muscles do lunges work",
+        "is it better to do cardio before or after weights",
+        "how do I do a proper push up",
+        "what is a good beginner routine",
+        "how much sleep do I need for recovery",
+    ],
+}
+
+
+class CentroidClassifier:
+    def __init__(self, name: str, examples: dict[str, list[str]], threshold: float = FAST_CLASSIFIER_THRESHOLD):
+        """Nearest-centroid classifier over prompt embeddings."""
+        self.name = name
+        self.examples = examples
+        self.threshold = threshold
+        self.labels = list(examples)
+        self.centroids = None  # (labels, dim) float32, unit rows
+        self._lock = asyncio.Lock()
+        self._loading = None
+
+    async def load(self) -> None:
+        """Embed the examples and build the centroid matrix (once)."""
+        if self.centroids is not None:
+            return
+        async with self._lock:
+            if self.centroids is not None:
+                return
+            texts = [example for label in self.labels for example in self.examples[label]]
+            vectors = _normalize(np.asarray(await rag.embeddings.aembed_documents(texts), dtype=np.float32))
+
+            centroids = []
+            start = 0
+            for label in self.labels:
+                count = len(self.examples[label])
+                centroids.append(vectors[start:start + count].mean(axis=0))
+                start += count
+            self.centroids = _normalize(np.stack(centroids))
+
+    def scores(self, query_vectors: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each query (rows) to each label centroid (columns)."""
+        return _normalize(np.atleast_2d(query_vectors).astype(np.float32)) @ self.centroids.T
+
+    def predict(self, query_vector: np.ndarray, threshold: float | None = None) -> tuple[str, float, bool]:
+        """Return (label, confidence, confident) for one query vector.
+
+        Confidence is the margin between the best and second-best centroid.
+        """
+        scores = self.scores(query_vector)[0]
+        best, runner_up = np.argsort(scores)[::-1][:2]
+        confidence = float(scores[best] - scores[runner_up])
+        threshold = self.threshold if threshold is None else threshold
+        return self.labels[best], confidence, confidence >= threshold
+
+    def classify(self, query_vector: np.ndarray | None) -> str | None:
+        """Label for a confident prediction, or None (no vector or centroids yet)."""
+        if query_vector is None or self.centroids is None:
+            return None
+        label, confidence, confident = self.predict(query_vector)
+        if not confident:
+            return None
+        tracing.log(f"[fast_classifier] {self.name}: {label} (margin {confidence:.3f})")
+        return label
+
+    async def decide(self, vector_task: asyncio.Task | None, llm_task: asyncio.Task, accept=None) -> str:
+        """Result of the already running llm_task, or a local label if one is ready first.
+
+        The local label is used (and llm_task cancelled) only when vector_task
+        finishes before llm_task, the prediction is confident and ``accept``
+        (if given) allows the label. Otherwise this is ``await llm_task``.
+        """
+        if not FAST_CLASSIFIER_ENABLED or vector_task is None:
+            return await llm_task
+        self._warm()
+        try:
+            await asyncio.wait({vector_task, llm_task}, return_when=asyncio.FIRST_COMPLETED)
+            if not llm_task.done() and not vector_task.cancelled() and vector_task.exception() is None:
+                label = self.classify(vector_task.result())
+                if label is not None and (accept is None or accept(label)):
+                    llm_task.cancel()
+                    metrics.FAST_CLASSIFIER_DECISIONS.labels(classifier=self.name, outcome="local").inc()
+                    return label
+            result = await llm_task
+        except asyncio.CancelledError:
+            llm_task.cancel()
+            raise
+        metrics.FAST_CLASSIFIER_DECISIONS.labels(classifier=self.name, outcome="llm").inc()
+        return result
+
+    def _warm(self) -> None:
+        """Build the centroids in the background; requests skip the fast path until then."""
+        if self.centroids is None and (self._loading is None or self._loading.done()):
+            self._loading = asyncio.create_task(self._load_quietly())
+
+    async def _load_quietly(self) -> None:
+        try:
+            await self.load()
+        except Exception as e:
+            tracing.log(f"[fast_classifier] {self.name}: could not build centroids: {e}")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+guardrail = CentroidClassifier("guardrail", GUARDRAIL_EXAMPLES)
+router = CentroidClassifier("router", ROUTE_EXAMPLES)
@@ -0,0 +1,100 @@
+"""
+Freshness-aware embedding refresh for the /chat path.
+
+Instead of embedding a user's whole backlog before every answer, /chat:
+1. Reads a cheap per-user watermark (pending row counts)
+2. Embeds only the newest few rows inline, under a latency budget
+3. Leaves everything else to embedding_worker, which is fed by Kafka and
+   drains a user's remaining backlog (this watermark) after every event
+
+Set EMBEDDING_REFRESH_MODE=full to restore the old embed-everything behaviour.
+"""
+
+import asyncio
+import os
+from sqlmodel import text
+from . import db
+from . import executor
+from . import tracing
+from . import exercise_embeddings
+from . import workout_embeddings
+
+EMBEDDING_REFRESH_MODE = os.getenv("EMBEDDING_REFRESH_MODE", "freshness")  # "freshness" or "full"
+INLINE_EMBED_LIMIT = int(os.getenv("INLINE_EMBED_LIMIT", "5"))
+INLINE_EMBED_BUDGET_SECONDS = float(os.getenv("INLINE_EMBED_BUDGET_SECONDS", "1.5"))
+
+
+# Rows still waiting for embeddings; read by /chat and by embedding_worker
+WATERMARK_SQL = """
+    SELECT
+        (SELECT COUNT(*)
+         FROM workout_exercises we
+         WHERE we.embeddings IS NULL AND we.user_id = :user_id) AS exercises_pending,
+        (SELECT COUNT(*)
+         FROM workouts w
+         WHERE w.embeddings IS NULL AND w.user_id = :user_id) AS workouts_pending
+"""
+
+
+async def get_watermark(user_id: int) -> dict:
+    """Return how many exercise and workout rows are still waiting for embeddings."""
+    async with db.get_async_session() as session:
+        row = (await session.execute(text(WATERMARK_SQL), {"user_id": user_id})).one()
+    return _watermark(row)
+
+
+def get_watermark_blocking(user_id: int) -> dict:
+    """get_watermark for the sync pipelines (embedding_worker)."""
+    with db.get_session() as session:
+        row = session.execute(text(WATERMARK_SQL), {"user_id": user_id}).one()
+    return _watermark(row)
+
+
+def _watermark(row) -> dict:
+    return {
+        "exercises_pending": row.exercises_pending,
+        "workouts_pending": row.workouts_pending,
+    }
+
+
+async def refresh_embeddings(user_id: int) -> None:
+    """Bring a user's embeddings up to date enough to answer a question.
+
+    Inline work that overruns the budget keeps running in the background and
+    saves when done; retrieval simply proceeds with what is already embedded.
+    """
+    if EMBEDDING_REFRESH_MODE == "full":
+        await executor.run_sync(exercise_embeddings.update_embeddings, user_id)
+        await executor.run_sync(workout_embeddings.update_embeddings, user_id)
+        return
+
+    watermark = await get_watermark(user_id)
+    tracing.log(f"[freshness] user {user_id} watermark: {watermark}")
+
+    tasks = []
+    if watermark["exercises_pending"]:
+        tasks.append(asyncio.create_task(executor.run_sync(
+            exercise_embeddings.update_embeddings, user_id, INLINE_EMBED_LIMIT
+        )))
+    if watermark["workouts_pending"]:
+        tasks.append(asyncio.create_task(executor.run_sync(
+            workout_embeddings.update_embeddings, user_id, INLINE_EMBED_LIMIT
+        )))
+
+    if not tasks:
+        return
+
+    done, pending = await asyncio.wait(tasks, timeout=INLINE_EMBED_BUDGET_SECONDS)
+    for task in done:
+        if task.exception():
+            tracing.log(f"[freshness] inline embedding failed: {task.exception()}")
+    if pending:
+        tracing.log(f"[freshness] budget of {INLINE_EMBED_BUDGET_SECONDS}s exceeded, "
+              f"{len(pending)} refresh step(s) continue in the background")
+        for task in pending:
+            task.add_done_callback(_log_background_failure)
+
+
+def _log_background_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception():
+        tracing.log(f"[freshness] background embedding failed: {task.exception()}")
@@ -2,22 +2,38 @@ import os
 from dotenv import load_dotenv
 from langchain_mistralai import ChatMistralAI
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import make_asgi_app
 import asyncio
+import json
+import time
+from . import agent_tasks
 from . import db
-from . import exercise_embeddings
-from . import workout_embeddings
+from . import fast_classifier
+from . import freshness
+from . import metrics
+from . import progress
 from . import rag
+from . import tracing
 from . import answerBot
 from . import rag_director
 from . import question_guardrail
 
 app = FastAPI()
 
+# Prometheus metrics (embedding cache hit rate, ...)
+app.mount("/metrics", make_asgi_app())
+
+# Run guardrail, routing and query embedding concurrently instead of in sequence
+SPECULATIVE_PIPELINE = os.getenv("SPECULATIVE_PIPELINE", "true").lower() == "true"
+
+# Stream answer tokens to /progress as AI_delta events before the final AI_message
+STREAM_ANSWER = os.getenv("STREAM_ANSWER", "true").lower() == "true"
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "24"))
+STREAM_FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", "0.05"))
+
 # ----------------------------
-# Per-user event storage
-# user_events[user_id] = list of progress messages for that user
-user_events = {}
+# Per-user progress events are published to progress.bus and streamed by /progress
 # ----------------------------
 
 # ----------------------------
@@ -31,63 +47,144 @@ user_events = {}
 #   }
 # ----------------------------
 
+def _cancel_tasks(*tasks):
+    """Cancel speculative work that is no longer needed."""
+    for task in tasks:
+        if task is not None and not task.done():
+            task.cancel()
+
+
+async def _query_vector(vector_task):
+    """Speculatively embedded query vector, or None if it isn't available."""
+    if vector_task is None:
+        return None
+    try:
+        return await vector_task
+    except Exception as e:
+        tracing.log(f"[agent_task] query embedding failed, retrieval embeds the prompt again: {e}")
+        return None
+
+
+async def _embed_query(prompt: str):
+    with tracing.span(metrics.AGENT_STAGE_SECONDS, "embed_query"):
+        return await rag.embed_prompt(prompt)
+
+
+async def _route(prompt: str, context: list, vector_task):
+    with tracing.span(metrics.AGENT_STAGE_SECONDS, "route"):
+        return await rag_director.get_rag_direction(prompt, context, vector_task)
+
+
+async def stream_answer(user_id: str, messages: list) -> str:
+    """Forward answer tokens as "AI_delta: <json string>" events; return the full text.
+
+    Deltas are coalesced (STREAM_FLUSH_CHARS / STREAM_FLUSH_SECONDS) so a
+    shared progress backend isn't written once per token. Clients that don't
+    understand deltas ignore them and use the final AI_message.
+    """
+    parts = []
+    pending = ""
+    last_flush = time.monotonic()
+    async for delta in answerBot.stream_chat(messages):
+        parts.append(delta)
+        pending += delta
+        now = time.monotonic()
+        if len(pending) >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_SECONDS:
+            await progress.bus.publish(user_id, f"AI_delta: {json.dumps(pending)}")
+            pending = ""
+            last_flush = now
+    if pending:
+        await progress.bus.publish(user_id, f"AI_delta: {json.dumps(pending)}")
+    return "".join(parts)
+
+
 async def agent_task(user_id: str, prompt: str = "", context: list = []):
-    """Simulated agent task: appends progress updates to user_events[user_id]."""
+    """Agent pipeline: publishes progress updates for user_id to the progress bus.
+
+    Every step is awaited (LLM/embedding clients via their async APIs, the DB via
+    the async engine, the sync embedding pipelines via the bounded executor), so
+    one slow Mistral call never stalls other users' /chat or /progress streams.
+    Each stage is timed into the agent_stage_seconds histogram.
+    """
+    with tracing.span(metrics.AGENT_STAGE_SECONDS, "total"):
+        await _agent_pipeline(user_id, prompt, context)
+
+
+async def _agent_pipeline(user_id: str, prompt: str, context: list):
+    route_task = None
+    vector_task = None
     try:
+        #speculatively start routing and query embedding alongside the guardrail;
+        #both only depend on the prompt and are discarded if the guardrail rejects.
+        #the query vector also feeds the local fast-path classifiers, which only
+        #use it if it arrives before the LLM classifier answers
+        if SPECULATIVE_PIPELINE or fast_classifier.FAST_CLASSIFIER_ENABLED:
+            vector_task = asyncio.create_task(_embed_query(prompt))
+        if SPECULATIVE_PIPELINE:
+            route_task = asyncio.create_task(_route(prompt, context, vector_task))
+
         #check if question is inside guardrails
-        user_events[user_id].append(f"System_message: Running guardrail check")
-        guardrail_status = question_guardrail.check_guardrails(prompt, context)
+        await progress.bus.publish(user_id, f"System_message: Running guardrail check")
+        with tracing.span(metrics.AGENT_STAGE_SECONDS, "guardrail"):
+            guardrail_status = await question_guardrail.check_guardrails(prompt, context, vector_task)
         if guardrail_status == "MEDICAL_ADVICE":
-            user_events[user_id].append(question_guardrail.MEDICAL_RESPONSE)
-            user_events[user_id].append("Finished!")
+            _cancel_tasks(route_task, vector_task)
+            await progress.bus.publish(user_id, question_guardrail.MEDICAL_RESPONSE)
+            await progress.bus.publish(user_id, "Finished!")
             return
         if guardrail_status == "NON_FITNESS":
-            user_events[user_id].append(question_guardrail.NON_FITNESS_RESPONSE)
-            user_events[user_id].append("Finished!")
+            _cancel_tasks(route_task, vector_task)
+            await progress.bus.publish(user_id, question_guardrail.NON_FITNESS_RESPONSE)
+            await progress.bus.publish(user_id, "Finished!")
             return
 
-        await asyncio.sleep(0.1)
-
         #update embeddings
-        user_events[user_id].append(f"System_message: Creating embeddings")
-        exercise_embeddings.update_embeddings(int(user_id))
-        workout_embeddings.update_embeddings(int(user_id))
+        await progress.bus.publish(user_id, f"System_message: Creating embeddings")
+        with tracing.span(metrics.AGENT_STAGE_SECONDS, "refresh_embeddings"):
+            await freshness.refresh_embeddings(int(user_id))
 
-        await asyncio.sleep(0.1)
         #identify relevant data
-        user_events[user_id].append(f"System_message: Identifying relevant data")
-        route = rag_director.get_rag_direction(prompt, context)
-
+        await progress.bus.publish(user_id, f"System_message: Identifying relevant data")
+        if route_task is not None:
+            route = await route_task
+        else:
+            route = await _route(prompt, context, vector_task)
 
-        await asyncio.sleep(0.1)
         #perform RAG retrieval
-        user_events[user_id].append(f"System_message: Retrieving relevant data")
-        prompt = rag.get_data(prompt, int(user_id), route)
-
-        await asyncio.sleep(0.1)
+        await progress.bus.publish(user_id, f"System_message: Retrieving relevant data")
+        query_vector = await _query_vector(vector_task)
+        with tracing.span(metrics.AGENT_STAGE_SECONDS, "retrieval"):
+            prompt = await rag.get_data(prompt, int(user_id), route, query_vector)
 
         #print(f"[agent_task] Starting for user {user_id}, prompt: {prompt}")
-        user_events[user_id].append("System_message: Answering your question...")
+        await progress.bus.publish(user_id, "System_message: Answering your question...")
 
-        await asyncio.sleep(0.1)
-        
         #print(f"[agent_task] Calling answerBot.chat with context length: {len(context)}")
-        ai_msg = answerBot.chat(context + [("human", prompt)])
+        with tracing.span(metrics.AGENT_STAGE_SECONDS, "answer"):
+            if STREAM_ANSWER:
+                ai_msg = await stream_answer(user_id, context + [("human", prompt)])
+            else:
+                ai_msg = await answerBot.chat(context + [("human", prompt)])
         #print(f"[agent_task] Got response: {ai_msg[:100] if ai_msg else 'EMPTY'}")
 
         if ai_msg:
-            user_events[user_id].append(f"AI_message: {ai_msg}")
+            await progress.bus.publish(user_id, f"AI_message: {ai_msg}")
         else:
-            print(f"[agent_task] WARNING: ai_msg is empty!")
-            user_events[user_id].append("AI_message: (No response from AI)")
+            tracing.log(f"[agent_task] WARNING: ai_msg is empty!")
+            await progress.bus.publish(user_id, "AI_message: (No response from AI)")
         
-        user_events[user_id].append("Finished!")
+        await progress.bus.publish(user_id, "Finished!")
+    except asyncio.CancelledError:
+        # Superseded by a newer /chat from the same user
+        _cancel_tasks(route_task, vector_task)
+        raise
     except Exception as e:
-        print(f"[agent_task] ERROR: {type(e).__name__}: {e}")
+        _cancel_tasks(route_task, vector_task)
+        tracing.log(f"[agent_task] ERROR: {type(e).__name__}: {e}")
         import traceback
         traceback.print_exc()
-        user_events[user_id].append(f"AI_message: Error: {str(e)}")
-        user_events[user_id].append("Finished!")
+        await progress.bus.publish(user_id, f"AI_message: Error: {str(e)}")
+        await progress.bus.publish(user_id, "Finished!")
 
 @app.post("/chat")
 async def start_agent(request: Request):
@@ -101,28 +198,43 @@ async def start_agent(request: Request):
     prompt = data.get("prompt", "")
     context = data.get("context", [])
 
-    # Clear any previous events for this user
-    user_events[user_id] = []
+    # Refuse new work when the queue is full instead of piling up pipelines
+    if agent_tasks.registry.is_saturated(user_id):
+        metrics.AGENT_TASKS_REJECTED.inc()
+        return JSONResponse(
+            {"error": "Too many chats in progress, try again shortly"},
+            status_code=429,
+            headers={"Retry-After": str(agent_tasks.AGENT_RETRY_AFTER_SECONDS)},
+        )
+
+    # Cancel any pipeline still running for this user, then start a new run;
+    # /progress streams from here
+    agent_tasks.registry.cancel(user_id)
+    await progress.bus.start_run(user_id)
+
+    # Tag the run's logs; the agent task inherits this context
+    request_id = tracing.set_request_id(request.headers.get("x-request-id"))
+    tracing.log(f"[chat] user {user_id}")
 
     # Launch agent task asynchronously
-    asyncio.create_task(agent_task(user_id, prompt, context))
+    agent_tasks.registry.start(user_id, agent_task(user_id, prompt, context))
 
-    return {"status": f"Agent started for user {user_id}"}
+    return JSONResponse(
+        {"status": f"Agent started for user {user_id}", "request_id": request_id},
+        headers={"X-Request-ID": request_id},
+    )
 
-async def event_generator(user_id: str):
-    """Yield events for the given user as SSE, then stop after 'Finished!'."""
-    last_index = 0
-    while True:
-        events = user_events.get(user_id, [])
-        if last_index < len(events):
-            for e in events[last_index:]:
-                yield f"data: {e}\n\n"
-                if e == "Finished!":
-                    # Optionally clear events after finished
-                    user_events[user_id].clear()
-                    return
-            last_index = len(events)
-        await asyncio.sleep(0.1)
+async def event_generator(user_id: str, cursor: int | None = None):
+    """Yield events for the given user as SSE, then stop after 'Finished!'.
+
+    Event ids are only emitted for clients that passed a cursor, so the plain
+    "data: ..." stream the frontend parses is unchanged.
+    """
+    async for seq, e in progress.bus.subscribe(user_id, cursor):
+        if cursor is not None:
+            yield f"id: {seq}\ndata: {e}\n\n"
+        else:
+            yield f"data: {e}\n\n"
 
 
 
@@ -130,10 +242,14 @@ async def event_generator(user_id: str):
 # Method: GET
 # Headers:
 #   user-id: <string>  -> unique identifier for the user/session
+#   Last-Event-ID: <int>  -> optional, resume after this event id
+# Query (optional):
+#   cursor=<int>          -> same as Last-Event-ID; cursor=0 starts the run with ids on
 # Body: None
 # Response: SSE stream of progress messages for that user
 # Example curl:
 #   curl http://localhost:5001/progress -H "user-id: 12345"
+#   curl "http://localhost:5001/progress?cursor=3" -H "user-id: 12345"
 @app.get("/progress")
 async def progress_endpoint(request: Request):
     # Get user ID from header
@@ -141,7 +257,13 @@ async def progress_endpoint(request: Request):
     if not user_id:
         return {"error": "Missing user ID in headers"}
 
-    return StreamingResponse(event_generator(user_id), media_type="text/event-stream")
+    cursor = request.headers.get("last-event-id") or request.query_params.get("cursor")
+    try:
+        cursor = int(cursor) if cursor is not None else None
+    except ValueError:
+        return {"error": "Invalid cursor"}
+
+    return StreamingResponse(event_generator(user_id, cursor), media_type="text/event-stream")
 
 
 # Load environment variables
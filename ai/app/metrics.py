@@ -0,0 +1,146 @@
+"""
+Prometheus metrics shared by the chat API and the embedding worker.
+
+The API serves them on /metrics; the worker starts its own exporter on
+WORKER_METRICS_PORT.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+EMBEDDING_CACHE_HITS = Counter(
+    "embedding_cache_hits_total",
+    "Texts whose embedding was served from the content-hash cache",
+    ["model"],
+)
+EMBEDDING_CACHE_MISSES = Counter(
+    "embedding_cache_misses_total",
+    "Texts that had to be sent to the embedding provider",
+    ["model"],
+)
+
+AGENT_TASKS_RUNNING = Gauge(
+    "agent_tasks_running",
+    "Agent pipelines currently holding a concurrency slot",
+)
+AGENT_TASKS_QUEUED = Gauge(
+    "agent_tasks_queued",
+    "Agent pipelines waiting for a concurrency slot",
+)
+AGENT_TASKS_FINISHED = Counter(
+    "agent_tasks_finished_total",
+    "Agent pipelines that ended, by outcome",
+    ["outcome"],  # completed, failed, cancelled
+)
+AGENT_TASKS_SUPERSEDED = Counter(
+    "agent_tasks_superseded_total",
+    "In-flight agent pipelines cancelled by a newer /chat from the same user",
+)
+AGENT_TASKS_REJECTED = Counter(
+    "agent_tasks_rejected_total",
+    "/chat requests refused with 429 because the queue was full",
+)
+
+FAST_CLASSIFIER_DECISIONS = Counter(
+    "fast_classifier_decisions_total",
+    "Guardrail/routing decisions made locally vs. passed to the LLM",
+    ["classifier", "outcome"],  # outcome: local, llm
+)
+
+DECISION_CACHE_HITS = Counter(
+    "decision_cache_hits_total",
+    "Guardrail/routing decisions served from the decision cache",
+    ["classifier", "tier"],  # tier: memory, postgres
+)
+DECISION_CACHE_MISSES = Counter(
+    "decision_cache_misses_total",
+    "Guardrail/routing decisions that had to be classified",
+    ["classifier"],
+)
+
+WORKER_MESSAGES_SKIPPED = Counter(
+    "worker_messages_skipped_total",
+    "workout-logged messages the embedding worker committed past without processing",
+    ["reason"],  # invalid: unparseable, max_attempts: its user failed WORKER_MAX_ATTEMPTS times
+)
+
+# Stage latency; stages are listed where the spans are opened (main.agent_task,
+# embedding_worker)
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+AGENT_STAGE_SECONDS = Histogram(
+    "agent_stage_seconds",
+    "Duration of each agent_task stage",
+    ["stage"],  # guardrail, embed_query, route, refresh_embeddings, retrieval, answer, total
+    buckets=STAGE_BUCKETS,
+)
+WORKER_STAGE_SECONDS = Histogram(
+    "worker_stage_seconds",
+    "Duration of each embedding worker step",
+    ["stage"],  # user, exercises, workouts, backlog, stats, summaries, commit
+    buckets=STAGE_BUCKETS,
+)
+
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens reported by the chat models",
+    ["model", "kind"],  # kind: input, output
+)
+EMBEDDING_TOKENS = Counter(
+    "embedding_tokens_total",
+    "Estimated tokens sent to the embedding provider",
+    ["model"],
+)
+ROWS_EMBEDDED = Counter(
+    "rows_embedded_total",
+    "Rows whose embeddings were saved",
+    ["kind"],  # exercise, workout, summary
+)
+VECTORS_RETRIEVED = Counter(
+    "vectors_retrieved_total",
+    "Rows returned by RAG similarity searches",
+    ["kind"],  # exercise, workout, summary
+)
+QUERY_EMBEDDING_CACHE_HITS = Counter(
+    "query_embedding_cache_hits_total",
+    "Prompt embeddings served from the in-process query cache",
+)
+QUERY_EMBEDDING_CACHE_MISSES = Counter(
+    "query_embedding_cache_misses_total",
+    "Prompt embeddings that had to be requested",
+)
+
+HOT_VECTOR_CACHE_LOOKUPS = Counter(
+    "hot_vector_cache_lookups_total",
+    "In-process retrieval tier lookups",
+    ["kind", "outcome"],  # outcome: hit, load, cold (served by the DB)
+)
+HOT_VECTOR_CACHE_BYTES = Gauge(
+    "hot_vector_cache_bytes",
+    "Memory held by the in-process retrieval tier",
+)
+
+RAG_CONTEXT_TOKENS = Histogram(
+    "rag_context_tokens",
+    "Estimated tokens of retrieved context per request",
+    ["context"],  # selected: after re-ranking, baseline: the old fixed top-N, summaries: weekly/monthly roll-ups
+    buckets=(0, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000),
+)
+
+USER_STATS_UPDATES = Counter(
+    "user_stats_updates_total",
+    "Refreshes of the per-user aggregate tables by the embedding worker",
+    ["mode"],  # incremental: the changed workouts only, rebuild: the user's whole history
+)
+STATS_SUMMARIES = Counter(
+    "stats_summaries_total",
+    "STATS route requests, by whether aggregates answered them",
+    ["outcome"],  # served, fallback (no aggregates yet, retrieved rows instead)
+)
+
+
+def record_llm_usage(model: str, message) -> None:
+    """Count the tokens of a chat model response (or final stream chunk), if reported."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    LLM_TOKENS.labels(model=model, kind="input").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(model=model, kind="output").inc(usage.get("output_tokens", 0))
@@ -0,0 +1,239 @@
+"""
+Pub/sub for agent progress messages (/chat -> /progress).
+
+Two backends share one interface (ProgressBackend), selected by PROGRESS_BACKEND:
+- memory:   in-process buffers; single uvicorn worker only
+- postgres: events stored in progress_events and announced with NOTIFY, so
+            /chat and /progress may be served by different workers or replicas
+
+Each session (currently the user id) has numbered events. Subscribers sleep
+until something is published instead of polling, can resume from a replay
+cursor (the last event id they saw), and sessions idle for
+PROGRESS_SESSION_TTL_SECONDS are evicted. A run that a subscriber has read
+through FINISHED is consumed: a later subscriber without a cursor waits for
+the next run instead of replaying it (a client may open /progress before its
+/chat has started the run).
+"""
+
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import AsyncIterator
+import psycopg
+from sqlmodel import text
+from . import db
+
+PROGRESS_BACKEND = os.getenv("PROGRESS_BACKEND", "memory")  # "memory" or "postgres"
+PROGRESS_BUFFER_SIZE = int(os.getenv("PROGRESS_BUFFER_SIZE", "500"))
+PROGRESS_SESSION_TTL_SECONDS = float(os.getenv("PROGRESS_SESSION_TTL_SECONDS", "600"))
+# Postgres backend: re-check the table this often even without a notification
+PROGRESS_POLL_FALLBACK_SECONDS = float(os.getenv("PROGRESS_POLL_FALLBACK_SECONDS", "5"))
+PROGRESS_CHANNEL = "progress_events"
+
+# Terminal message of every agent run
+FINISHED = "Finished!"
+
+
+class ProgressBackend(ABC):
+    """Interface shared by the progress backends."""
+
+    @abstractmethod
+    async def start_run(self, session_id: str) -> None:
+        """Mark the start of a new run; new subscribers begin here."""
+
+    @abstractmethod
+    async def publish(self, session_id: str, message: str) -> None:
+        """Append a message to the session's current run and wake its subscribers."""
+
+    @abstractmethod
+    def subscribe(self, session_id: str, cursor: int | None = None) -> AsyncIterator[tuple[int, str]]:
+        """Async iterator of (seq, message) ending after FINISHED.
+
+        ``cursor`` is the last seq the client already received; without one the
+        stream starts at the beginning of the current run, or of the next one if
+        the current run has been consumed.
+        """
+
+
+class _Session:
+    def __init__(self, buffer_size: int):
+        self.events = deque(maxlen=buffer_size)  # (seq, message)
+        self.next_seq = 1
+        self.run_start = 1   # first seq of the current /chat run
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.last_active = time.monotonic()
+
+
+class InMemoryProgressBus(ProgressBackend):
+    def __init__(self, buffer_size: int = PROGRESS_BUFFER_SIZE, ttl: float = PROGRESS_SESSION_TTL_SECONDS):
+        self.buffer_size = buffer_size
+        self.ttl = ttl
+        self._sessions = {}
+        self._last_sweep = time.monotonic()
+
+    def _session(self, session_id: str) -> _Session:
+        self._evict_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session(self.buffer_size)
+        session.last_active = time.monotonic()
+        return session
+
+    def _evict_idle(self) -> None:
+        """Drop idle sessions nobody is listening to (at most once per ttl/4)."""
+        now = time.monotonic()
+        if now - self._last_sweep < self.ttl / 4:
+            return
+        self._last_sweep = now
+        expired = [
+            session_id for session_id, session in self._sessions.items()
+            if session.subscribers == 0 and now - session.last_active > self.ttl
+        ]
+        for session_id in expired:
+            del self._sessions[session_id]
+
+    async def start_run(self, session_id: str) -> None:
+        session = self._session(session_id)
+        session.run_start = session.next_seq
+
+    async def publish(self, session_id: str, message: str) -> None:
+        session = self._session(session_id)
+        session.events.append((session.next_seq, message))
+        session.next_seq += 1
+        # Wake every waiting subscriber, then arm a fresh event for the next publish
+        session.changed.set()
+        session.changed = asyncio.Event()
+
+    async def subscribe(self, session_id: str, cursor: int | None = None):
+        session = self._session(session_id)
+        position = session.run_start if cursor is None else max(cursor + 1, session.run_start)
+        session.subscribers += 1
+        try:
+            while True:
+                # Grab the event before reading so a publish in between is not missed
+                changed = session.changed
+                for seq, message in list(session.events):
+                    if seq < position:
+                        continue
+                    position = seq + 1
+                    if message == FINISHED:
+                        # Marked before yielding; the consumer may close us right after
+                        session.run_start = max(session.run_start, position)
+                        yield seq, message
+                        return
+                    yield seq, message
+                await changed.wait()
+                session.last_active = time.monotonic()
+        finally:
+            session.subscribers -= 1
+
+
+class PostgresProgressBus(ProgressBackend):
+    """Progress events in Postgres, with LISTEN/NOTIFY for wake-ups.
+
+    Event ids are progress_events.id. Each process runs one LISTEN connection
+    and fans notifications out to its local subscribers.
+    """
+
+    def __init__(self, ttl: float = PROGRESS_SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._changed = {}
+        self._listener = None
+
+    async def start_run(self, session_id: str) -> None:
+        # A new run replaces the previous one; expired sessions are swept here too
+        async with db.get_async_session() as session:
+            await session.execute(
+                text("DELETE FROM progress_events WHERE session_id = :session_id"),
+                {"session_id": session_id},
+            )
+            await session.execute(
+                text("DELETE FROM progress_events WHERE created_at < now() - make_interval(secs => :ttl)"),
+                {"ttl": self.ttl},
+            )
+            await session.commit()
+
+    async def publish(self, session_id: str, message: str) -> None:
+        async with db.get_async_session() as session:
+            await session.execute(text("""
+                WITH inserted AS (
+                    INSERT INTO progress_events (session_id, message)
+                    VALUES (:session_id, :message)
+                    RETURNING id
+                )
+                SELECT pg_notify(:channel, :session_id) FROM inserted
+            """), {"session_id": session_id, "message": message, "channel": PROGRESS_CHANNEL})
+            await session.commit()
+
+    async def subscribe(self, session_id: str, cursor: int | None = None):
+        self._ensure_listener()
+        position = cursor or 0
+        while True:
+            # Grab the event before reading so a notification in between is not missed
+            changed = self._changed.setdefault(session_id, asyncio.Event())
+            async with db.get_async_session() as session:
+                result = await session.execute(text("""
+                    SELECT id, message
+                    FROM progress_events
+                    WHERE session_id = :session_id AND id > :position
+                    ORDER BY id
+                """), {"session_id": session_id, "position": position})
+                rows = result.fetchall()
+
+            for row in rows:
+                position = row.id
+                if row.message == FINISHED:
+                    await self._consume(session_id, row.id)
+                    yield row.id, row.message
+                    return
+                yield row.id, row.message
+
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=PROGRESS_POLL_FALLBACK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _consume(self, session_id: str, finished_id: int) -> None:
+        """Drop a run that has been read through FINISHED."""
+        async with db.get_async_session() as session:
+            await session.execute(
+                text("DELETE FROM progress_events WHERE session_id = :session_id AND id <= :id"),
+                {"session_id": session_id, "id": finished_id},
+            )
+            await session.commit()
+
+    def _wake(self, session_id: str) -> None:
+        changed = self._changed.pop(session_id, None)
+        if changed is not None:
+            changed.set()
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        """Hold one LISTEN connection and wake local subscribers on NOTIFY."""
+        conninfo = db.ENGINE_URL.set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {PROGRESS_CHANNEL}")
+                    async for notify in conn.notifies():
+                        self._wake(notify.payload)
+            except Exception as e:
+                print(f"[progress] LISTEN connection lost: {e}; reconnecting")
+                await asyncio.sleep(1)
+
+
+def create_backend(name: str = PROGRESS_BACKEND) -> ProgressBackend:
+    if name == "postgres":
+        return PostgresProgressBus()
+    if name == "memory":
+        return InMemoryProgressBus()
+    raise ValueError(f"Unknown PROGRESS_BACKEND: {name}")
+
+
+bus = create_backend()
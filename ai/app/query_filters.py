@@ -0,0 +1,301 @@
+"""
+Rule-based query understanding for RAG retrieval.
+
+Pulls a date range ("in March", "last week", "yesterday", "last 30 days",
+"2024-03-05", ...) and exercise names (matched against the user's exercise
+vocabulary) out of the question. rag.py turns them into WHERE conditions on
+w.workout_date and the exercise ids, so only the matching rows are
+vector-ranked (indexes in 09_FilterIndexes.sql).
+
+Set QUERY_FILTERS_ENABLED=false to rank the user's whole history again.
+"""
+
+import calendar
+import os
+import re
+from datetime import date, timedelta
+from sqlmodel import text
+from . import db
+from .cache import TTLCache
+
+QUERY_FILTERS_ENABLED = os.getenv("QUERY_FILTERS_ENABLED", "true").lower() == "true"
+
+# A user's exercise names change rarely; re-read them every few minutes
+exercise_vocabulary_cache = TTLCache(
+    maxsize=int(os.getenv("EXERCISE_VOCABULARY_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("EXERCISE_VOCABULARY_CACHE_TTL_SECONDS", "300")),
+)
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({
+    "jan": 1, "feb": 2, "apr": 4, "jun": 6, "jul": 7, "aug": 8,
+    "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+})
+# Only read as months next to a year or after "in"/"during"/...: "may I ...", "marches"
+AMBIGUOUS_MONTHS = {"march", "may"}
+WEEKDAYS = {name.lower(): i for i, name in enumerate(calendar.day_name)}
+
+# Words too generic to identify an exercise on their own: equipment, modifiers
+# ("Long lever plank", "Easy grip curl") and words common in plain questions
+# ("how long", "push day", "what should I focus on")
+GENERIC_WORDS = {
+    "machine", "barbell", "dumbbell", "dumbbells", "cable", "smith", "seated",
+    "standing", "incline", "decline", "single", "weighted", "assisted",
+    "press", "raise", "row", "workout", "exercise", "training",
+    "long", "short", "easy", "hard", "heavy", "light", "focus", "grip", "flat",
+    "push", "pull", "down", "over", "lever", "angled", "kneeling", "prone",
+    "inner", "outer", "close", "wide", "reverse", "front", "back", "high", "side",
+}
+
+
+class QueryFilters:
+    def __init__(self, date_from: date | None = None, date_to: date | None = None, exercise_ids=(), exercise_names=(),
+                 workout_ids=()):
+        """Extracted restrictions; date_to is exclusive.
+
+        ``workout_ids`` is not extracted from the question: rag.get_data sets it
+        to the workouts of the matching weekly/monthly summaries.
+        """
+        self.date_from = date_from
+        self.date_to = date_to
+        self.exercise_ids = list(exercise_ids)
+        self.exercise_names = list(exercise_names)
+        self.workout_ids = list(workout_ids)
+
+    def __bool__(self):
+        return self.date_from is not None or bool(self.exercise_ids) or bool(self.workout_ids)
+
+    def __repr__(self):
+        return (f"QueryFilters(date_from={self.date_from}, date_to={self.date_to}, exercises={self.exercise_names}, "
+                f"workouts={len(self.workout_ids)})")
+
+    def within(self, workout_ids) -> "QueryFilters":
+        """Copy of these filters further restricted to ``workout_ids``."""
+        return QueryFilters(self.date_from, self.date_to, self.exercise_ids, self.exercise_names, workout_ids)
+
+    def widen(self) -> "QueryFilters | None":
+        """Looser filters to retry with when nothing matched, or None to keep the empty result.
+
+        An explicit date range is never dropped (the answer is that nothing
+        happened then); only the exercise and workout restrictions inside it
+        are. Without one, the whole history is searched (empty filters).
+        """
+        if self.date_from is None:
+            return QueryFilters()
+        if self.exercise_ids or self.workout_ids:
+            return QueryFilters(self.date_from, self.date_to)
+        return None
+
+    def sql(self, kind: str) -> tuple[str, dict]:
+        """Extra WHERE conditions (starting with AND) for an "exercise" or "workout" search.
+
+        Exercise searches must alias workout_exercises as we; workout searches
+        alias workouts as w.
+        """
+        conditions = []
+        params = {}
+        if self.date_from is not None:
+            params["date_from"] = self.date_from
+            params["date_to"] = self.date_to
+            if kind == "exercise":
+                conditions.append("""we.workout_id IN (
+                    SELECT fw.id FROM workouts fw
+                    WHERE fw.user_id = :user_id
+                    AND fw.workout_date >= :date_from AND fw.workout_date < :date_to)""")
+            else:
+                conditions.append("w.workout_date >= :date_from AND w.workout_date < :date_to")
+        if self.exercise_ids:
+            params["exercise_ids"] = self.exercise_ids
+            if kind == "exercise":
+                conditions.append("we.exercise_id = ANY(:exercise_ids)")
+            else:
+                conditions.append("""EXISTS (
+                    SELECT 1 FROM workout_exercises fwe
+                    WHERE fwe.workout_id = w.id AND fwe.exercise_id = ANY(:exercise_ids))""")
+        if self.workout_ids:
+            params["workout_ids"] = self.workout_ids
+            if kind == "exercise":
+                conditions.append("we.workout_id = ANY(:workout_ids)")
+            else:
+                conditions.append("w.id = ANY(:workout_ids)")
+        return "".join(f"\n AND {condition}" for condition in conditions), params
+
+
+async def extract(prompt: str, user_id: int, today: date | None = None) -> QueryFilters:
+    """Date range and exercises mentioned in the prompt (empty filters if none)."""
+    if not QUERY_FILTERS_ENABLED:
+        return QueryFilters()
+
+    date_range = extract_date_range(prompt, today or date.today())
+    vocabulary = await get_exercise_vocabulary(user_id)
+    exercises = match_exercises(prompt, vocabulary)
+
+    date_from, date_to = date_range or (None, None)
+    return QueryFilters(
+        date_from,
+        date_to,
+        [exercise_id for exercise_id, _ in exercises],
+        [name for _, name in exercises],
+    )
+
+
+def extract_date_range(prompt: str, today: date) -> tuple[date, date] | None:
+    """First date expression in the prompt as (start, exclusive end), or None."""
+    p = prompt.lower()
+    tomorrow = today + timedelta(days=1)
+
+    match = re.search(r"\b(since\s+)?(\d{4})-(\d{2})-(\d{2})\b", p)
+    if match:
+        try:
+            day = date(int(match[2]), int(match[3]), int(match[4]))
+            return day, tomorrow if match[1] else day + timedelta(days=1)
+        except ValueError:
+            pass
+
+    if re.search(r"\btoday\b", p):
+        return today, tomorrow
+    if re.search(r"\byesterday\b", p):
+        return today - timedelta(days=1), today
+
+    match = re.search(r"\b(?:last|past) (\d+) (day|week|month|year)s?\b", p)
+    if match:
+        count, unit = int(match[1]), match[2]
+        if unit == "day":
+            start = today - timedelta(days=count)
+        elif unit == "week":
+            start = today - timedelta(weeks=count)
+        elif unit == "month":
+            start = _add_months(today, -count)
+        else:
+            start = _add_months(today, -12 * count)
+        return start, tomorrow
+
+    match = re.search(r"\b(this|last|past) (week|month|year)\b", p)
+    if match:
+        which, unit = match[1], match[2]
+        if unit == "week":
+            monday = today - timedelta(days=today.weekday())
+            if which == "this":
+                return monday, tomorrow
+            if which == "last":
+                return monday - timedelta(weeks=1), monday
+            return today - timedelta(weeks=1), tomorrow
+        if unit == "month":
+            first = today.replace(day=1)
+            if which == "this":
+                return first, tomorrow
+            if which == "last":
+                return _add_months(first, -1), first
+            return _add_months(today, -1), tomorrow
+        first = today.replace(month=1, day=1)
+        if which == "this":
+            return first, tomorrow
+        if which == "last":
+            return first.replace(year=first.year - 1), first
+        return _add_months(today, -12), tomorrow
+
+    month_names = "|".join(sorted(MONTHS, key=len, reverse=True))
+    unambiguous_month_names = "|".join(sorted(set(MONTHS) - AMBIGUOUS_MONTHS, key=len, reverse=True))
+
+    # "since March", "since March 2024", "since 2024": open-ended, up to today
+    match = re.search(rf"\bsince\s+(?:({month_names})(?:\s+(\d{{4}}))?|(20\d{{2}}))\b", p)
+    if match:
+        if match[3]:
+            return date(int(match[3]), 1, 1), tomorrow
+        return _month_start(MONTHS[match[1]], match[2], today), tomorrow
+
+    match = (
+        re.search(rf"\b({month_names})\s+(\d{{4}})\b", p)
+        or re.search(rf"\b(?:in|during|of|for)\s+({month_names})\b", p)
+        or re.search(rf"\b({unambiguous_month_names})\b", p)
+    )
+    if match:
+        start = _month_start(MONTHS[match[1]], match[2] if match.re.groups > 1 else None, today)
+        return start, _add_months(start, 1)
+
+    match = re.search(r"\b(?:(last|on)\s+)?(" + "|".join(WEEKDAYS) + r")\b", p)
+    if match:
+        days_back = (today.weekday() - WEEKDAYS[match[2]]) % 7
+        if days_back == 0 and match[1] == "last":
+            days_back = 7
+        day = today - timedelta(days=days_back)
+        return day, day + timedelta(days=1)
+
+    match = re.search(r"\b(?:in|during)\s+(20\d{2})\b", p)
+    if match:
+        return date(int(match[1]), 1, 1), date(int(match[1]) + 1, 1, 1)
+
+    return None
+
+
+def match_exercises(prompt: str, vocabulary: list[tuple[int, str]]) -> list[tuple[int, str]]:
+    """Exercises named in the prompt.
+
+    Full names win ("bench press" -> Bench Press only), and a longer full name
+    hides the names inside it ("incline bench press" -> not Bench Press too);
+    otherwise any exercise sharing a distinctive word with the prompt matches
+    ("curls" -> every curl). Words in GENERIC_WORDS or shorter than 4 letters
+    never match on their own.
+    """
+    prompt_words = [_singular(word) for word in re.findall(r"[a-z0-9]+", prompt.lower())]
+    prompt_text = f" {' '.join(prompt_words)} "
+    generic_words = {_singular(word) for word in GENERIC_WORDS}
+
+    full = []
+    partial = []
+    for exercise_id, name in vocabulary:
+        name_words = [_singular(word) for word in re.findall(r"[a-z0-9]+", name.lower())]
+        if not name_words:
+            continue
+        name_text = f" {' '.join(name_words)} "
+        if name_text in prompt_text:
+            full.append((exercise_id, name, name_text))
+        elif any(
+            len(word) >= 4 and word not in generic_words and word in prompt_words
+            for word in name_words
+        ):
+            partial.append((exercise_id, name))
+    if full:
+        return [
+            (exercise_id, name) for exercise_id, name, name_text in full
+            if not any(name_text != other and name_text in other for _, _, other in full)
+        ]
+    return partial
+
+
+async def get_exercise_vocabulary(user_id: int) -> list[tuple[int, str]]:
+    """(id, name) of the global exercises and the user's own ones."""
+    vocabulary = exercise_vocabulary_cache.get(user_id)
+    if vocabulary is None:
+        async with db.get_async_session() as session:
+            result = await session.execute(text("""
+                SELECT id, name
+                FROM exercises
+                WHERE is_global OR user_id = :user_id
+            """), {"user_id": user_id})
+            vocabulary = [(row.id, row.name) for row in result]
+        exercise_vocabulary_cache.set(user_id, vocabulary)
+    return vocabulary
+
+
+def _singular(word: str) -> str:
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _month_start(month: int, year: str | None, today: date) -> date:
+    """First day of ``month``; without a year, its latest occurrence up to today."""
+    if year:
+        return date(int(year), month, 1)
+    if month > today.month:
+        # "in November" asked in March means last November
+        return date(today.year - 1, month, 1)
+    return date(today.year, month, 1)
+
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
@@ -1,4 +1,8 @@
+import asyncio
 from langchain_mistralai import ChatMistralAI
+from . import decision_cache
+from . import fast_classifier
+from . import metrics
 
 router_llm = ChatMistralAI(
     model="ministral-3b-latest",
@@ -6,35 +10,10 @@ router_llm = ChatMistralAI(
     max_tokens=15,
 )
 
-MEDICAL_RESPONSE = """AI_message: I can't provide medical advice or diagnose injuries or conditions.
-
-**For pain, injuries, or medical concerns**, please consult a qualified healthcare professional.
-
-I can help with:
-- General fitness training
-- Exercise selection
-- Workout structure
+# The only labels the local fast path may decide; FITNESS_OK always comes from the LLM
+FAST_PATH_LABELS = {"MEDICAL_ADVICE", "NON_FITNESS"}
 
-Feel free to ask if you'd like assistance with any of these!"""
-
-
-NON_FITNESS_RESPONSE = """AI_message: I'm designed to help with fitness and training-related questions.
-
-Try asking about:
-- Workouts
-- Exercises
-- Progress
-- Recovery"""
-
-
-def check_guardrails(prompt: str, context: list = []):
-    previous_queries = ""
-    if context:
-        for role, message in context:
-            if role == "human":
-                previous_queries += f"User: {message}\n"
-
-    guardrail_prompt = """
+GUARDRAIL_PROMPT = """
         You are a guardrail classifier for a fitness-focused AI application.
 
         Your task is to classify the user's message into exactly ONE of the following labels:
@@ -63,9 +42,59 @@ def check_guardrails(prompt: str, context: list = []):
         {prompt}
     """
 
-    response = router_llm.invoke([
-        ("human", guardrail_prompt.format(prompt=prompt, previous_queries=previous_queries)),
+guardrail_decisions = decision_cache.DecisionCache(
+    "guardrail", router_llm.model, GUARDRAIL_PROMPT, enabled=decision_cache.GUARDRAIL_DECISION_CACHE
+)
+
+MEDICAL_RESPONSE = """AI_message: I can't provide medical advice or diagnose injuries or conditions.
+
+**For pain, injuries, or medical concerns**, please consult a qualified healthcare professional.
+
+I can help with:
+- General fitness training
+- Exercise selection
+- Workout structure
+
+Feel free to ask if you'd like assistance with any of these!"""
+
+
+NON_FITNESS_RESPONSE = """AI_message: I'm designed to help with fitness and training-related questions.
+
+Try asking about:
+- Workouts
+- Exercises
+- Progress
+- Recovery"""
+
+
+async def check_guardrails(prompt: str, context: list = [], vector_task: asyncio.Task | None = None):
+    #repeated questions reuse the earlier decision
+    classification = await guardrail_decisions.get(prompt, context)
+    if classification is not None:
+        return classification
+
+    #the LLM call starts right away; a confident local decision from the prompt
+    #embedding may still beat it, but only to refuse. Follow-ups skip the fast
+    #path since the embedding doesn't see the earlier turns
+    llm_task = asyncio.create_task(_llm_guardrail(prompt, context))
+    return await fast_classifier.guardrail.decide(
+        None if context else vector_task,
+        llm_task,
+        accept=lambda label: label in FAST_PATH_LABELS,
+    )
+
+
+async def _llm_guardrail(prompt: str, context: list) -> str:
+    previous_queries = ""
+    if context:
+        for role, message in context:
+            if role == "human":
+                previous_queries += f"User: {message}\n"
+
+    response = await router_llm.ainvoke([
+        ("human", GUARDRAIL_PROMPT.format(prompt=prompt, previous_queries=previous_queries)),
     ])
+    metrics.record_llm_usage(router_llm.model, response)
     
     classification = response.content.strip().upper()
 
@@ -73,4 +102,5 @@ def check_guardrails(prompt: str, context: list = []):
     if classification not in {"FITNESS_OK", "MEDICAL_ADVICE", "NON_FITNESS"}:
         classification = "FITNESS_OK"
     print(classification)
+    await guardrail_decisions.set(prompt, context, classification)
     return classification
@@ -1,4 +1,15 @@
+import os
+import re
+from datetime import timedelta
+import numpy as np
 from . import db
+from . import metrics
+from . import query_filters
+from . import rerank
+from . import tracing
+from . import user_stats
+from . import vector_cache
+from .cache import TTLCache
 from langchain_mistralai import MistralAIEmbeddings
 from sqlmodel import text
 from pprint import pprint
@@ -8,28 +19,149 @@ embeddings = MistralAIEmbeddings(
     model="mistral-embed",
 )
 
+# Query vectors keyed by normalized prompt text
+query_embedding_cache = TTLCache(
+    maxsize=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "600")),
+)
+
+
+# "ann" uses the HNSW indexes from 05_VectorIndexes.sql, "exact" scans every row
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "ann")
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+# pgvector >= 0.8: keep scanning the index until LIMIT rows pass the user filter.
+# Without it a scan stops after ef_search rows across all users and a user with
+# a small share of the table gets fewer than LIMIT results (benchmarks/hnsw_recall.py)
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")  # "", "relaxed_order" or "strict_order"
+
+# Weekly/monthly summaries (summary_embeddings.py) are added to WORKOUTS/BOTH
+# context. Long-horizon questions go coarse-to-fine: the best SUMMARY_LIMIT
+# periods first, then only the workouts inside them. A question is long-horizon
+# if its date range spans more than SUMMARY_MIN_SPAN_WEEKS or it asks about
+# progress or trends (TREND_PATTERN); other questions search as usual.
+SUMMARY_RETRIEVAL_ENABLED = os.getenv("SUMMARY_RETRIEVAL_ENABLED", "true").lower() == "true"
+SUMMARY_LIMIT = int(os.getenv("SUMMARY_LIMIT", "3"))
+SUMMARY_MIN_SPAN_WEEKS = int(os.getenv("SUMMARY_MIN_SPAN_WEEKS", "6"))
+TREND_PATTERN = re.compile(
+    r"\b(progress\w*|trend\w*|over time|improv\w*|plateau\w*|overall|so far|long[- ]term|"
+    r"over the (?:months|years)|history)\b"
+)
+# Workouts searched inside the summaries' periods when going coarse-to-fine
+# (without re-ranking)
+SUMMARY_DETAIL_LIMIT = int(os.getenv("SUMMARY_DETAIL_LIMIT", "5"))
+
+
+async def embed_prompt(prompt: str) -> np.ndarray:
+    """Embed a user question for similarity search.
+
+    Vectors are cached by normalized prompt text, so repeated questions skip
+    the remote embedding call.
+    """
+    key = normalize_prompt(prompt)
+    query_vector = query_embedding_cache.get(key)
+    if query_vector is None:
+        metrics.QUERY_EMBEDDING_CACHE_MISSES.inc()
+        query_vector = np.asarray(await embeddings.aembed_query(prompt), dtype=np.float32)
+        query_embedding_cache.set(key, query_vector)
+    else:
+        metrics.QUERY_EMBEDDING_CACHE_HITS.inc()
+    return query_vector
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+def is_long_horizon(prompt: str, filters: query_filters.QueryFilters | None = None) -> bool:
+    """Whether a question is about a long stretch of time (coarse-to-fine retrieval)."""
+    if filters is not None and filters.date_from is not None:
+        return filters.date_to - filters.date_from > timedelta(weeks=SUMMARY_MIN_SPAN_WEEKS)
+    return TREND_PATTERN.search(prompt.lower()) is not None
+
+
+async def configure_search(session, ef_search: int | None = None, limit: int = 0, exact: bool = False) -> None:
+    """Apply the retrieval mode to the current transaction.
 
+    "ann" lets the planner use the HNSW indexes and sets hnsw.ef_search, the
+    recall/latency knob (higher = better recall, slower); it is raised to
+    ``limit`` since an HNSW scan returns at most ef_search rows. "exact" disables
+    plain index scans so the HNSW index is skipped and distances are computed
+    for every one of the user's rows (the user_id btree is still used via a
+    bitmap scan). ``exact`` forces the latter for pre-filtered searches, where
+    the btree narrows the rows far more than an HNSW scan could.
+    """
+    if RETRIEVAL_MODE == "ann" and not exact:
+        await session.execute(
+            text("SELECT set_config('hnsw.ef_search', :ef_search, true)"),
+            {"ef_search": str(max(ef_search or HNSW_EF_SEARCH, limit))},
+        )
+        if HNSW_ITERATIVE_SCAN:
+            await session.execute(
+                text("SELECT set_config('hnsw.iterative_scan', :mode, true)"),
+                {"mode": HNSW_ITERATIVE_SCAN},
+            )
+    else:
+        await session.execute(text("SELECT set_config('enable_indexscan', 'off', true)"))
 
-def retrieve_exercises(prompt: str, user_id: int, limit: int = 10):
-    # Get embedding for the query
-    query_vector = embeddings.embed_query(prompt)
 
-    # Convert to pgvector format
-    vector_str = "[" + ",".join(str(v) for v in query_vector) + "]"
+def search_cached(entry: vector_cache.UserVectors, query_vector: np.ndarray, limit: int, text_key: str,
+                  with_vectors: bool = False) -> list[dict]:
+    """Top-k over a hot user's in-memory vectors, shaped like the DB results."""
+    indices, similarities = entry.top_k(query_vector, limit)
+    result = [
+        {"id": int(entry.ids[i]), text_key: entry.texts[i], "similarity": float(similarity)}
+        for i, similarity in zip(indices, similarities)
+    ]
+    if with_vectors:
+        for item, i in zip(result, indices):
+            item["embedding"] = entry.matrix[i]
+    return result
+
+
+async def retrieve_exercises(query_vector: np.ndarray, user_id: int, limit: int = 10, ef_search: int | None = None,
+                        with_vectors: bool = False, filters: query_filters.QueryFilters | None = None):
+    """Nearest exercises of a user; with_vectors adds each row's "embedding" (for re-ranking).
+
+    ``filters`` restrict the search in SQL; if nothing matches them, the
+    search is retried with ``filters.widen()`` (the whole history, unless the
+    question named a date range).
+    """
+    if filters:
+        result = await _retrieve_exercises_db(query_vector, user_id, limit, ef_search, with_vectors, filters)
+        wider = filters.widen()
+        if result or wider is None:
+            return result
+        tracing.log(f"[rag] no exercises match {filters}, retrying with {wider}")
+        return await retrieve_exercises(query_vector, user_id, limit, ef_search, with_vectors, wider)
+
+    # Hot users are served from the in-process tier
+    cached = await vector_cache.cache.lookup(user_id, "exercise")
+    if cached is not None:
+        result = search_cached(cached, query_vector, limit, "exercise_text", with_vectors)
+        metrics.VECTORS_RETRIEVED.labels(kind="exercise").inc(len(result))
+        return result
+    return await _retrieve_exercises_db(query_vector, user_id, limit, ef_search, with_vectors)
 
+
+async def _retrieve_exercises_db(query_vector: np.ndarray, user_id: int, limit: int = 10, ef_search: int | None = None,
+                              with_vectors: bool = False, filters: query_filters.QueryFilters | None = None):
+    filter_sql, filter_params = filters.sql("exercise") if filters else ("", {})
     # Search database using cosine similarity
-    with db.get_session() as session:
-        result = session.execute(text("""
+    async with db.get_async_session() as session:
+        await configure_search(session, ef_search, limit, exact=bool(filters))
+        result = await session.execute(text(f"""
             SELECT we.id, we.exercise_text,
                    we.embeddings <=> :query_vector AS distance
+                   {", we.embeddings AS embedding" if with_vectors else ""}
             FROM workout_exercises we
-            JOIN workouts w ON we.workout_id = w.id
-            WHERE w.user_id = :user_id AND we.embeddings IS NOT NULL
+            WHERE we.user_id = :user_id AND we.embeddings IS NOT NULL{filter_sql}
             ORDER BY we.embeddings <=> :query_vector
             LIMIT :limit
-        """), {"query_vector": vector_str, "user_id": user_id, "limit": limit})
+        """), {"query_vector": query_vector, "user_id": user_id, "limit": limit, **filter_params})
         rows = result.fetchall()
     
+    metrics.VECTORS_RETRIEVED.labels(kind="exercise").inc(len(rows))
+
     # Convert rows to dictionaries with similarity score
 
     result = [
@@ -40,30 +172,58 @@ def retrieve_exercises(prompt: str, user_id: int, limit: int = 10):
         }
         for row in rows
     ]
+    if with_vectors:
+        for item, row in zip(result, rows):
+            item["embedding"] = np.asarray(row.embedding, dtype=np.float32)
 
     #pprint(result)
 
     return result
 
 
-def retrieve_workouts(prompt: str, user_id: int, limit: int = 10):
-    # Get embedding for the query
-    query_vector = embeddings.embed_query(prompt)
+async def retrieve_workouts(query_vector: np.ndarray, user_id: int, limit: int = 10, ef_search: int | None = None,
+                        with_vectors: bool = False, filters: query_filters.QueryFilters | None = None):
+    """Nearest workouts of a user; with_vectors adds each row's "embedding" (for re-ranking).
+
+    ``filters`` restrict the search in SQL; if nothing matches them, the
+    search is retried with ``filters.widen()`` (the whole history, unless the
+    question named a date range).
+    """
+    if filters:
+        result = await _retrieve_workouts_db(query_vector, user_id, limit, ef_search, with_vectors, filters)
+        wider = filters.widen()
+        if result or wider is None:
+            return result
+        tracing.log(f"[rag] no workouts match {filters}, retrying with {wider}")
+        return await retrieve_workouts(query_vector, user_id, limit, ef_search, with_vectors, wider)
+
+    # Hot users are served from the in-process tier
+    cached = await vector_cache.cache.lookup(user_id, "workout")
+    if cached is not None:
+        result = search_cached(cached, query_vector, limit, "workout_text", with_vectors)
+        metrics.VECTORS_RETRIEVED.labels(kind="workout").inc(len(result))
+        return result
+    return await _retrieve_workouts_db(query_vector, user_id, limit, ef_search, with_vectors)
 
-    # Convert to pgvector format
-    vector_str = "[" + ",".join(str(v) for v in query_vector) + "]"
 
+async def _retrieve_workouts_db(query_vector: np.ndarray, user_id: int, limit: int = 10, ef_search: int | None = None,
+                              with_vectors: bool = False, filters: query_filters.QueryFilters | None = None):
+    filter_sql, filter_params = filters.sql("workout") if filters else ("", {})
     # Search database using cosine similarity
-    with db.get_session() as session:
-        result = session.execute(text("""
+    async with db.get_async_session() as session:
+        await configure_search(session, ef_search, limit, exact=bool(filters))
+        result = await session.execute(text(f"""
             SELECT w.id, w.workout_text,
                    w.embeddings <=> :query_vector AS distance
+                   {", w.embeddings AS embedding" if with_vectors else ""}
             FROM workouts w
-            WHERE w.user_id = :user_id AND w.embeddings IS NOT NULL
+            WHERE w.user_id = :user_id AND w.embeddings IS NOT NULL{filter_sql}
             ORDER BY w.embeddings <=> :query_vector
             LIMIT :limit
-        """), {"query_vector": vector_str, "user_id": user_id, "limit": limit})
+        """), {"query_vector": query_vector, "user_id": user_id, "limit": limit, **filter_params})
         rows = result.fetchall()
+
+    metrics.VECTORS_RETRIEVED.labels(kind="workout").inc(len(rows))
     
     # Convert rows to dictionaries with similarity score
     result = [
@@ -74,40 +234,270 @@ def retrieve_workouts(prompt: str, user_id: int, limit: int = 10):
         }
         for row in rows
     ]
+    if with_vectors:
+        for item, row in zip(result, rows):
+            item["embedding"] = np.asarray(row.embedding, dtype=np.float32)
 
     #pprint(result)
 
     return result
 
-def get_data(prompt: str, user_id: int, route: str) -> str:
+
+async def retrieve_both(query_vector: np.ndarray, user_id: int, exercise_limit: int = 5, workout_limit: int = 5, ef_search: int | None = None,
+                        with_vectors: bool = False, filters: query_filters.QueryFilters | None = None):
+    """Run the exercise and workout searches as a single SQL round trip.
+
+    Returns (exercises, workouts) shaped like retrieve_exercises/retrieve_workouts.
+    Kinds held by the hot-user tier are searched in memory instead.
+    """
+    if filters:
+        exercises, workouts = await _retrieve_both_db(query_vector, user_id, exercise_limit, workout_limit, ef_search, with_vectors, filters)
+        wider = filters.widen()
+        if wider is not None and not exercises:
+            tracing.log(f"[rag] no exercises match {filters}, retrying with {wider}")
+            exercises = await retrieve_exercises(query_vector, user_id, exercise_limit, ef_search, with_vectors, wider)
+        if wider is not None and not workouts:
+            tracing.log(f"[rag] no workouts match {filters}, retrying with {wider}")
+            workouts = await retrieve_workouts(query_vector, user_id, workout_limit, ef_search, with_vectors, wider)
+        return exercises, workouts
+
+    cached_exercises = await vector_cache.cache.lookup(user_id, "exercise")
+    cached_workouts = await vector_cache.cache.lookup(user_id, "workout")
+    if cached_exercises is not None or cached_workouts is not None:
+        if cached_exercises is not None:
+            exercises = search_cached(cached_exercises, query_vector, exercise_limit, "exercise_text", with_vectors)
+            metrics.VECTORS_RETRIEVED.labels(kind="exercise").inc(len(exercises))
+        else:
+            exercises = await _retrieve_exercises_db(query_vector, user_id, exercise_limit, ef_search, with_vectors)
+        if cached_workouts is not None:
+            workouts = search_cached(cached_workouts, query_vector, workout_limit, "workout_text", with_vectors)
+            metrics.VECTORS_RETRIEVED.labels(kind="workout").inc(len(workouts))
+        else:
+            workouts = await _retrieve_workouts_db(query_vector, user_id, workout_limit, ef_search, with_vectors)
+        return exercises, workouts
+
+    return await _retrieve_both_db(query_vector, user_id, exercise_limit, workout_limit, ef_search, with_vectors)
+
+
+async def _retrieve_both_db(query_vector: np.ndarray, user_id: int, exercise_limit: int, workout_limit: int, ef_search: int | None = None,
+                            with_vectors: bool = False, filters: query_filters.QueryFilters | None = None):
+    vector_column = ", {}.embeddings AS embedding" if with_vectors else ""
+    exercise_filter_sql, filter_params = filters.sql("exercise") if filters else ("", {})
+    workout_filter_sql, workout_filter_params = filters.sql("workout") if filters else ("", {})
+    filter_params.update(workout_filter_params)
+    async with db.get_async_session() as session:
+        await configure_search(session, ef_search, max(exercise_limit, workout_limit), exact=bool(filters))
+        result = await session.execute(text(f"""
+            (SELECT 'exercise' AS kind, we.id, we.exercise_text AS text,
+                    we.embeddings <=> :query_vector AS distance
+                    {vector_column.format("we")}
+             FROM workout_exercises we
+             WHERE we.user_id = :user_id AND we.embeddings IS NOT NULL{exercise_filter_sql}
+             ORDER BY we.embeddings <=> :query_vector
+             LIMIT :exercise_limit)
+            UNION ALL
+            (SELECT 'workout' AS kind, w.id, w.workout_text AS text,
+                    w.embeddings <=> :query_vector AS distance
+                    {vector_column.format("w")}
+             FROM workouts w
+             WHERE w.user_id = :user_id AND w.embeddings IS NOT NULL{workout_filter_sql}
+             ORDER BY w.embeddings <=> :query_vector
+             LIMIT :workout_limit)
+        """), {
+            "query_vector": query_vector,
+            "user_id": user_id,
+            "exercise_limit": exercise_limit,
+            "workout_limit": workout_limit,
+            **filter_params,
+        })
+        rows = result.fetchall()
+
+    exercises = []
+    workouts = []
+    for row in rows:
+        if row.kind == "exercise":
+            item = {"id": row.id, "exercise_text": row.text, "similarity": 1 - row.distance}
+            exercises.append(item)
+        else:
+            item = {"id": row.id, "workout_text": row.text, "similarity": 1 - row.distance}
+            workouts.append(item)
+        if with_vectors:
+            item["embedding"] = np.asarray(row.embedding, dtype=np.float32)
+    metrics.VECTORS_RETRIEVED.labels(kind="exercise").inc(len(exercises))
+    metrics.VECTORS_RETRIEVED.labels(kind="workout").inc(len(workouts))
+    return exercises, workouts
+
+
+async def retrieve_summaries(query_vector: np.ndarray, user_id: int, limit: int = SUMMARY_LIMIT, ef_search: int | None = None,
+                             filters: query_filters.QueryFilters | None = None) -> list[dict]:
+    """Nearest weekly/monthly summaries of a user above the similarity floor.
+
+    Over-fetches and keeps at most one summary per stretch of time: a month and
+    the weeks inside it say much the same, so the better match wins. A date
+    range in ``filters`` keeps only the periods overlapping it.
+    """
+    date_sql = ""
+    params = {"query_vector": query_vector, "user_id": user_id, "limit": limit * 4}
+    if filters is not None and filters.date_from is not None:
+        date_sql = "\n AND s.period_start < :date_to AND s.period_end > :date_from"
+        params.update({"date_from": filters.date_from, "date_to": filters.date_to})
+
+    async with db.get_async_session() as session:
+        await configure_search(session, ef_search, params["limit"], exact=bool(date_sql))
+        result = await session.execute(text(f"""
+            SELECT s.period, s.period_start, s.period_end, s.workout_ids, s.summary_text,
+                   s.embeddings <=> :query_vector AS distance
+            FROM workout_summaries s
+            WHERE s.user_id = :user_id AND s.embeddings IS NOT NULL{date_sql}
+            ORDER BY s.embeddings <=> :query_vector
+            LIMIT :limit
+        """), params)
+        rows = result.fetchall()
+
+    metrics.VECTORS_RETRIEVED.labels(kind="summary").inc(len(rows))
+
+    selected = []
+    for row in rows:
+        similarity = 1 - row.distance
+        if similarity < rerank.RAG_SIMILARITY_FLOOR or len(selected) >= limit:
+            break
+        if any(row.period_start < item["period_end"] and item["period_start"] < row.period_end for item in selected):
+            continue
+        selected.append({
+            "period": row.period,
+            "period_start": row.period_start,
+            "period_end": row.period_end,
+            "workout_ids": list(row.workout_ids),
+            "summary_text": row.summary_text,
+            "similarity": similarity,
+        })
+    return selected
+
+
+def no_data_message(filters: query_filters.QueryFilters | None) -> str:
+    """Context line for an empty retrieval."""
+    if filters is not None and filters.date_from is not None:
+        last_day = filters.date_to - timedelta(days=1)
+        return f"no workouts in that range ({filters.date_from} to {last_day})"
+    return "no relevant data found"
+
+
+def format_summaries(summaries: list[dict]) -> str:
+    return "--- SUMMARIES ---\n" + "\n\n".join(item["summary_text"] for item in summaries)
+
+
+def select_context(query_vector: np.ndarray, candidates: list[dict], text_key: str, baseline: list[dict],
+                   token_budget: int = rerank.RAG_CONTEXT_TOKEN_BUDGET) -> list[dict]:
+    """Re-rank over-fetched candidates and report the tokens saved against ``baseline``,
+    the fixed top-N context used before re-ranking."""
+    selected = rerank.select_context(query_vector, candidates, text_key, token_budget)
+    baseline_tokens = rerank.context_tokens(baseline, text_key)
+    selected_tokens = rerank.context_tokens(selected, text_key)
+    metrics.RAG_CONTEXT_TOKENS.labels(context="baseline").observe(baseline_tokens)
+    metrics.RAG_CONTEXT_TOKENS.labels(context="selected").observe(selected_tokens)
+    tracing.log(f"[rag] context: {len(selected)}/{len(candidates)} rows, {selected_tokens} tokens "
+                f"(top-{len(baseline)} would be {baseline_tokens}, saved {baseline_tokens - selected_tokens})")
+    return selected
+
+
+async def get_data(prompt: str, user_id: int, route: str, query_vector: np.ndarray | None = None, ef_search: int | None = None) -> str:
     
+    # Totals and records come from the worker-maintained aggregates, not from rows
+    stats_summary = None
+    filters = None
+    if route == "STATS":
+        filters = await query_filters.extract(prompt, user_id)
+        stats_summary = await user_stats.get_summary(user_id, filters)
+        if stats_summary is None:
+            # Aggregates not built yet for this user
+            metrics.STATS_SUMMARIES.labels(outcome="fallback").inc()
+            route = "BOTH"
+        else:
+            metrics.STATS_SUMMARIES.labels(outcome="served").inc()
+
+    # Embed the question once; every search below shares the same vector
+    if query_vector is None and route in {"EXERCISES", "WORKOUTS", "BOTH"}:
+        query_vector = await embed_prompt(prompt)
+
+    # Dates and exercise names in the question narrow the search in SQL
+    if route in {"EXERCISES", "WORKOUTS", "BOTH"}:
+        if filters is None:
+            filters = await query_filters.extract(prompt, user_id)
+        if filters:
+            tracing.log(f"[rag] {filters}")
+
+    # The best matching weeks/months; for long-horizon questions (coarse-to-fine)
+    # only their workouts are searched, otherwise they are just added to the context
+    summaries = []
+    coarse_to_fine = False
+    token_budget = rerank.RAG_CONTEXT_TOKEN_BUDGET
+    if route in {"WORKOUTS", "BOTH"} and SUMMARY_RETRIEVAL_ENABLED:
+        summaries = await retrieve_summaries(query_vector, user_id, ef_search=ef_search, filters=filters)
+        if summaries:
+            coarse_to_fine = is_long_horizon(prompt, filters)
+            if coarse_to_fine:
+                filters = filters.within({workout_id for item in summaries for workout_id in item["workout_ids"]})
+            summary_tokens = rerank.context_tokens(summaries, "summary_text")
+            token_budget = max(0, token_budget - summary_tokens)
+            metrics.RAG_CONTEXT_TOKENS.labels(context="summaries").observe(summary_tokens)
+            tracing.log(f"[rag] {len(summaries)} summaries ({summary_tokens} tokens, "
+                        f"{'coarse-to-fine' if coarse_to_fine else 'added'}): "
+                        + ", ".join(f"{item['period']} of {item['period_start']}" for item in summaries))
+
     formatted_context = ""
     match route:
         case "EXERCISES":
-            data = retrieve_exercises(prompt, user_id, limit=10)
+            if rerank.RAG_RERANK_ENABLED:
+                candidates = await retrieve_exercises(query_vector, user_id, limit=rerank.RAG_CANDIDATES, ef_search=ef_search, filters=filters, with_vectors=True)
+                data = select_context(query_vector, candidates, "exercise_text", baseline=candidates[:10])
+            else:
+                data = await retrieve_exercises(query_vector, user_id, limit=10, ef_search=ef_search, filters=filters)
             formatted_context = "\n\n".join([
                 f"{item['exercise_text']}"
                 for item in data
-            ])
+            ]) or no_data_message(filters)
         case "WORKOUTS":
-            data = retrieve_workouts(prompt, user_id, limit=10)
+            if rerank.RAG_RERANK_ENABLED:
+                candidates = await retrieve_workouts(query_vector, user_id, limit=rerank.RAG_CANDIDATES, ef_search=ef_search, filters=filters, with_vectors=True)
+                data = select_context(query_vector, candidates, "workout_text", baseline=candidates[:10], token_budget=token_budget)
+            else:
+                data = await retrieve_workouts(query_vector, user_id, limit=SUMMARY_DETAIL_LIMIT if coarse_to_fine else 10, ef_search=ef_search, filters=filters)
             formatted_context = "\n\n".join([
                 f"{item['workout_text']}"
                 for item in data
-            ])
+            ]) or no_data_message(filters)
+            if summaries:
+                formatted_context = f"{format_summaries(summaries)}\n\n--- WORKOUTS ---\n{formatted_context}"
         case "BOTH":
-            exercises = retrieve_exercises(prompt, user_id, limit=5)
-            formatted_context = "--- EXERCISES ---\n"
+            if rerank.RAG_RERANK_ENABLED:
+                exercises, workouts = await retrieve_both(query_vector, user_id, exercise_limit=rerank.RAG_CANDIDATES, workout_limit=rerank.RAG_CANDIDATES, ef_search=ef_search, filters=filters, with_vectors=True)
+                # One shared budget; MMR decides the mix of exercises and workouts
+                candidates = (
+                    [{**item, "kind": "exercise", "text": item["exercise_text"]} for item in exercises]
+                    + [{**item, "kind": "workout", "text": item["workout_text"]} for item in workouts]
+                )
+                baseline = [item for item in candidates if item["kind"] == "exercise"][:5] \
+                    + [item for item in candidates if item["kind"] == "workout"][:5]
+                selected = select_context(query_vector, candidates, "text", baseline=baseline, token_budget=token_budget)
+                exercises = [item for item in selected if item["kind"] == "exercise"]
+                workouts = [item for item in selected if item["kind"] == "workout"]
+            else:
+                exercises, workouts = await retrieve_both(query_vector, user_id, exercise_limit=5, workout_limit=5, ef_search=ef_search, filters=filters)
+            formatted_context = f"{format_summaries(summaries)}\n\n" if summaries else ""
+            if not exercises and not workouts:
+                formatted_context += f"{no_data_message(filters)}\n\n"
+            formatted_context += "--- EXERCISES ---\n"
             formatted_context += "\n\n".join([
                 f"{item['exercise_text']}"
                 for item in exercises
             ])
-            workouts = retrieve_workouts(prompt, user_id, limit=5)
             formatted_context += "\n\n--- WORKOUTS ---\n"
             formatted_context += "\n\n".join([
                 f"{item['workout_text']}"
                 for item in workouts
             ])
+        case "STATS":
+            formatted_context = stats_summary
         case "NEITHER":
             formatted_context = "no relevant data found"
         case _:
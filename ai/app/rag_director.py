@@ -1,4 +1,8 @@
+import asyncio
 from langchain_mistralai import ChatMistralAI
+from . import decision_cache
+from . import fast_classifier
+from . import metrics
 
 router_llm = ChatMistralAI(
     model="ministral-3b-latest",
@@ -7,17 +11,7 @@ router_llm = ChatMistralAI(
     # other params...
 )
 
-def get_rag_direction(prompt:str, context:list=[]) -> str:
-
-    previous_queries = ""
-    if context:
-        for role, message in context:
-            if role == "human":
-                previous_queries += f"User: {message}\n"
-
-
-
-    classification_prompt = """You are a routing classifier for a fitness tracking app.
+ROUTER_PROMPT = """You are a routing classifier for a fitness tracking app.
 
     Each option refers to a DIFFERENT type of stored data:
 
@@ -35,12 +29,17 @@ def get_rag_direction(prompt:str, context:list=[]) -> str:
     BOTH:
     - Questions that need individual exercises AND full workouts
 
+    STATS:
+    - Totals, counts, records and trends over the user's history
+    - Personal records / best lifts, how many sessions, volume per week or month
+    - Answered from numbers, not from the details of particular sessions
+
     NEITHER:
     - General fitness advice or concepts
     - Not answered using stored exercise or workout data
 
     Respond with EXACTLY ONE word:
-    EXERCISES, WORKOUTS, BOTH, or NEITHER.
+    EXERCISES, WORKOUTS, BOTH, STATS, or NEITHER.
 
     Conversation previous queries:
     {previous_queries}
@@ -49,14 +48,40 @@ def get_rag_direction(prompt:str, context:list=[]) -> str:
     User: {prompt}
     """
 
-    response = router_llm.invoke([
-        ("human", classification_prompt.format(prompt=prompt, previous_queries=previous_queries)),
+router_decisions = decision_cache.DecisionCache(
+    "router", router_llm.model, ROUTER_PROMPT, enabled=decision_cache.ROUTER_DECISION_CACHE
+)
+
+async def get_rag_direction(prompt:str, context:list=[], vector_task: asyncio.Task | None = None) -> str:
+    #repeated questions reuse the earlier decision
+    route = await router_decisions.get(prompt, context)
+    if route is not None:
+        return route
+
+    #the LLM call starts right away; a confident local decision from the
+    #prompt embedding is used only if it is ready first. Follow-ups skip the
+    #fast path since the embedding doesn't see the earlier turns
+    llm_task = asyncio.create_task(_llm_route(prompt, context))
+    return await fast_classifier.router.decide(None if context else vector_task, llm_task)
+
+
+async def _llm_route(prompt: str, context: list) -> str:
+    previous_queries = ""
+    if context:
+        for role, message in context:
+            if role == "human":
+                previous_queries += f"User: {message}\n"
+
+    response = await router_llm.ainvoke([
+        ("human", ROUTER_PROMPT.format(prompt=prompt, previous_queries=previous_queries)),
     ])
+    metrics.record_llm_usage(router_llm.model, response)
     
     route = response.content.strip().upper()
 
-    if route not in {"EXERCISES", "WORKOUTS", "BOTH", "NEITHER"}:
+    if route not in {"EXERCISES", "WORKOUTS", "BOTH", "STATS", "NEITHER"}:
         route = "NEITHER"  # safe fallback
 
     print(route)
+    await router_decisions.set(prompt, context, route)
     return route
\ No newline at end of file
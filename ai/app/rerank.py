@@ -0,0 +1,89 @@
+"""
+Re-ranking of retrieved rows before they go into the answer prompt.
+
+rag.get_data over-fetches RAG_CANDIDATES rows (with their embeddings), then:
+1. Drops rows below RAG_SIMILARITY_FLOOR
+2. Orders the rest by Maximal Marginal Relevance, so near-duplicates (ten
+   identical "Biceps curl machine" sessions) don't crowd out everything else
+3. Keeps rows in that order until RAG_CONTEXT_TOKEN_BUDGET is spent
+
+Token use is compared with the old fixed top-N context and reported per
+request (log line and the rag_context_tokens histogram).
+"""
+
+import os
+import numpy as np
+from .embedding_batcher import estimate_tokens
+
+RAG_RERANK_ENABLED = os.getenv("RAG_RERANK_ENABLED", "true").lower() == "true"
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "40"))
+RAG_SIMILARITY_FLOOR = float(os.getenv("RAG_SIMILARITY_FLOOR", "0.5"))
+# 1.0 = pure relevance, 0.0 = pure diversity
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+
+
+def mmr_order(query_vector: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float = RAG_MMR_LAMBDA) -> list[int]:
+    """Indices of up to k rows of ``vectors`` in Maximal Marginal Relevance order.
+
+    Each step picks the row maximizing
+        lambda * sim(query, row) - (1 - lambda) * max sim(row, already picked)
+    The pairwise similarities are one matrix product; each step is a vector update.
+    """
+    count = len(vectors)
+    if count == 0 or k <= 0:
+        return []
+
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    query = _normalize(np.asarray(query_vector, dtype=np.float32))
+    relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+
+    selected = []
+    max_redundancy = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    for _ in range(min(k, count)):
+        redundancy = np.where(np.isfinite(max_redundancy), max_redundancy, 0.0)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_redundancy = np.maximum(max_redundancy, pairwise[best])
+    return selected
+
+
+def select_context(query_vector: np.ndarray, candidates: list[dict], text_key: str,
+                   token_budget: int = RAG_CONTEXT_TOKEN_BUDGET,
+                   similarity_floor: float = RAG_SIMILARITY_FLOOR) -> list[dict]:
+    """Filter, diversify and budget retrieved rows.
+
+    ``candidates`` are retrieval results carrying "similarity" and "embedding";
+    each row's text is ``row[text_key]``.
+    """
+    relevant = [row for row in candidates if row["similarity"] >= similarity_floor]
+    if not relevant:
+        return []
+
+    order = mmr_order(query_vector, np.stack([row["embedding"] for row in relevant]), len(relevant))
+
+    selected = []
+    used = 0
+    for i in order:
+        row = relevant[i]
+        tokens = estimate_tokens(row[text_key] or "")
+        if used + tokens > token_budget:
+            # Smaller rows further down may still fit
+            continue
+        selected.append(row)
+        used += tokens
+    return selected
+
+
+def context_tokens(rows: list[dict], text_key: str) -> int:
+    return sum(estimate_tokens(row.get(text_key) or "") for row in rows)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
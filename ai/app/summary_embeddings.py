@@ -0,0 +1,230 @@
+"""
+Weekly and monthly summary documents for long histories.
+
+Each week and month a user trained in gets one rolled-up document (workout
+count and kinds, training days, and per exercise the sessions, sets and metric
+ranges), built from the same rows workout_embeddings embeds and stored with its
+embedding in workout_summaries (11_WorkoutSummaries.sql). For long-horizon
+questions rag.get_data searches these first and then only the workouts they
+cover, so a "progress over time" question is answered from a handful of
+summaries instead of many raw sessions; other questions get the best
+summaries next to their usual results.
+
+embedding_worker keeps them current: a workout event rebuilds only the
+periods that hold the changed workouts now or held them before (a moved or
+deleted workout also refreshes its old week), and a summary whose text did
+not change is not re-embedded.
+"""
+
+import os
+from collections import Counter
+from datetime import timedelta
+from sqlmodel import text
+from . import db
+from . import embedding_batcher
+from . import metrics
+from . import tracing
+from . import workout_embeddings
+from .user_stats import PERIODS, period_end, period_start
+from langchain_mistralai import MistralAIEmbeddings
+
+SUMMARY_EMBEDDINGS_ENABLED = os.getenv("SUMMARY_EMBEDDINGS_ENABLED", "true").lower() == "true"
+
+# Metrics that add up over a period; the others are reported as a range
+TOTAL_METRICS = {"distance", "duration"}
+
+embeddings = MistralAIEmbeddings(
+    model="mistral-embed",
+)
+
+
+def update_summaries(id: int, workout_ids=(), workout_exercise_ids=()) -> int:
+    """Rebuild the summaries covering changed (or deleted) workouts; returns summaries embedded."""
+    if not SUMMARY_EMBEDDINGS_ENABLED:
+        return 0
+
+    with db.get_session() as session:
+        has_summaries = session.execute(text("""
+            SELECT EXISTS (SELECT 1 FROM workout_summaries WHERE user_id = :user_id)
+        """), {"user_id": id}).scalar()
+        if not has_summaries:
+            # First event for this user: roll up their whole history once
+            targets = None
+        else:
+            params = {
+                "user_id": id,
+                "workout_ids": list(workout_ids),
+                "workout_exercise_ids": list(workout_exercise_ids),
+            }
+            dates = session.execute(text("""
+                SELECT DISTINCT w.workout_date
+                FROM workouts w
+                WHERE w.user_id = :user_id
+                AND (w.id = ANY(:workout_ids)
+                     OR w.id IN (SELECT workout_id FROM workout_exercises
+                                 WHERE id = ANY(:workout_exercise_ids)))
+            """), params).scalars().all()
+            previous = session.execute(text("""
+                SELECT period, period_start
+                FROM workout_summaries
+                WHERE user_id = :user_id AND workout_ids && CAST(:workout_ids AS BIGINT[])
+            """), params).fetchall()
+
+            targets = {(period, period_start(day, period)) for day in dates for period in PERIODS}
+            targets |= {(row.period, row.period_start) for row in previous}
+            if not targets:
+                return 0
+
+    return _refresh(id, targets)
+
+
+def rebuild_summaries(id: int) -> int:
+    """Rebuild every summary of a user; returns summaries embedded."""
+    if not SUMMARY_EMBEDDINGS_ENABLED:
+        return 0
+    return _refresh(id, None)
+
+
+def format_summary(period: str, start, workouts: list[dict]) -> str:
+    """Summary document for one period from workout_embeddings workout dicts."""
+    last_day = period_end(start, period) - timedelta(days=1)
+    kinds = Counter(workout['workout_kind'] or "unknown" for workout in workouts)
+    title = f"Week of {start}" if period == "week" else f"Month of {start:%B %Y}"
+    lines = [
+        f"{title} ({start} to {last_day}): {len(workouts)} workouts "
+        f"({', '.join(f'{count} {kind}' for kind, count in kinds.most_common())})",
+        "Training days: " + ", ".join(str(day) for day in sorted({workout['workout_date'] for workout in workouts})),
+    ]
+
+    exercises = {}
+    for workout in workouts:
+        for exercise in workout['exercises']:
+            summary = exercises.setdefault(exercise['exercise_name'], {
+                'sessions': set(),
+                'sets': 0,
+                'metrics': {},
+            })
+            summary['sessions'].add(workout['workout_id'])
+            summary['sets'] += len(exercise['entries'])
+            for entry in exercise['entries']:
+                for metric in entry['metrics']:
+                    if metric['value_number'] is None:
+                        continue
+                    values, units = summary['metrics'].setdefault(metric['key'], ([], set()))
+                    values.append(metric['value_number'])
+                    if metric['unit']:
+                        units.add(metric['unit'])
+
+    for name, summary in sorted(exercises.items(), key=lambda item: (-len(item[1]['sessions']), item[0])):
+        parts = [f"{len(summary['sessions'])} sessions", f"{summary['sets']} sets"]
+        for key, (values, units) in summary['metrics'].items():
+            unit = f" {'/'.join(sorted(units))}" if units else ""
+            if key in TOTAL_METRICS:
+                parts.append(f"{key} total {_value(sum(values))}{unit}")
+            elif min(values) == max(values):
+                parts.append(f"{key} {_value(max(values))}{unit}")
+            else:
+                parts.append(f"{key} {_value(min(values))}-{_value(max(values))}{unit}")
+        lines.append(f"{name}: {', '.join(parts)}")
+
+    return "\n".join(lines)
+
+
+def _refresh(id: int, targets: set | None) -> int:
+    """Rebuild the (period, period_start) summaries in ``targets`` (all if None)."""
+    params = {"user_id": id}
+    range_filter = ""
+    range_from = range_to = None
+    if targets is not None:
+        range_from = min(start for _, start in targets)
+        range_to = max(period_end(start, period) for period, start in targets)
+        params.update({"range_from": range_from, "range_to": range_to})
+        range_filter = "AND period_start >= :range_from AND period_start < :range_to"
+
+    # Bucket the workouts of the affected periods
+    periods = {}
+    for workout in workout_embeddings.get_workouts_between(id, range_from, range_to):
+        for period in PERIODS:
+            key = (period, period_start(workout['workout_date'], period))
+            if targets is None or key in targets:
+                periods.setdefault(key, []).append(workout)
+
+    with db.get_session() as session:
+        existing = {
+            (row.period, row.period_start): row
+            for row in session.execute(text(f"""
+                SELECT period, period_start, summary_text, workout_ids,
+                       embeddings IS NOT NULL AS embedded
+                FROM workout_summaries
+                WHERE user_id = :user_id
+                {range_filter}
+            """), params)
+        }
+
+        # Periods that no longer have any workouts
+        emptied = [key for key in existing if key not in periods and (targets is None or key in targets)]
+        if emptied:
+            session.execute(text("""
+                DELETE FROM workout_summaries
+                WHERE user_id = :user_id AND period = :period AND period_start = :period_start
+            """), [{"user_id": id, "period": period, "period_start": start} for period, start in emptied])
+            session.commit()
+
+    pending = []
+    workout_ids = {}
+    for (period, start), workouts in periods.items():
+        key = (period, start)
+        summary_text = format_summary(period, start, workouts)
+        workout_ids[key] = sorted(workout['workout_id'] for workout in workouts)
+        row = existing.get(key)
+        if row is not None and row.embedded and row.summary_text == summary_text \
+                and sorted(row.workout_ids) == workout_ids[key]:
+            continue
+        pending.append((key, summary_text))
+
+    saved = 0
+    for batch in embedding_batcher.embed_batches(embeddings, pending):
+        save_summary_embeddings(id, batch, workout_ids)
+        saved += len(batch)
+        metrics.ROWS_EMBEDDED.labels(kind="summary").inc(len(batch))
+
+    if saved or emptied:
+        tracing.log(f"  🗓️  Summaries: {saved} embedded, {len(emptied)} removed")
+    return saved
+
+
+def save_summary_embeddings(id: int, summary_embeddings, workout_ids: dict) -> None:
+    """Upsert (vector, (period, period_start), summary_text) tuples for a user."""
+    query = """INSERT INTO workout_summaries (
+                   user_id, period, period_start, period_end, workout_ids, summary_text, embeddings, updated_at
+               )
+               VALUES (:user_id, :period, :period_start, :period_end, :workout_ids, :text,
+                       CAST(:embedding AS vector), now())
+               ON CONFLICT (user_id, period, period_start)
+               DO UPDATE SET period_end = EXCLUDED.period_end,
+                             workout_ids = EXCLUDED.workout_ids,
+                             summary_text = EXCLUDED.summary_text,
+                             embeddings = EXCLUDED.embeddings,
+                             updated_at = now()"""
+
+    with db.get_session() as session:
+        for start in range(0, len(summary_embeddings), db.BULK_WRITE_CHUNK_SIZE):
+            chunk = summary_embeddings[start:start + db.BULK_WRITE_CHUNK_SIZE]
+            params = [
+                {
+                    "user_id": id,
+                    "period": period,
+                    "period_start": start_date,
+                    "period_end": period_end(start_date, period),
+                    "workout_ids": workout_ids[(period, start_date)],
+                    "text": summary_text,
+                    "embedding": vector,
+                }
+                for vector, (period, start_date), summary_text in chunk
+            ]
+            session.execute(text(query), params)
+            session.commit()
+
+
+def _value(value: float) -> str:
+    return f"{value:g}"
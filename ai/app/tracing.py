@@ -0,0 +1,60 @@
+"""
+Request ids and per-stage timing spans.
+
+A request id lives in a contextvar: set once per /chat (or per user in the
+embedding worker), it follows the pipeline into asyncio tasks and into
+executor.run_sync, and log() prefixes every line with it.
+
+span() times one stage, records it in a stage-labelled histogram and logs the
+duration and outcome:
+
+    with tracing.span(metrics.AGENT_STAGE_SECONDS, "retrieval"):
+        ...
+"""
+
+import asyncio
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Client-supplied ids (X-Request-ID) are only kept if they look like ids
+_VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def set_request_id(value: str | None = None) -> str:
+    """Set (or generate) the request id for the current context and return it."""
+    if not value or not _VALID_REQUEST_ID.fullmatch(value):
+        value = new_request_id()
+    request_id.set(value)
+    return value
+
+
+def log(message: str) -> None:
+    print(f"[req={request_id.get()}] {message}")
+
+
+@contextmanager
+def span(histogram, stage: str):
+    """Time the enclosed block as ``stage`` of ``histogram``."""
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.labels(stage=stage).observe(elapsed)
+        log(f"span stage={stage} duration_ms={elapsed * 1000:.1f} status={status}")
@@ -0,0 +1,366 @@
+"""
+Per-user training aggregates for the STATS route.
+
+Questions like "what's my bench PR" or "how many times did I train this month"
+are answered from three small tables (10_UserStats.sql) instead of retrieved
+rows:
+- user_exercise_stats: per exercise sessions, sets, reps, volume, best weight,
+  max reps and estimated 1RM
+- user_period_stats:   per week / month workouts, exercises, sets, volume
+- user_stats_sources:  what each workout last contributed (date, exercise ids)
+
+embedding_worker keeps them current. For each workout-logged event only the
+exercises and periods the changed workouts touch (before and after the change)
+are recomputed from the source rows; a user's first event, and legacy
+events without ids, rebuild the user's whole history once.
+
+Set USER_STATS_ENABLED=false to stop maintaining them and route STATS
+questions to ordinary retrieval.
+"""
+
+import os
+from datetime import date, timedelta
+from sqlmodel import text
+from . import db
+from . import metrics
+from . import tracing
+
+USER_STATS_ENABLED = os.getenv("USER_STATS_ENABLED", "true").lower() == "true"
+# Size of the summary handed to the answer model
+USER_STATS_EXERCISES = int(os.getenv("USER_STATS_EXERCISES", "15"))
+USER_STATS_WEEKS = int(os.getenv("USER_STATS_WEEKS", "8"))
+USER_STATS_MONTHS = int(os.getenv("USER_STATS_MONTHS", "6"))
+
+PERIODS = ("week", "month")
+
+# One row per set (entry) with its weight and reps; {where} narrows the scan
+SETS_SQL = """
+    SELECT we.exercise_id,
+           w.id AS workout_id,
+           w.workout_date,
+           en.id AS entry_id,
+           MAX(em.value_number) FILTER (WHERE md.key = 'weight') AS weight,
+           MAX(em.value_number) FILTER (WHERE md.key = 'reps') AS reps
+    FROM workouts w
+    LEFT JOIN workout_exercises we ON w.id = we.workout_id
+    LEFT JOIN entries en ON we.id = en.workout_exercise_id
+    LEFT JOIN entry_metrics em ON en.id = em.entry_id
+    LEFT JOIN metric_definitions md ON em.metric_id = md.id
+    WHERE w.user_id = :user_id{where}
+    GROUP BY we.exercise_id, w.id, w.workout_date, en.id
+"""
+
+# Per-exercise aggregates over the rows of SETS_SQL, grouped by exercise_id
+EXERCISE_AGGREGATES_SQL = """
+    COUNT(DISTINCT workout_id) AS sessions,
+    COUNT(entry_id) AS sets,
+    COALESCE(SUM(reps), 0) AS total_reps,
+    COALESCE(SUM(weight * reps), 0) AS total_volume,
+    MAX(weight) AS max_weight,
+    (ARRAY_AGG(workout_date ORDER BY weight DESC, workout_date) FILTER (WHERE weight IS NOT NULL))[1] AS max_weight_date,
+    MAX(reps) AS max_reps,
+    MAX(weight * (1 + reps / 30.0)) AS best_e1rm,
+    MIN(workout_date) AS first_performed,
+    MAX(workout_date) AS last_performed"""
+
+
+def update_workouts(user_id: int, workout_ids=(), workout_exercise_ids=()) -> None:
+    """Refresh the aggregates touched by changed (or deleted) workouts."""
+    if not USER_STATS_ENABLED:
+        return
+
+    with db.get_session() as session:
+        if not _has_sources(session, user_id):
+            # Aggregates were never built for this user; a partial refresh would
+            # leave out their older history
+            _rebuild(session, user_id)
+            session.commit()
+            metrics.USER_STATS_UPDATES.labels(mode="rebuild").inc()
+            return
+
+        workout_ids = set(workout_ids) | _workouts_of(session, user_id, workout_exercise_ids)
+        if not workout_ids:
+            return
+        workout_ids = list(workout_ids)
+
+        # Before the change (from the snapshot) and after it (from the source rows)
+        before = session.execute(text("""
+            SELECT workout_date, exercise_ids
+            FROM user_stats_sources
+            WHERE user_id = :user_id AND workout_id = ANY(:workout_ids)
+        """), {"user_id": user_id, "workout_ids": workout_ids}).fetchall()
+        after = session.execute(text("""
+            SELECT w.workout_date, ARRAY_REMOVE(ARRAY_AGG(we.exercise_id), NULL) AS exercise_ids
+            FROM workouts w
+            LEFT JOIN workout_exercises we ON w.id = we.workout_id
+            WHERE w.user_id = :user_id AND w.id = ANY(:workout_ids)
+            GROUP BY w.id, w.workout_date
+        """), {"user_id": user_id, "workout_ids": workout_ids}).fetchall()
+
+        exercise_ids = {exercise_id for row in before + after for exercise_id in row.exercise_ids}
+        dates = {row.workout_date for row in before + after}
+
+        if exercise_ids:
+            _refresh_exercises(session, user_id, list(exercise_ids))
+        if dates:
+            for period in PERIODS:
+                _refresh_periods(session, user_id, period, sorted({period_start(day, period) for day in dates}))
+        _save_sources(session, user_id, workout_ids)
+        session.commit()
+
+    metrics.USER_STATS_UPDATES.labels(mode="incremental").inc()
+    tracing.log(f"  📈 Stats: {len(workout_ids)} workouts, {len(exercise_ids)} exercises, {len(dates)} dates")
+
+
+def rebuild(user_id: int) -> None:
+    """Recompute all of a user's aggregates from their workouts."""
+    if not USER_STATS_ENABLED:
+        return
+
+    with db.get_session() as session:
+        _rebuild(session, user_id)
+        session.commit()
+    metrics.USER_STATS_UPDATES.labels(mode="rebuild").inc()
+    tracing.log(f"  📈 Stats rebuilt for user {user_id}")
+
+
+def period_start(day: date, period: str) -> date:
+    """Monday of the week (as Postgres date_trunc('week')) or first of the month."""
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def period_end(start: date, period: str) -> date:
+    """Exclusive end of the period beginning on ``start``."""
+    if period == "week":
+        return start + timedelta(weeks=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def _rebuild(session, user_id: int) -> None:
+    _refresh_exercises(session, user_id)
+    for period in PERIODS:
+        _refresh_periods(session, user_id, period)
+    _save_sources(session, user_id)
+
+
+def _has_sources(session, user_id: int) -> bool:
+    return session.execute(text("""
+        SELECT EXISTS (SELECT 1 FROM user_stats_sources WHERE user_id = :user_id)
+    """), {"user_id": user_id}).scalar()
+
+
+def _workouts_of(session, user_id: int, workout_exercise_ids) -> set[int]:
+    if not workout_exercise_ids:
+        return set()
+    result = session.execute(text("""
+        SELECT DISTINCT workout_id
+        FROM workout_exercises
+        WHERE user_id = :user_id AND id = ANY(:workout_exercise_ids)
+    """), {"user_id": user_id, "workout_exercise_ids": list(workout_exercise_ids)})
+    return set(result.scalars())
+
+
+def _refresh_exercises(session, user_id: int, exercise_ids: list[int] | None = None) -> None:
+    """Recompute user_exercise_stats for ``exercise_ids`` (all exercises if None)."""
+    params = {"user_id": user_id}
+    stats_filter = ""
+    sets_filter = "\n AND we.exercise_id IS NOT NULL"
+    if exercise_ids is not None:
+        params["exercise_ids"] = exercise_ids
+        stats_filter = " AND exercise_id = ANY(:exercise_ids)"
+        sets_filter = "\n AND we.user_id = :user_id AND we.exercise_id = ANY(:exercise_ids)"
+
+    # Exercises no longer in any workout simply aren't re-inserted
+    session.execute(text(f"""
+        DELETE FROM user_exercise_stats
+        WHERE user_id = :user_id{stats_filter}
+    """), params)
+    session.execute(text(f"""
+        WITH sets AS ({SETS_SQL.format(where=sets_filter)})
+        INSERT INTO user_exercise_stats (
+            user_id, exercise_id, sessions, sets, total_reps, total_volume,
+            max_weight, max_weight_date, max_reps, best_e1rm,
+            first_performed, last_performed, updated_at
+        )
+        SELECT :user_id,
+               exercise_id,{EXERCISE_AGGREGATES_SQL},
+               now()
+        FROM sets
+        GROUP BY exercise_id
+    """), params)
+
+
+def _refresh_periods(session, user_id: int, period: str, starts: list[date] | None = None) -> None:
+    """Recompute user_period_stats for the periods beginning on ``starts`` (all if None)."""
+    params = {"user_id": user_id, "period": period}
+    stats_filter = ""
+    sets_filter = ""
+    if starts is not None:
+        # The date range lets the scan use (user_id, workout_date); ANY drops the gaps
+        params.update({"starts": starts, "range_from": min(starts), "range_to": max(starts) + timedelta(days=31)})
+        stats_filter = " AND period_start = ANY(:starts)"
+        sets_filter = """
+            AND w.workout_date >= :range_from AND w.workout_date < :range_to
+            AND date_trunc(:period, w.workout_date::timestamp)::date = ANY(:starts)"""
+
+    session.execute(text(f"""
+        DELETE FROM user_period_stats
+        WHERE user_id = :user_id AND period = :period{stats_filter}
+    """), params)
+    session.execute(text(f"""
+        WITH sets AS ({SETS_SQL.format(where=sets_filter)})
+        INSERT INTO user_period_stats (
+            user_id, period, period_start, workouts, exercises, sets,
+            total_reps, total_volume, updated_at
+        )
+        SELECT :user_id,
+               :period,
+               date_trunc(:period, workout_date::timestamp)::date,
+               COUNT(DISTINCT workout_id),
+               COUNT(DISTINCT exercise_id),
+               COUNT(entry_id),
+               COALESCE(SUM(reps), 0),
+               COALESCE(SUM(weight * reps), 0),
+               now()
+        FROM sets
+        GROUP BY 3
+    """), params)
+
+
+def _save_sources(session, user_id: int, workout_ids: list[int] | None = None) -> None:
+    """Snapshot what ``workout_ids`` (all workouts if None) now contribute; deleted ones drop out."""
+    params = {"user_id": user_id}
+    sources_filter = ""
+    workouts_filter = ""
+    if workout_ids is not None:
+        params["workout_ids"] = workout_ids
+        sources_filter = " AND workout_id = ANY(:workout_ids)"
+        workouts_filter = " AND w.id = ANY(:workout_ids)"
+
+    session.execute(text(f"""
+        DELETE FROM user_stats_sources
+        WHERE user_id = :user_id{sources_filter}
+    """), params)
+    session.execute(text(f"""
+        INSERT INTO user_stats_sources (workout_id, user_id, workout_date, exercise_ids)
+        SELECT w.id, w.user_id, w.workout_date, ARRAY_REMOVE(ARRAY_AGG(we.exercise_id), NULL)
+        FROM workouts w
+        LEFT JOIN workout_exercises we ON w.id = we.workout_id
+        WHERE w.user_id = :user_id{workouts_filter}
+        GROUP BY w.id, w.user_id, w.workout_date
+    """), params)
+
+
+async def get_summary(user_id: int, filters=None) -> str | None:
+    """Compact numeric summary of a user's training, or None if no aggregates exist yet.
+
+    Exercises named in the question (query_filters) narrow the exercise lines.
+    A date range narrows the weeks and months, and the exercise lines are then
+    computed from that range's sets instead of read from the all-time table.
+    """
+    if not USER_STATS_ENABLED:
+        return None
+
+    params = {"user_id": user_id}
+    exercise_filter = ""
+    period_filter = ""
+    if filters is not None and filters.exercise_ids:
+        params["exercise_ids"] = filters.exercise_ids
+        exercise_filter = " AND s.exercise_id = ANY(:exercise_ids)"
+    if filters is not None and filters.date_from is not None:
+        params["date_from"] = filters.date_from
+        params["date_to"] = filters.date_to
+        # Periods overlapping [date_from, date_to)
+        period_filter = """
+            AND period_start < :date_to
+            AND period_start >= date_trunc(period, CAST(:date_from AS timestamp))::date"""
+
+    async with db.get_async_session() as session:
+        total = (await session.execute(text("""
+            SELECT SUM(workouts) AS workouts, SUM(sets) AS sets,
+                   SUM(total_volume) AS volume, MIN(period_start) AS since
+            FROM user_period_stats
+            WHERE user_id = :user_id AND period = 'month'
+        """), {"user_id": user_id})).one()
+        if not total.workouts:
+            return None
+
+        if period_filter:
+            # Only the range's sets; the exercise filter moves into the scan
+            sets_filter = "\n AND w.workout_date >= :date_from AND w.workout_date < :date_to AND we.exercise_id IS NOT NULL"
+            if exercise_filter:
+                sets_filter += " AND we.exercise_id = ANY(:exercise_ids)"
+            exercise_source = f"""(
+                WITH sets AS ({SETS_SQL.format(where=sets_filter)})
+                SELECT exercise_id,{EXERCISE_AGGREGATES_SQL}
+                FROM sets
+                GROUP BY exercise_id
+            )"""
+            exercise_where = ""
+        else:
+            exercise_source = "user_exercise_stats"
+            exercise_where = f"\n WHERE s.user_id = :user_id{exercise_filter}"
+        exercises = (await session.execute(text(f"""
+            SELECT e.name, s.sessions, s.sets, s.total_reps, s.total_volume,
+                   s.max_weight, s.max_weight_date, s.max_reps, s.best_e1rm, s.last_performed
+            FROM {exercise_source} s
+            JOIN exercises e ON s.exercise_id = e.id{exercise_where}
+            ORDER BY s.sessions DESC, s.last_performed DESC
+            LIMIT :limit
+        """), {**params, "limit": USER_STATS_EXERCISES})).fetchall()
+
+        periods = {}
+        for period, limit in (("week", USER_STATS_WEEKS), ("month", USER_STATS_MONTHS)):
+            periods[period] = (await session.execute(text(f"""
+                SELECT period_start, workouts, exercises, sets, total_volume
+                FROM user_period_stats
+                WHERE user_id = :user_id AND period = :period{period_filter}
+                ORDER BY period_start DESC
+                LIMIT :limit
+            """), {**params, "period": period, "limit": limit})).fetchall()
+
+    lines = ["--- TRAINING STATS ---"]
+    lines.append(
+        f"Total since {total.since:%Y-%m}: {total.workouts} workouts, {total.sets} sets, "
+        f"volume {_number(total.volume)} (weight x reps, units as logged)"
+    )
+
+    if period_filter:
+        last_day = filters.date_to - timedelta(days=1)
+        lines.append(f"\n--- EXERCISES ({filters.date_from} to {last_day}) ---")
+    else:
+        lines.append("\n--- EXERCISES (all time) ---")
+    for row in exercises:
+        line = f"{row.name}: {row.sessions} sessions, {row.sets} sets, {_number(row.total_reps)} reps, last {row.last_performed}"
+        if row.max_weight is not None:
+            line += f" | best weight {_number(row.max_weight)} ({row.max_weight_date})"
+        if row.max_reps is not None:
+            line += f", max reps {_number(row.max_reps)}"
+        if row.best_e1rm is not None:
+            line += f", est. 1RM {_number(row.best_e1rm)}"
+        if row.total_volume:
+            line += f", volume {_number(row.total_volume)}"
+        lines.append(line)
+    if not exercises:
+        lines.append("no matching exercises")
+
+    for period, heading, label in (("week", "WEEKS (starting Monday)", "{:%Y-%m-%d}"), ("month", "MONTHS", "{:%Y-%m}")):
+        lines.append(f"\n--- {heading} ---")
+        lines.extend(
+            f"{label.format(row.period_start)}: {row.workouts} workouts, {row.exercises} exercises, "
+            f"{row.sets} sets, volume {_number(row.total_volume)}"
+            for row in periods[period]
+        )
+        if not periods[period]:
+            lines.append("no workouts")
+
+    return "\n".join(lines)
+
+
+def _number(value) -> str:
+    if value is None:
+        return "-"
+    value = round(float(value), 1)
+    return f"{value:,.0f}" if value == int(value) else f"{value:,.1f}"
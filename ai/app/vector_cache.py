@@ -0,0 +1,221 @@
+"""
+In-process retrieval tier for hot users.
+
+Once a user has asked HOT_VECTOR_CACHE_MIN_REQUESTS questions within the TTL,
+their exercise and workout embeddings are loaded into one contiguous float32
+matrix per kind (unit rows, with ids and texts in parallel arrays). Top-k is
+then a single matrix-vector product plus argpartition, with no DB round trip.
+
+- Memory-bounded LRU: least recently used users are evicted once the
+  matrices exceed HOT_VECTOR_CACHE_MAX_BYTES
+- Entries expire after HOT_VECTOR_CACHE_TTL_SECONDS
+- The embedding pipelines invalidate a user's entries whenever they save
+  rows, in every process: the saving process drops them directly and sends a
+  NOTIFY on VECTOR_CACHE_CHANNEL, and each API process holds one LISTEN
+  connection that drops the named entries (so rows saved by embedding_worker
+  are seen on the next question). While that connection is down, every
+  entry is dropped on reconnect and the TTL bounds staleness
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import psycopg
+from sqlmodel import text
+from . import db
+from . import metrics
+from . import tracing
+from .cache import TTLCache
+
+HOT_VECTOR_CACHE_ENABLED = os.getenv("HOT_VECTOR_CACHE_ENABLED", "false").lower() == "true"
+HOT_VECTOR_CACHE_MAX_BYTES = int(os.getenv("HOT_VECTOR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+HOT_VECTOR_CACHE_TTL_SECONDS = float(os.getenv("HOT_VECTOR_CACHE_TTL_SECONDS", "120"))
+HOT_VECTOR_CACHE_MIN_REQUESTS = int(os.getenv("HOT_VECTOR_CACHE_MIN_REQUESTS", "2"))
+VECTOR_CACHE_CHANNEL = "vector_cache_invalidations"  # payload "<user_id>:<kind>"
+
+# kind -> (table, text column)
+SOURCES = {
+    "exercise": ("workout_exercises", "exercise_text"),
+    "workout": ("workouts", "workout_text"),
+}
+
+
+class UserVectors:
+    def __init__(self, ids: np.ndarray, texts: list[str], matrix: np.ndarray):
+        """One user's embeddings of one kind; matrix rows are unit length."""
+        self.ids = ids
+        self.texts = texts
+        self.matrix = matrix
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.ids.nbytes + sum(len(t or "") for t in self.texts)
+
+    def top_k(self, query_vector: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, cosine similarities) of the k best rows, best first."""
+        if not len(self.ids) or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        similarities = self.matrix @ query
+
+        if k < len(similarities):
+            candidates = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            candidates = np.arange(len(similarities))
+        order = candidates[np.argsort(-similarities[candidates])]
+        return order, similarities[order]
+
+
+class HotVectorCache:
+    def __init__(self, max_bytes: int = HOT_VECTOR_CACHE_MAX_BYTES, ttl: float = HOT_VECTOR_CACHE_TTL_SECONDS,
+                 min_requests: int = HOT_VECTOR_CACHE_MIN_REQUESTS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.min_requests = min_requests
+        self.nbytes = 0
+        self._entries = OrderedDict()  # (user_id, kind) -> (expires_at, UserVectors)
+        self._generations = {}         # user_id -> bumped on every invalidation
+        self._requests = TTLCache(maxsize=10000, ttl=ttl)  # (user_id, kind) -> recent lookups
+        self._lock = threading.Lock()
+        self._listener = None
+
+    async def lookup(self, user_id: int, kind: str) -> UserVectors | None:
+        """Cached vectors for a hot user, loading them if needed; None means use the DB."""
+        if not HOT_VECTOR_CACHE_ENABLED:
+            return None
+        self._ensure_listener()
+
+        entry = self._get(user_id, kind)
+        if entry is not None:
+            metrics.HOT_VECTOR_CACHE_LOOKUPS.labels(kind=kind, outcome="hit").inc()
+            return entry
+
+        if not self._is_hot(user_id, kind):
+            metrics.HOT_VECTOR_CACHE_LOOKUPS.labels(kind=kind, outcome="cold").inc()
+            return None
+
+        metrics.HOT_VECTOR_CACHE_LOOKUPS.labels(kind=kind, outcome="load").inc()
+        generation = self._generations.get(user_id, 0)
+        entry = await _load(user_id, kind)
+        self._put(user_id, kind, entry, generation)
+        return entry
+
+    def invalidate(self, user_id: int, kind: str | None = None, notify: bool = False) -> None:
+        """Drop a user's cached vectors (all kinds unless ``kind`` is given).
+
+        ``notify`` also tells every other process (see VECTOR_CACHE_CHANNEL);
+        the embedding pipelines pass it after saving rows.
+        """
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == user_id and kind in (None, key[1])]:
+                self._drop(key)
+        if notify:
+            try:
+                with db.get_session() as session:
+                    session.execute(text("SELECT pg_notify(:channel, :payload)"), {
+                        "channel": VECTOR_CACHE_CHANNEL,
+                        "payload": f"{user_id}:{kind or ''}",
+                    })
+                    session.commit()
+            except Exception as e:
+                tracing.log(f"[vector_cache] invalidation NOTIFY failed, other processes wait for the TTL: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            # Loads in flight started before the clear must not be stored
+            for user_id in {user_id for user_id, _ in self._entries} | set(self._generations):
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._entries.clear()
+            self.nbytes = 0
+            metrics.HOT_VECTOR_CACHE_BYTES.set(0)
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        """Hold one LISTEN connection and drop the entries other processes invalidate."""
+        conninfo = db.ENGINE_URL.set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {VECTOR_CACHE_CHANNEL}")
+                    # Anything saved while we weren't listening went unannounced
+                    self.clear()
+                    async for notify in conn.notifies():
+                        user_id, _, kind = notify.payload.partition(":")
+                        self.invalidate(int(user_id), kind or None)
+            except Exception as e:
+                tracing.log(f"[vector_cache] LISTEN connection lost: {e}; reconnecting")
+                self.clear()
+                await asyncio.sleep(1)
+
+    def _is_hot(self, user_id: int, kind: str) -> bool:
+        # Counted per kind: a question may only ever search one of them
+        key = (user_id, kind)
+        count = (self._requests.get(key) or 0) + 1
+        self._requests.set(key, count)
+        return count >= self.min_requests
+
+    def _get(self, user_id: int, kind: str) -> UserVectors | None:
+        key = (user_id, kind)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, user_id: int, kind: str, entry: UserVectors, generation: int) -> None:
+        if entry.nbytes > self.max_bytes:
+            return
+        key = (user_id, kind)
+        with self._lock:
+            # Rows were saved while we were loading; this snapshot is already stale
+            if self._generations.get(user_id, 0) != generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+            metrics.HOT_VECTOR_CACHE_BYTES.set(self.nbytes)
+
+    def _drop(self, key) -> None:
+        _, entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+        metrics.HOT_VECTOR_CACHE_BYTES.set(self.nbytes)
+
+
+async def _load(user_id: int, kind: str) -> UserVectors:
+    table, text_column = SOURCES[kind]
+    async with db.get_async_session() as session:
+        result = await session.execute(text(f"""
+            SELECT id, {text_column} AS text, embeddings
+            FROM {table}
+            WHERE user_id = :user_id AND embeddings IS NOT NULL
+            ORDER BY id
+        """), {"user_id": user_id})
+        rows = result.fetchall()
+
+    if not rows:
+        return UserVectors(np.empty(0, dtype=np.int64), [], np.empty((0, 0), dtype=np.float32))
+
+    matrix = np.stack([np.asarray(row.embeddings, dtype=np.float32) for row in rows])
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+    return UserVectors(ids, [row.text for row in rows], matrix)
+
+
+cache = HotVectorCache()
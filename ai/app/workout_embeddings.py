@@ -1,12 +1,54 @@
+from itertools import groupby
 from sqlmodel import Session, SQLModel, text
 from . import db
+from . import embedding_batcher
+from . import metrics
+from . import vector_cache
 from langchain_mistralai import MistralAIEmbeddings
 
 embeddings = MistralAIEmbeddings(
     model="mistral-embed",
 )
 
-def get_unembedded_workouts(id: int):
+def get_unembedded_workouts(id: int, limit: int | None = None):
+    """Stream a user's unembedded workouts, one dict at a time.
+
+    When ``limit`` is given only the ``limit`` newest workouts (by id) are returned.
+    """
+    newest_filter = ""
+    params = {"user_id": id}
+    if limit is not None:
+        newest_filter = """AND w.id IN (
+                    SELECT w2.id
+                    FROM workouts w2
+                    WHERE w2.embeddings IS NULL
+                    AND w2.user_id = :user_id
+                    ORDER BY w2.id DESC
+                    LIMIT :limit)"""
+        params["limit"] = limit
+
+    yield from _stream_workouts(f"""w.embeddings IS NULL
+                AND w.user_id = :user_id
+                {newest_filter}""", params)
+
+
+def _stream_workouts(where: str, params: dict):
+    """Fetch the matching workouts a page at a time and group them.
+
+    Like exercise_embeddings._stream_exercises: ids first, then one short
+    session per page of db.STREAM_PAGE_SIZE workouts, closed before yielding.
+    """
+    with db.get_session() as session:
+        ids = session.execute(text(f"""SELECT w.id
+                FROM workouts w
+                WHERE {where}
+                ORDER BY w.id"""), params).scalars().all()
+
+    for start in range(0, len(ids), db.STREAM_PAGE_SIZE):
+        yield from _fetch_workouts(ids[start:start + db.STREAM_PAGE_SIZE])
+
+
+def _fetch_workouts(workout_ids: list[int]):
     query = """SELECT 
                     w.id AS workout_id,
                     w.workout_date,
@@ -26,56 +68,51 @@ def get_unembedded_workouts(id: int):
                 LEFT JOIN entries en ON we.id = en.workout_exercise_id
                 LEFT JOIN entry_metrics em ON en.id = em.entry_id
                 LEFT JOIN metric_definitions md ON em.metric_id = md.id
-                WHERE w.embeddings IS NULL
-                AND w.user_id = :user_id
+                WHERE w.id = ANY(:workout_ids)
                 ORDER BY w.id, we.id, en.entry_index;"""
     
     with db.get_session() as session:
-        result = session.execute(text(query), {"user_id": id})
-        rows = result.fetchall()
+        rows = session.execute(text(query), {"workout_ids": workout_ids}).fetchall()
+
+    for w_id, workout_rows in groupby(rows, key=lambda row: row.workout_id):
+        workout = None
+        for we_id, exercise_rows in groupby(workout_rows, key=lambda row: row.workout_exercise_id):
+            exercise = None
+            for row in exercise_rows:
+                if workout is None:
+                    workout = {
+                        'workout_id': w_id,
+                        'workout_date': row.workout_date,
+                        'workout_kind': row.workout_kind,
+                        'exercises': []
+                    }
+
+                if exercise is None:
+                    exercise = {
+                        'workout_exercise_id': we_id,
+                        'exercise_name': row.exercise_name,
+                        'note': row.note,
+                        'entries': {}
+                    }
+
+                if row.entry_id and row.entry_id not in exercise['entries']:
+                    exercise['entries'][row.entry_id] = {
+                        'entry_index': row.entry_index,
+                        'metrics': []
+                    }
+
+                if row.metric_key:
+                    exercise['entries'][row.entry_id]['metrics'].append({
+                        'key': row.metric_key,
+                        'value_number': row.value_number,
+                        'value_text': row.value_text,
+                        'unit': row.unit
+                    })
 
-    workouts_dict = {}
-    for row in rows:
-        w_id = row.workout_id
-        we_id = row.workout_exercise_id
-        
-        if w_id not in workouts_dict:
-            workouts_dict[w_id] = {
-                'workout_id': w_id,
-                'workout_date': row.workout_date,
-                'workout_kind': row.workout_kind,
-                'exercises': {}
-            }
-        
-        if we_id not in workouts_dict[w_id]['exercises']:
-            workouts_dict[w_id]['exercises'][we_id] = {
-                'workout_exercise_id': we_id,
-                'exercise_name': row.exercise_name,
-                'note': row.note,
-                'entries': {}
-            }
-        
-        if row.entry_id and row.entry_id not in workouts_dict[w_id]['exercises'][we_id]['entries']:
-            workouts_dict[w_id]['exercises'][we_id]['entries'][row.entry_id] = {
-                'entry_index': row.entry_index,
-                'metrics': []
-            }
-        
-        if row.metric_key:
-            workouts_dict[w_id]['exercises'][we_id]['entries'][row.entry_id]['metrics'].append({
-                'key': row.metric_key,
-                'value_number': row.value_number,
-                'value_text': row.value_text,
-                'unit': row.unit
-            })
-    
-    # Convert nested dictionaries to lists
-    for w_id in workouts_dict:
-        workouts_dict[w_id]['exercises'] = list(workouts_dict[w_id]['exercises'].values())
-        for exercise in workouts_dict[w_id]['exercises']:
             exercise['entries'] = list(exercise['entries'].values())
-    
-    return list(workouts_dict.values())
+            workout['exercises'].append(exercise)
+
+        yield workout
 
 
 def print_workouts(workouts):
@@ -101,50 +138,44 @@ def print_workouts(workouts):
 
 # (int, str) list
 def format_workouts(workouts):
-    formatted = []
-    
-    for workout in workouts:
-        # Build the embedding text for the entire workout
-        embedding_lines = [f"Workout on {workout['workout_date']} ({workout['workout_kind']})"]
-        
-        for exercise in workout['exercises']:
-            embedding_lines.append(f"Performed {exercise['exercise_name']}")
-            
-            if exercise['note'] is not None:
-                embedding_lines.append(f"  Note: {exercise['note']}")
-            
-            for entry in sorted(exercise['entries'], key=lambda e: e['entry_index']):
-                metrics_str = ", ".join([
-                    f"{metric['key']} {metric['value_number']}{' ' + metric['unit'] if metric['unit'] else ''}"
-                    for metric in entry['metrics']
-                ])
-                embedding_lines.append(f"  {metrics_str}")
-        
-        # Combine lines into single string
-        embedding_text = "\n".join(embedding_lines)
-        
-        # Add tuple of (workout_id, embedding_text)
-        formatted.append((workout['workout_id'], embedding_text))
+    formatted = [format_workout(workout) for workout in workouts]
     
     #print(formatted[0][1])
 
     return formatted
 
-def make_workout_embeddings(formatted_workouts):
-    # Extract texts from (workout_id, embedding_text) tuples
-    texts = [embedding_text for _, embedding_text in formatted_workouts]
+
+# (int, str)
+def format_workout(workout):
+    # Build the embedding text for the entire workout
+    embedding_lines = [f"Workout on {workout['workout_date']} ({workout['workout_kind']})"]
     
-    # Get embeddings from LangChain
-    vectors = embeddings.embed_documents(texts)
+    for exercise in workout['exercises']:
+        embedding_lines.append(f"Performed {exercise['exercise_name']}")
+        
+        if exercise['note'] is not None:
+            embedding_lines.append(f"  Note: {exercise['note']}")
+        
+        for entry in sorted(exercise['entries'], key=lambda e: e['entry_index']):
+            metrics_str = ", ".join([
+                f"{metric['key']} {metric['value_number']}{' ' + metric['unit'] if metric['unit'] else ''}"
+                for metric in entry['metrics']
+            ])
+            embedding_lines.append(f"  {metrics_str}")
     
-    # Combine vectors with original IDs and texts
-    results = [
-        (vector, workout_id, embedding_text)
-        for vector, (workout_id, embedding_text) in zip(vectors, formatted_workouts)
-    ]
+    # Combine lines into single string
+    embedding_text = "\n".join(embedding_lines)
     
-    #print(results[0])
-    return results
+    # Tuple of (workout_id, embedding_text)
+    return (workout['workout_id'], embedding_text)
+
+def make_workout_embeddings(formatted_workouts):
+    """Embed (workout_id, embedding_text) tuples batch by batch.
+
+    Yields lists of (vector, workout_id, embedding_text) as each batch finishes,
+    so callers can save progress incrementally.
+    """
+    yield from embedding_batcher.embed_batches(embeddings, formatted_workouts)
 
 
 def save_workout_embeddings(workout_embeddings):
@@ -152,72 +183,104 @@ def save_workout_embeddings(workout_embeddings):
     
     Args:
         workout_embeddings: List of tuples (vector, workout_id, embedding_text)
-                           where vector is a list of floats
+                           where vector is a float32 NumPy array
     """
     if not workout_embeddings:
         print("No embeddings to save")
         return
     
-    # Build CASE statements for both embeddings and text
-    embedding_cases = []
-    text_cases = []
-    params = {}
-    
-    for idx, (vector, workout_id, embedding_text) in enumerate(workout_embeddings):
-        # Convert vector list to string format for pgvector
-        vector_str = "[" + ",".join(str(v) for v in vector) + "]"
-        vector_key = f"vector_{idx}"
-        text_key = f"text_{idx}"
-        params[vector_key] = vector_str
-        params[text_key] = embedding_text
-        params[f"id_{idx}"] = workout_id
-        
-        embedding_cases.append(f"WHEN :id_{idx} THEN :{vector_key}")
-        text_cases.append(f"WHEN :id_{idx} THEN :{text_key}")
-    
-    # Build the batch update query
-    ids = [id for _, id, _ in workout_embeddings]
-    params["ids"] = ids
-    
-    query = f"""UPDATE workouts 
-                SET embeddings = CASE id
-                    {' '.join(embedding_cases)}
-                    ELSE embeddings
-                END,
-                workout_text = CASE id
-                    {' '.join(text_cases)}
-                    ELSE workout_text
-                END
-                WHERE id = ANY(:ids)"""
-    
+    # One parameter set per row, sent with executemany in fixed-size chunks;
+    # the statement stays constant no matter how many rows are saved
+    query = """UPDATE workouts
+               SET embeddings = CAST(:embedding AS vector),
+                   workout_text = :text
+               WHERE id = :id"""
+
+    saved = 0
     try:
         with db.get_session() as session:
-            result = session.execute(text(query), params)
-            session.commit()
-            print(f"Successfully saved {result.rowcount} embeddings")
+            for start in range(0, len(workout_embeddings), db.BULK_WRITE_CHUNK_SIZE):
+                chunk = workout_embeddings[start:start + db.BULK_WRITE_CHUNK_SIZE]
+                params = [
+                    {
+                        "embedding": vector,
+                        "text": embedding_text,
+                        "id": workout_id,
+                    }
+                    for vector, workout_id, embedding_text in chunk
+                ]
+                session.execute(text(query), params)
+                session.commit()
+                saved += len(chunk)
+            print(f"Successfully saved {saved} embeddings")
     except Exception as e:
-        print(f"Error saving embeddings: {e}")
+        print(f"Error saving embeddings after {saved} rows: {e}")
         raise
 
 
 
-def update_embeddings(id:int) -> None:
+def update_embeddings(id:int, limit: int | None = None) -> int:
+    """Embed a user's unembedded workouts end to end; returns rows saved.
 
+    Pages stream from the database through formatting and batched embedding into
+    the save step, so only a few batches are ever held in memory.
+    """
     print("updating embeddings")
-    workouts = get_unembedded_workouts(id)
+    saved = _embed_and_save(id, get_unembedded_workouts(id, limit))
 
-    print("formatting workouts")
-    formatted_workouts = format_workouts(workouts)
+    if not saved:
+        print("No unembedded workouts")
+    return saved
 
-    print("making embeddings")
-    workout_embeddings = make_workout_embeddings(formatted_workouts)
 
-    print("saving embeddings")
-    save_workout_embeddings(workout_embeddings)
+def update_embeddings_by_ids(id: int, workout_ids=(), workout_exercise_ids=()) -> int:
+    """Re-embed specific workouts (and the workouts containing the given exercises).
 
+    Used for change events: rows are fetched by primary key whether or not
+    they already have embeddings. Returns rows saved.
+    """
+    if not workout_ids and not workout_exercise_ids:
+        return 0
 
+    workouts = get_workouts_by_ids(id, workout_ids, workout_exercise_ids)
+    return _embed_and_save(id, workouts)
 
-    
 
+def get_workouts_by_ids(id: int, workout_ids=(), workout_exercise_ids=()):
+    """Stream the given workouts of a user, embedded or not."""
+    yield from _stream_workouts("""w.user_id = :user_id
+                AND (w.id = ANY(:workout_ids)
+                     OR w.id IN (SELECT workout_id FROM workout_exercises
+                                 WHERE id = ANY(:workout_exercise_ids)))""", {
+        "user_id": id,
+        "workout_ids": list(workout_ids),
+        "workout_exercise_ids": list(workout_exercise_ids),
+    })
 
-    
+
+def get_workouts_between(id: int, date_from=None, date_to=None):
+    """Stream a user's workouts dated in [date_from, date_to), embedded or not
+    (the whole history if no range is given)."""
+    date_filter = ""
+    params = {"user_id": id}
+    if date_from is not None:
+        date_filter = "AND w.workout_date >= :date_from AND w.workout_date < :date_to"
+        params.update({"date_from": date_from, "date_to": date_to})
+
+    yield from _stream_workouts(f"""w.user_id = :user_id
+                {date_filter}""", params)
+
+
+def _embed_and_save(id: int, workouts) -> int:
+    formatted_workouts = (format_workout(workout) for workout in workouts)
+
+    saved = 0
+    for batch in make_workout_embeddings(formatted_workouts):
+        save_workout_embeddings(batch)
+        saved += len(batch)
+        metrics.ROWS_EMBEDDED.labels(kind="workout").inc(len(batch))
+
+    # No process's hot-user retrieval tier may serve the old vectors
+    if saved:
+        vector_cache.cache.invalidate(id, "workout", notify=True)
+    return saved
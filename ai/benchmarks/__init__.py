@@ -0,0 +1,8 @@
+"""
+Reproducible benchmarks for the AI service and the embedding worker.
+
+Run from ai/ (python -m benchmarks.<name> --help). They are not shipped in the
+service image; install their extra dependencies with
+pip install -r benchmarks/requirements.txt. Scripts that need Postgres read
+DATABASE_URL and only write to rows and tables they create themselves.
+"""
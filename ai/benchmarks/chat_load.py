@@ -0,0 +1,119 @@
+"""
+Concurrent /chat load test with stubbed Mistral and database latencies.
+
+Starts the service of an app/ checkout in a subprocess with benchmarks.fakes
+installed, then sends ``--users`` concurrent chats (distinct users and
+prompts, so no cache helps) and times each one from POST /chat to the
+"Finished!" event on /progress.
+
+Usage (from ai/):
+    python -m benchmarks.chat_load
+    # the same load against another checkout, e.g. the pre-async baseline:
+    git worktree add /tmp/baseline <commit>
+    python -m benchmarks.chat_load --app-root /tmp/baseline/ai
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+AI_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(args) -> None:
+    from benchmarks import fakes
+    fakes.install(args.llm_latency, args.embed_latency, args.db_latency, args.route)
+
+    import uvicorn
+    from app.main import app
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+async def one_chat(client: httpx.AsyncClient, user: int) -> float:
+    headers = {"user-id": str(100000 + user)}
+    start = time.perf_counter()
+    response = await client.post("/chat", headers=headers, json={
+        "prompt": f"how much did I bench last week (run {user})",
+        "context": [],
+    })
+    response.raise_for_status()
+    async with client.stream("GET", "/progress", headers=headers) as stream:
+        async for line in stream.aiter_lines():
+            if line == "data: Finished!":
+                return time.perf_counter() - start
+    raise RuntimeError(f"user {user}: stream ended without Finished!")
+
+
+async def run_load(port: int, users: int) -> list[float]:
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300) as client:
+        return await asyncio.gather(*(one_chat(client, user) for user in range(users)))
+
+
+def wait_for_port(port: int, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError("service did not start")
+
+
+def percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-root", default=AI_ROOT, help="directory containing the app/ package to load")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--embed-latency", type=float, default=0.1)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--route", default="EXERCISES")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    env = {
+        **os.environ,
+        # app/ of --app-root wins over this checkout's; benchmarks/ comes from here
+        "PYTHONPATH": os.pathsep.join([os.path.abspath(args.app_root), AI_ROOT]),
+        "DATABASE_URL": os.getenv("DATABASE_URL", "postgresql+psycopg://bench@127.0.0.1:1/bench"),
+        "MISTRAL_API_KEY": os.getenv("MISTRAL_API_KEY", "bench"),
+        # MistralAIEmbeddings fetches its tokenizer from the Hugging Face hub at import
+        "HF_HUB_OFFLINE": os.getenv("HF_HUB_OFFLINE", "1"),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.chat_load", "--serve", "--port", str(args.port),
+         "--llm-latency", str(args.llm_latency), "--embed-latency", str(args.embed_latency),
+         "--db-latency", str(args.db_latency), "--route", args.route],
+        cwd=args.app_root, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(args.port)
+        start = time.perf_counter()
+        latencies = asyncio.run(run_load(args.port, args.users))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"app: {os.path.abspath(args.app_root)}")
+    print(f"{args.users} concurrent chats in {elapsed:.2f}s "
+          f"(llm {args.llm_latency}s, embed {args.embed_latency}s, db {args.db_latency}s)")
+    print(f"p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  max {max(latencies):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Latency-faithful stand-ins for Mistral and the database.
+
+install() patches the LangChain client classes and the SQLModel sessions at
+class level, so it works on any checkout of app/ (sync or async pipeline):
+- chat models answer the guardrail with FITNESS_OK, the router with ``route``
+  and everything else with a short answer
+- embeddings return random unit vectors
+- every session.execute returns an empty result
+
+Blocking methods sleep with time.sleep and async ones with asyncio.sleep, so
+code that calls a blocking client on the event loop pays for it exactly as it
+would against the real services.
+"""
+
+import asyncio
+import time
+import numpy as np
+
+DIMENSIONS = 1024
+
+
+class FakeRow:
+    """Any column reads as 0 (no pending rows, no stats, ...)."""
+
+    def __getattr__(self, name):
+        return 0
+
+    def __getitem__(self, index):
+        return 0
+
+
+class FakeResult:
+    rowcount = 0
+
+    def __iter__(self):
+        return iter(())
+
+    def fetchall(self):
+        return []
+
+    def all(self):
+        return []
+
+    def first(self):
+        return None
+
+    def one(self):
+        return FakeRow()
+
+    def scalar(self):
+        return None
+
+    def scalar_one_or_none(self):
+        return None
+
+    def scalars(self):
+        return self
+
+    def mappings(self):
+        return self
+
+
+def _text_of(messages) -> str:
+    if isinstance(messages, str):
+        return messages
+    return " ".join(str(message) for message in messages)
+
+
+def _reply(messages, route: str) -> str:
+    prompt = _text_of(messages)
+    if "FITNESS_OK" in prompt:
+        return "FITNESS_OK"
+    if "routing classifier" in prompt:
+        return route
+    return "Keep the bar path vertical and add 2.5 kg next week."
+
+
+def _vectors(count: int) -> list[list[float]]:
+    vectors = np.random.default_rng().standard_normal((count, DIMENSIONS)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.tolist()
+
+
+def install(llm_latency: float = 0.3, embed_latency: float = 0.1, db_latency: float = 0.02,
+            route: str = "EXERCISES") -> None:
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_mistralai import ChatMistralAI, MistralAIEmbeddings
+    from sqlmodel import Session
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    def invoke(self, messages, *args, **kwargs):
+        time.sleep(llm_latency)
+        return AIMessage(content=_reply(messages, route))
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        await asyncio.sleep(llm_latency)
+        return AIMessage(content=_reply(messages, route))
+
+    async def astream(self, messages, *args, **kwargs):
+        await asyncio.sleep(llm_latency)
+        for word in _reply(messages, route).split(" "):
+            yield AIMessageChunk(content=word + " ")
+
+    def embed_query(self, text):
+        time.sleep(embed_latency)
+        return _vectors(1)[0]
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(embed_latency)
+        return _vectors(1)[0]
+
+    def embed_documents(self, texts):
+        time.sleep(embed_latency)
+        return _vectors(len(texts))
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(embed_latency)
+        return _vectors(len(texts))
+
+    def execute(self, *args, **kwargs):
+        time.sleep(db_latency)
+        return FakeResult()
+
+    async def aexecute(self, *args, **kwargs):
+        await asyncio.sleep(db_latency)
+        return FakeResult()
+
+    for name, method in (("invoke", invoke), ("ainvoke", ainvoke), ("astream", astream)):
+        setattr(ChatMistralAI, name, method)
+    for name, method in (("embed_query", embed_query), ("aembed_query", aembed_query),
+                         ("embed_documents", embed_documents), ("aembed_documents", aembed_documents)):
+        setattr(MistralAIEmbeddings, name, method)
+    Session.execute = execute
+    AsyncSession.execute = aexecute
@@ -0,0 +1,136 @@
+"""
+Exact vs. HNSW recall@k for the per-user retrieval query.
+
+Builds a scratch table shaped like workout_exercises (user_id, embeddings
+VECTOR(1024)) with the same HNSW index as 05_VectorIndexes.sql, then runs the
+query rag.py issues:
+
+    WHERE user_id = :user_id ORDER BY embeddings <=> :q LIMIT :k
+
+once exactly (index scans off, like RETRIEVAL_MODE=exact) and once per
+(hnsw.ef_search, hnsw.iterative_scan) setting. It reports recall@k against
+the exact result and the mean query time. The user_id filter is why the
+iterative scan matters: without it an HNSW scan yields at most ef_search
+rows across all users, and most of them belong to someone else.
+
+Vectors are synthetic (a few clusters per user) unless --from-db copies the
+embedded rows of workout_exercises. The real table is only read. The scratch
+table is dropped afterwards unless --keep is given.
+
+Usage (from ai/, against a pgvector >= 0.8 database):
+    DATABASE_URL=postgresql://... python -m benchmarks.hnsw_recall
+    python -m benchmarks.hnsw_recall --users 200 --rows-per-user 500 --ef-search 40,100
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+
+TABLE = "bench_hnsw_recall"
+DIMENSIONS = 1024
+
+
+def synthetic_rows(users: int, rows_per_user: int, rng: np.random.Generator):
+    """(user_id, vector) rows: each user's vectors scatter around a few centres."""
+    for user_id in range(1, users + 1):
+        centres = rng.standard_normal((4, DIMENSIONS)).astype(np.float32)
+        picks = rng.integers(0, len(centres), rows_per_user)
+        vectors = centres[picks] + 0.5 * rng.standard_normal((rows_per_user, DIMENSIONS)).astype(np.float32)
+        for vector in vectors:
+            yield user_id, vector
+
+
+def create_table(conn, args, rng) -> None:
+    conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    conn.execute(f"CREATE TABLE {TABLE} (id BIGSERIAL PRIMARY KEY, user_id BIGINT NOT NULL, "
+                 f"embeddings VECTOR({DIMENSIONS}) NOT NULL)")
+    if args.from_db:
+        conn.execute(f"""
+            INSERT INTO {TABLE} (user_id, embeddings)
+            SELECT user_id, embeddings FROM workout_exercises WHERE embeddings IS NOT NULL
+        """)
+    else:
+        with conn.cursor() as cursor:
+            with cursor.copy(f"COPY {TABLE} (user_id, embeddings) FROM STDIN WITH (FORMAT BINARY)") as copy:
+                copy.set_types(["int8", "vector"])
+                for row in synthetic_rows(args.users, args.rows_per_user, rng):
+                    copy.write_row(row)
+    conn.execute(f"CREATE INDEX ON {TABLE} (user_id)")
+    conn.execute(f"CREATE INDEX ON {TABLE} USING hnsw (embeddings vector_cosine_ops)")
+    conn.execute(f"ANALYZE {TABLE}")
+
+
+def sample_queries(conn, count: int, rng) -> list[tuple[int, np.ndarray]]:
+    """Queries near a random row of a random user, as real questions are."""
+    rows = conn.execute(f"SELECT user_id, embeddings FROM {TABLE} ORDER BY random() LIMIT %s", (count,)).fetchall()
+    return [
+        (user_id, np.asarray(vector, dtype=np.float32) + 0.3 * rng.standard_normal(DIMENSIONS).astype(np.float32))
+        for user_id, vector in rows
+    ]
+
+
+def search(conn, queries, k: int, settings: dict[str, str]) -> tuple[list[set], float]:
+    """Top-k ids per query under the given GUCs, and the mean query time in ms."""
+    results = []
+    elapsed = 0.0
+    for user_id, query_vector in queries:
+        with conn.transaction():
+            for name, value in settings.items():
+                conn.execute("SELECT set_config(%s, %s, true)", (name, value))
+            start = time.perf_counter()
+            rows = conn.execute(
+                f"SELECT id FROM {TABLE} WHERE user_id = %s ORDER BY embeddings <=> %s LIMIT %s",
+                (user_id, query_vector, k),
+            ).fetchall()
+            elapsed += time.perf_counter() - start
+        results.append({row[0] for row in rows})
+    return results, 1000 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rows-per-user", type=int, default=300)
+    parser.add_argument("--from-db", action="store_true", help="copy workout_exercises embeddings instead of synthetic ones")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--ef-search", default="40,100,200", help="comma-separated hnsw.ef_search values")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help=f"keep {TABLE} for another run")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    url = os.environ["DATABASE_URL"].replace("postgresql+psycopg://", "postgresql://")
+    # autocommit, so each conn.transaction() scopes its set_config calls
+    with psycopg.connect(url, autocommit=True) as conn:
+        register_vector(conn)
+        try:
+            if not args.keep or conn.execute("SELECT to_regclass(%s)", (TABLE,)).fetchone()[0] is None:
+                create_table(conn, args, rng)
+            total = conn.execute(f"SELECT count(*), count(DISTINCT user_id) FROM {TABLE}").fetchone()
+            print(f"{total[0]} rows, {total[1]} users, {args.queries} queries, recall@{args.k}")
+
+            queries = sample_queries(conn, args.queries, rng)
+            exact, exact_ms = search(conn, queries, args.k, {"enable_indexscan": "off"})
+            print(f"{'exact':<28} recall 1.000  {exact_ms:7.2f} ms")
+
+            for ef_search in (int(value) for value in args.ef_search.split(",")):
+                for mode in ("off", "relaxed_order", "strict_order"):
+                    found, ms = search(conn, queries, args.k, {
+                        "hnsw.ef_search": str(ef_search),
+                        "hnsw.iterative_scan": mode,
+                    })
+                    recall = np.mean([
+                        len(got & want) / len(want) for got, want in zip(found, exact) if want
+                    ])
+                    print(f"{f'ef_search={ef_search} {mode}':<28} recall {recall:.3f}  {ms:7.2f} ms")
+        finally:
+            if not args.keep:
+                conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Embedding save throughput: chunked executemany vs. the old CASE update.
+
+Fills a scratch table shaped like workout_exercises (id, exercise_text,
+embeddings VECTOR(1024)) with --rows rows and saves a fresh vector and text
+for every row, timing:
+
+- "executemany": the statement and chunking of
+  exercise_embeddings.save_exercise_embeddings, run through app.db's sync
+  engine (psycopg 3, binary float32 vectors, one commit per
+  BULK_WRITE_CHUNK_SIZE rows), once per --chunk-sizes value
+- "case": the statement it replaced, one UPDATE ... SET x = CASE id WHEN ...
+  with every vector as a text literal
+
+--with-index adds the HNSW index from 05_VectorIndexes.sql, whose
+maintenance is most of an UPDATE's cost in production.
+
+Usage (from ai/):
+    DATABASE_URL=postgresql://... python -m benchmarks.save_embeddings --rows 10000
+"""
+
+import argparse
+import time
+import numpy as np
+from sqlmodel import text
+from app import db
+
+TABLE = "bench_save_embeddings"
+DIMENSIONS = 1024
+
+
+def reset_table(rows: int, with_index: bool) -> None:
+    with db.get_session() as session:
+        session.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        session.execute(text(f"""
+            CREATE TABLE {TABLE} (
+                id BIGINT PRIMARY KEY,
+                exercise_text TEXT,
+                embeddings VECTOR({DIMENSIONS})
+            )
+        """))
+        session.execute(text(f"INSERT INTO {TABLE} (id) SELECT generate_series(1, :rows)"), {"rows": rows})
+        if with_index:
+            session.execute(text(f"CREATE INDEX ON {TABLE} USING hnsw (embeddings vector_cosine_ops)"))
+        session.commit()
+
+
+def make_rows(rows: int, rng) -> list[tuple]:
+    """(vector, id, text) tuples, as make_exercise_embeddings yields them."""
+    vectors = rng.standard_normal((rows, DIMENSIONS)).astype(np.float32)
+    return [(vectors[i], i + 1, f"Bench exercise {i + 1}: 5 sets x 5 reps at 100 kg") for i in range(rows)]
+
+
+def save_executemany(rows: list[tuple], chunk_size: int) -> None:
+    # Same statement and chunking as exercise_embeddings.save_exercise_embeddings
+    query = f"""UPDATE {TABLE}
+                SET embeddings = CAST(:embedding AS vector),
+                    exercise_text = :text
+                WHERE id = :id"""
+    with db.get_session() as session:
+        for start in range(0, len(rows), chunk_size):
+            params = [
+                {"embedding": vector, "text": embedding_text, "id": row_id}
+                for vector, row_id, embedding_text in rows[start:start + chunk_size]
+            ]
+            session.execute(text(query), params)
+            session.commit()
+
+
+def save_case(rows: list[tuple]) -> None:
+    # The pre-executemany statement: one CASE arm per row, vectors as text
+    embedding_cases, text_cases, params = [], [], {}
+    for idx, (vector, row_id, embedding_text) in enumerate(rows):
+        params[f"vector_{idx}"] = "[" + ",".join(str(v) for v in vector.tolist()) + "]"
+        params[f"text_{idx}"] = embedding_text
+        params[f"id_{idx}"] = row_id
+        embedding_cases.append(f"WHEN :id_{idx} THEN CAST(:vector_{idx} AS vector)")
+        text_cases.append(f"WHEN :id_{idx} THEN :text_{idx}")
+    ids = ", ".join(f":id_{idx}" for idx in range(len(rows)))
+    with db.get_session() as session:
+        session.execute(text(f"""
+            UPDATE {TABLE}
+            SET embeddings = CASE id {' '.join(embedding_cases)} END,
+                exercise_text = CASE id {' '.join(text_cases)} END
+            WHERE id IN ({ids})
+        """), params)
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--chunk-sizes", default=f"100,{db.BULK_WRITE_CHUNK_SIZE},2000")
+    parser.add_argument("--with-index", action="store_true")
+    parser.add_argument("--skip-case", action="store_true", help="skip the old CASE statement (slow for big --rows)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    runs = [(f"executemany chunk={size}", lambda rows, size=int(size): save_executemany(rows, size))
+            for size in args.chunk_sizes.split(",")]
+    if not args.skip_case:
+        runs.append(("case (single statement)", save_case))
+
+    try:
+        for name, run in runs:
+            reset_table(args.rows, args.with_index)
+            rows = make_rows(args.rows, rng)
+            start = time.perf_counter()
+            run(rows)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<28} {args.rows} rows  {elapsed:7.2f}s  {args.rows / elapsed:8.0f} rows/s")
+    finally:
+        with db.get_session() as session:
+            session.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+            session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Embedding worker throughput with an in-memory Kafka and fake embedding latency.
+
+Runs app.embedding_worker.EmbeddingConsumer against FakeConsumer, an
+in-process stand-in for confluent_kafka.Consumer. It has partitions keyed by
+user id, pause/resume/seek, and manual commits. Messages are produced at
+--rate per second. Each user's embedding step sleeps --fast-seconds, except
+for --slow-users users that sleep --slow-seconds, standing in for a user with
+a long backlog or a slow provider call. Stats and summary refreshes are
+no-ops.
+
+It reports, per message, the time from being produced until its rows were
+saved (what /chat freshness sees) and until its offset was committed (which
+waits for every earlier message of the partition), and the total drain time.
+
+Usage (from ai/):
+    python -m benchmarks.worker_throughput
+    # the same load against another checkout:
+    python -m benchmarks.worker_throughput --app-root /tmp/other/ai
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+from confluent_kafka import TopicPartition
+
+TOPIC = "workout-logged"
+
+
+class FakeMessage:
+    def __init__(self, partition: int, offset: int, value: bytes):
+        self._partition = partition
+        self._offset = offset
+        self._value = value
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return TOPIC
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def value(self):
+        return self._value
+
+
+class FakeLog:
+    """Produced messages per partition, and when each offset got committed."""
+
+    def __init__(self, partitions: int):
+        self.partitions = partitions
+        self.messages = {p: [] for p in range(partitions)}  # (produced_at, FakeMessage)
+        self.committed_at = {}  # (partition, offset) -> time
+        self.total = 0
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def produce(self, user_id: int, value: bytes) -> None:
+        partition = user_id % self.partitions
+        with self.lock:
+            offset = len(self.messages[partition])
+            self.messages[partition].append((time.perf_counter(), FakeMessage(partition, offset, value)))
+
+    def commit(self, partition: int, position: int) -> None:
+        now = time.perf_counter()
+        with self.lock:
+            for offset in range(position):
+                self.committed_at.setdefault((partition, offset), now)
+            if len(self.committed_at) == self.total:
+                self.done.set()
+
+
+class FakeConsumer:
+    """The part of confluent_kafka.Consumer the worker uses, over a FakeLog."""
+
+    log: FakeLog = None
+
+    def __init__(self, config):
+        self.assigned = [TopicPartition(TOPIC, p) for p in range(self.log.partitions)]
+        self.position = {p: 0 for p in range(self.log.partitions)}
+        self.paused = set()
+        self.on_assign = None
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None, on_lost=None):
+        self.on_assign = on_assign
+
+    def assignment(self):
+        return list(self.assigned)
+
+    def pause(self, partitions):
+        self.paused |= {tp.partition for tp in partitions}
+
+    def resume(self, partitions):
+        self.paused -= {tp.partition for tp in partitions}
+
+    def seek(self, tp):
+        self.position[tp.partition] = tp.offset
+
+    def consume(self, num_messages=1, timeout=-1):
+        if self.on_assign is not None:
+            on_assign, self.on_assign = self.on_assign, None
+            on_assign(self, self.assignment())
+        deadline = time.perf_counter() + timeout
+        out = []
+        while True:
+            if self.log.done.is_set():
+                raise KeyboardInterrupt
+            with self.log.lock:
+                for partition, messages in self.log.messages.items():
+                    while (partition not in self.paused and len(out) < num_messages
+                           and self.position[partition] < len(messages)):
+                        out.append(messages[self.position[partition]][1])
+                        self.position[partition] += 1
+            # librdkafka waits for num_messages or the timeout, whichever comes first
+            if len(out) >= num_messages or time.perf_counter() >= deadline:
+                return out
+            time.sleep(0.002)
+
+    def poll(self, timeout=None):
+        messages = self.consume(1, timeout or 0)
+        return messages[0] if messages else None
+
+    def commit(self, message=None, offsets=None, asynchronous=True):
+        if offsets is None:
+            offsets = [TopicPartition(TOPIC, p, position) for p, position in self.position.items()]
+        for tp in offsets:
+            self.log.commit(tp.partition, tp.offset)
+
+    def close(self):
+        pass
+
+
+def produce(log: FakeLog, users: int, messages: int, rate: float) -> None:
+    for i in range(messages):
+        user_id = 1 + i % users
+        log.produce(user_id, f'{{"version": 1, "user_id": {user_id}, "workout_ids": [{i}]}}'.encode())
+        time.sleep(1 / rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-root", default=None, help="directory containing the app/ package to load")
+    parser.add_argument("--messages", type=int, default=600)
+    parser.add_argument("--users", type=int, default=60)
+    parser.add_argument("--partitions", type=int, default=6)
+    parser.add_argument("--rate", type=float, default=100.0, help="messages produced per second")
+    parser.add_argument("--fast-seconds", type=float, default=0.05)
+    parser.add_argument("--slow-users", type=int, default=1)
+    parser.add_argument("--slow-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.app_root:
+        sys.path.insert(0, os.path.abspath(args.app_root))
+    os.environ.setdefault("DATABASE_URL", "postgresql+psycopg://bench@127.0.0.1:1/bench")
+    os.environ.setdefault("MISTRAL_API_KEY", "bench")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    from app import embedding_worker
+
+    slow = set(range(1, args.slow_users + 1))
+    saved_at = {}  # message number (sent as its workout id) -> time
+
+    def generate_embeddings(self, request):
+        time.sleep(args.slow_seconds if request.user_id in slow else args.fast_seconds)
+        now = time.perf_counter()
+        for workout_id in request.workout_ids:
+            saved_at.setdefault(workout_id, now)
+
+    embedding_worker.EmbeddingConsumer._generate_embeddings = generate_embeddings
+    embedding_worker.EmbeddingConsumer._update_stats = lambda self, request: None
+    embedding_worker.EmbeddingConsumer._update_summaries = lambda self, request: None
+
+    log = FakeLog(args.partitions)
+    log.total = args.messages
+    FakeConsumer.log = log
+    embedding_worker.Consumer = FakeConsumer
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker = embedding_worker.EmbeddingConsumer()
+        producer = threading.Thread(target=produce, args=(log, args.users, args.messages, args.rate), daemon=True)
+        start = time.perf_counter()
+        producer.start()
+        worker.run()
+        elapsed = time.perf_counter() - start
+
+    saved, committed = [], []
+    for partition, messages in log.messages.items():
+        for offset, (produced_at, message) in enumerate(messages):
+            number = int(message.value().split(b"[")[1].split(b"]")[0])
+            saved.append(saved_at[number] - produced_at)
+            committed.append(log.committed_at[(partition, offset)] - produced_at)
+    print(f"app: {os.path.dirname(os.path.dirname(os.path.abspath(embedding_worker.__file__)))}")
+    print(f"{args.messages} messages, {args.users} users ({args.slow_users} slow at {args.slow_seconds}s), "
+          f"{args.partitions} partitions, {args.rate:g} msg/s, concurrency {embedding_worker.WORKER_CONCURRENCY}")
+    print(f"drained in {elapsed:.2f}s")
+    for name, latencies in (("saved", saved), ("committed", committed)):
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        print(f"produce->{name:<9} p50 {quantiles[49]:.2f}s  p95 {quantiles[94]:.2f}s  max {max(latencies):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
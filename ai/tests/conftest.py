@@ -0,0 +1,9 @@
+# Run from ai/: python -m pytest tests
+import os
+import sys
+
+# app modules build their clients at import time; no connection is made in the tests
+os.environ.setdefault("DATABASE_URL", "postgresql+psycopg://test@127.0.0.1:1/test")
+os.environ.setdefault("MISTRAL_API_KEY", "test")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
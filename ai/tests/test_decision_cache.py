@@ -0,0 +1,47 @@
+import asyncio
+from app import decision_cache
+from app.decision_cache import DecisionCache, decision_key
+
+
+def test_key_changes_with_the_classifier_prompt():
+    context = [("human", "what did I bench"), ("ai", "100 kg")]
+
+    assert decision_key("m", "And  Squats?", context, "v1") == decision_key("m", "and squats?", context, "v1")
+    assert decision_key("m", "and squats?", context, "v1") != decision_key("m", "and squats?", context, "v2")
+    assert decision_key("m", "and squats?", context, "v1") != decision_key("other", "and squats?", context, "v1")
+
+
+def test_memory_tier_is_keyed_by_template():
+    async def run():
+        old = DecisionCache("router", "m", "old prompt", persistent=False)
+        new = DecisionCache("router", "m", "new prompt", persistent=False)
+        new.memory = old.memory  # same process-wide store
+        await old.set("what is my PR", [], "STATS")
+        return await old.get("what is my PR"), await new.get("what is my PR")
+
+    assert asyncio.run(run()) == ("STATS", None)
+
+
+def test_sweep_runs_in_the_background_at_most_once_per_interval(monkeypatch):
+    sweeps = []
+    stored = []
+
+    async def store(self, key, label):
+        stored.append(label)
+
+    async def sweep(self):
+        sweeps.append(self.classifier)
+
+    monkeypatch.setattr(DecisionCache, "_store", store)
+    monkeypatch.setattr(DecisionCache, "_sweep", sweep)
+    monkeypatch.setattr(decision_cache, "DECISION_CACHE_SWEEP_SECONDS", 3600)
+
+    async def run():
+        cache = DecisionCache("guardrail", "m", "prompt", persistent=True)
+        for i in range(5):
+            await cache.set(f"question {i}", [], "FITNESS_OK")
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert len(stored) == 5
+    assert sweeps == ["guardrail"]
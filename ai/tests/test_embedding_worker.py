@@ -0,0 +1,119 @@
+import json
+import pytest
+from app import embedding_worker
+from app.embedding_worker import EmbeddingConsumer
+
+
+class FakeMessage:
+    def __init__(self, payload):
+        self._value = json.dumps(payload).encode()
+
+    def value(self):
+        return self._value
+
+
+@pytest.fixture
+def consumer():
+    # Parsing and the stats step don't touch Kafka
+    return EmbeddingConsumer.__new__(EmbeddingConsumer)
+
+
+@pytest.fixture
+def stats_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(embedding_worker.user_stats, "update_workouts",
+                        lambda user_id, workout_ids=(), workout_exercise_ids=(): calls.append(
+                            ("update", user_id, set(workout_ids), set(workout_exercise_ids))))
+    monkeypatch.setattr(embedding_worker.user_stats, "rebuild", lambda user_id: calls.append(("rebuild", user_id)))
+    return calls
+
+
+# The events the frontend publishes (lib/kafka.ts publishWorkoutLogged)
+@pytest.mark.parametrize("payload, expected", [
+    # workout created
+    ({"version": 1, "user_id": 7, "workout_ids": [3], "change": "created"}, ("update", 7, {3}, set())),
+    # workout deleted: its snapshot in user_stats_sources says what to refresh
+    ({"version": 1, "user_id": 7, "workout_ids": [3], "change": "deleted"}, ("update", 7, {3}, set())),
+    # exercise added / edited, sets (entries) saved through exercise_data
+    ({"version": 1, "user_id": 7, "workout_exercise_ids": [11], "change": "created"}, ("update", 7, set(), {11})),
+    ({"version": 1, "user_id": 7, "workout_exercise_ids": [11], "change": "updated"}, ("update", 7, set(), {11})),
+    # workout edited, or an exercise removed from it (published as an update of the workout)
+    ({"version": 1, "user_id": 7, "workout_ids": [3], "change": "updated"}, ("update", 7, {3}, set())),
+    # legacy bare user id
+    (7, ("rebuild", 7)),
+])
+def test_every_change_refreshes_stats(consumer, stats_calls, payload, expected):
+    request = consumer._process_message(FakeMessage(payload))
+
+    consumer._update_stats(request)
+
+    assert stats_calls == [expected]
+
+
+def test_merged_delete_still_refreshes_stats(consumer, stats_calls):
+    request = consumer._process_message(FakeMessage({"version": 1, "user_id": 7, "workout_ids": [3], "change": "created"}))
+    request.merge(consumer._process_message(FakeMessage({"version": 1, "user_id": 7, "workout_ids": [4], "change": "deleted"})))
+
+    consumer._update_stats(request)
+
+    assert stats_calls == [("update", 7, {3, 4}, set())]
+
+
+def test_stats_refresh_even_if_embedding_fails(consumer, stats_calls, monkeypatch):
+    def fail(request):
+        raise RuntimeError("embedding provider down")
+    monkeypatch.setattr(consumer, "_generate_embeddings", fail, raising=False)
+    request = consumer._process_message(FakeMessage({"version": 1, "user_id": 7, "workout_exercise_ids": [11]}))
+
+    assert consumer._process_user(request) is False
+    assert stats_calls == [("update", 7, set(), {11})]
+
+
+@pytest.fixture
+def embedding_calls(monkeypatch):
+    calls = []
+    for module, kind in ((embedding_worker.exercise_embeddings, "exercise"), (embedding_worker.workout_embeddings, "workout")):
+        monkeypatch.setattr(module, "update_embeddings_by_ids",
+                            lambda user_id, *ids, kind=kind: calls.append((kind, "by_ids", user_id)) or 1)
+        monkeypatch.setattr(module, "update_embeddings",
+                            lambda user_id, limit=None, kind=kind: calls.append((kind, "scan", user_id)) or 3)
+    return calls
+
+
+def set_watermark(monkeypatch, exercises_pending, workouts_pending):
+    monkeypatch.setattr(embedding_worker.freshness, "get_watermark_blocking", lambda user_id: {
+        "exercises_pending": exercises_pending, "workouts_pending": workouts_pending,
+    })
+
+
+def test_by_id_message_drains_older_backlog(consumer, embedding_calls, monkeypatch):
+    # /chat only embedded INLINE_EMBED_LIMIT rows; 12 older exercises and 4 workouts are left
+    set_watermark(monkeypatch, 12, 4)
+    request = consumer._process_message(FakeMessage({"version": 1, "user_id": 7, "workout_ids": [3], "change": "created"}))
+
+    consumer._generate_embeddings(request)
+
+    assert embedding_calls == [
+        ("exercise", "by_ids", 7), ("workout", "by_ids", 7),
+        ("exercise", "scan", 7), ("workout", "scan", 7),
+    ]
+
+
+def test_by_id_message_without_backlog_skips_the_scan(consumer, embedding_calls, monkeypatch):
+    set_watermark(monkeypatch, 0, 0)
+    request = consumer._process_message(FakeMessage({"version": 1, "user_id": 7, "workout_exercise_ids": [11]}))
+
+    consumer._generate_embeddings(request)
+
+    assert embedding_calls == [("exercise", "by_ids", 7), ("workout", "by_ids", 7)]
+
+
+def test_legacy_message_scans_without_reading_the_watermark(consumer, embedding_calls, monkeypatch):
+    def fail(user_id):
+        raise AssertionError("watermark read for a full scan")
+    monkeypatch.setattr(embedding_worker.freshness, "get_watermark_blocking", fail)
+    request = consumer._process_message(FakeMessage(7))
+
+    consumer._generate_embeddings(request)
+
+    assert embedding_calls == [("exercise", "scan", 7), ("workout", "scan", 7)]
@@ -0,0 +1,99 @@
+from datetime import date
+import pytest
+from app.query_filters import QueryFilters, extract_date_range, match_exercises
+
+# A Wednesday
+TODAY = date(2025, 3, 12)
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("what did I do on 2025-02-03", (date(2025, 2, 3), date(2025, 2, 4))),
+    ("how was my workout today", (date(2025, 3, 12), date(2025, 3, 13))),
+    ("what did I do yesterday", (date(2025, 3, 11), date(2025, 3, 12))),
+    ("my squats in the last 10 days", (date(2025, 3, 2), date(2025, 3, 13))),
+    ("volume over the past 2 weeks", (date(2025, 2, 26), date(2025, 3, 13))),
+    ("bench in the last 3 months", (date(2024, 12, 12), date(2025, 3, 13))),
+    ("what did I do this week", (date(2025, 3, 10), date(2025, 3, 13))),
+    ("what did I do last week", (date(2025, 3, 3), date(2025, 3, 10))),
+    ("sessions last month", (date(2025, 2, 1), date(2025, 3, 1))),
+    ("sessions this year", (date(2025, 1, 1), date(2025, 3, 13))),
+    ("sessions last year", (date(2024, 1, 1), date(2025, 1, 1))),
+    ("what did I lift in February", (date(2025, 2, 1), date(2025, 3, 1))),
+    ("what did I lift in november", (date(2024, 11, 1), date(2024, 12, 1))),
+    ("my deadlifts in march 2024", (date(2024, 3, 1), date(2024, 4, 1))),
+    ("my deadlifts during may", (date(2024, 5, 1), date(2024, 6, 1))),
+    ("what did I do on monday", (date(2025, 3, 10), date(2025, 3, 11))),
+    ("what did I do last wednesday", (date(2025, 3, 5), date(2025, 3, 6))),
+    ("how many sessions in 2023", (date(2023, 1, 1), date(2024, 1, 1))),
+    ("how has my squat improved since 2024", (date(2024, 1, 1), date(2025, 3, 13))),
+    ("progress since march 2024", (date(2024, 3, 1), date(2025, 3, 13))),
+    ("progress since january", (date(2025, 1, 1), date(2025, 3, 13))),
+    ("progress since november", (date(2024, 11, 1), date(2025, 3, 13))),
+    ("everything since 2025-01-15", (date(2025, 1, 15), date(2025, 3, 13))),
+])
+def test_extract_date_range(prompt, expected):
+    assert extract_date_range(prompt, TODAY) == expected
+
+
+@pytest.mark.parametrize("prompt", [
+    "how do I get stronger",
+    "may I ask how to improve my deadlift",
+    "how long should I rest between sets",
+    "what is 2024-02-30",
+])
+def test_extract_date_range_none(prompt):
+    assert extract_date_range(prompt, TODAY) is None
+
+
+VOCABULARY = [
+    (1, "Bench Press"),
+    (2, "Squat"),
+    (3, "Dumbbell flat bench press"),
+    (4, "Incline dumbbell bench press"),
+    (5, "Dumbbell Hammer curls"),
+    (6, "Focus curl"),
+    (7, "Easy grip curl"),
+    (8, "Long lever plank"),
+    (9, "Cable triceps push down"),
+    (10, "Chin-ups"),
+    (11, "Front Squat"),
+]
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    # full names win over shared words
+    ("what did I bench press last week", [1]),
+    ("how heavy were my squats", [2]),
+    ("how heavy were my front squats", [11]),
+    ("show my incline dumbbell bench press sets", [4]),
+    ("how many chin ups did I do", [10]),
+    # a distinctive word matches every exercise containing it
+    ("how have my curls progressed", [5, 6, 7]),
+    ("what did I do on the hammer", [5]),
+    ("how long was my plank", [8]),
+    ("triceps volume this month", [9]),
+])
+def test_match_exercises(prompt, expected):
+    assert [exercise_id for exercise_id, _ in match_exercises(prompt, VOCABULARY)] == expected
+
+
+@pytest.mark.parametrize("prompt", [
+    "how long was my workout on tuesday",
+    "was yesterday's session easy",
+    "what should I focus on next week",
+    "plan my next push day",
+    "should I slow down",
+    "what is a good grip width",
+    "how do I keep my back flat",
+])
+def test_match_exercises_ignores_generic_words(prompt):
+    assert match_exercises(prompt, VOCABULARY) == []
+
+
+def test_widen_keeps_an_explicit_date_range():
+    start, end = date(2025, 3, 1), date(2025, 4, 1)
+
+    assert QueryFilters(start, end).widen() is None
+    widened = QueryFilters(start, end, [1], ["Bench Press"], [7]).widen()
+    assert (widened.date_from, widened.date_to, widened.exercise_ids, widened.workout_ids) == (start, end, [], [])
+    assert not QueryFilters(exercise_ids=[1], exercise_names=["Bench Press"]).widen()
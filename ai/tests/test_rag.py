@@ -0,0 +1,22 @@
+from datetime import date
+import pytest
+from app import rag
+from app.query_filters import QueryFilters
+
+
+@pytest.mark.parametrize("prompt, filters, expected", [
+    # a long date range
+    ("what did I do", QueryFilters(date(2024, 1, 1), date(2024, 6, 1)), True),
+    ("what did I do", QueryFilters(date(2024, 1, 1), date(2024, 3, 1)), True),
+    # a short one, even when the wording sounds like a trend question
+    ("what did I do last week", QueryFilters(date(2024, 3, 4), date(2024, 3, 11)), False),
+    ("how did I progress in march", QueryFilters(date(2024, 3, 1), date(2024, 4, 1)), False),
+    # no dates: progress / trend wording decides
+    ("how has my squat progressed", QueryFilters(), True),
+    ("show me my bench trend", None, True),
+    ("have I improved over time", QueryFilters(exercise_ids=[1]), True),
+    ("summarize my last workout", QueryFilters(), False),
+    ("what did I do at the gym", None, False),
+])
+def test_is_long_horizon(prompt, filters, expected):
+    assert rag.is_long_horizon(prompt, filters) is expected
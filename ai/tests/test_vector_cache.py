@@ -0,0 +1,133 @@
+import asyncio
+import numpy as np
+import pytest
+from app import vector_cache
+from app.vector_cache import UserVectors
+
+
+def make_vectors(rows: int, dimensions: int = 16, seed: int = 0) -> UserVectors:
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((rows, dimensions)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return UserVectors(np.arange(100, 100 + rows, dtype=np.int64), [f"row {i}" for i in range(rows)], matrix)
+
+
+def brute_force_top_k(entry: UserVectors, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    query = query / np.linalg.norm(query)
+    similarities = np.array([float(row @ query) for row in entry.matrix])
+    order = np.argsort(-similarities, kind="stable")[:max(k, 0)]
+    return order, similarities[order]
+
+
+@pytest.mark.parametrize("rows, k", [(50, 1), (50, 10), (50, 49), (50, 50), (50, 80), (1, 5)])
+def test_top_k_matches_brute_force(rows, k):
+    entry = make_vectors(rows)
+    query = np.random.default_rng(1).standard_normal(entry.matrix.shape[1]).astype(np.float32)
+
+    indices, similarities = entry.top_k(query, k)
+    expected_indices, expected_similarities = brute_force_top_k(entry, query, k)
+
+    assert len(indices) == min(k, rows)
+    assert list(indices) == list(expected_indices)
+    np.testing.assert_allclose(similarities, expected_similarities, rtol=1e-5, atol=1e-6)
+    assert np.all(np.diff(similarities) <= 0)
+
+
+def test_top_k_ignores_query_norm():
+    entry = make_vectors(20)
+    query = np.random.default_rng(2).standard_normal(entry.matrix.shape[1]).astype(np.float32)
+
+    indices, similarities = entry.top_k(query, 5)
+    scaled_indices, scaled_similarities = entry.top_k(query * 37.0, 5)
+
+    assert list(indices) == list(scaled_indices)
+    np.testing.assert_allclose(similarities, scaled_similarities, rtol=1e-5)
+
+
+def test_top_k_empty_matrix():
+    entry = UserVectors(np.empty(0, dtype=np.int64), [], np.empty((0, 0), dtype=np.float32))
+
+    indices, similarities = entry.top_k(np.ones(16, dtype=np.float32), 10)
+
+    assert indices.size == 0 and similarities.size == 0
+
+
+def test_top_k_non_positive_k():
+    entry = make_vectors(10)
+
+    indices, similarities = entry.top_k(np.ones(16, dtype=np.float32), 0)
+
+    assert indices.size == 0 and similarities.size == 0
+
+
+class FakeSession:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, statement, params=None):
+        self.executed.append((str(statement), params))
+
+    def commit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_invalidate_notifies_other_processes(monkeypatch):
+    executed = []
+    monkeypatch.setattr(vector_cache.db, "get_session", lambda: FakeSession(executed))
+    cache = vector_cache.HotVectorCache(ttl=60)
+    cache._put(7, "exercise", make_vectors(3), 0)
+
+    cache.invalidate(7, "exercise", notify=True)
+
+    assert cache._get(7, "exercise") is None
+    assert executed == [("SELECT pg_notify(:channel, :payload)",
+                         {"channel": vector_cache.VECTOR_CACHE_CHANNEL, "payload": "7:exercise"})]
+
+
+def test_listener_drops_entries_named_by_other_processes(monkeypatch):
+    cache = vector_cache.HotVectorCache(ttl=60)
+    received = asyncio.Event()
+
+    class Notify:
+        def __init__(self, payload):
+            self.payload = payload
+
+    class FakeConnection:
+        async def execute(self, statement):
+            assert statement == f"LISTEN {vector_cache.VECTOR_CACHE_CHANNEL}"
+
+        async def notifies(self):
+            # Loaded after LISTEN is up (entries from before are dropped on connect)
+            cache._put(7, "exercise", make_vectors(3), cache._generations.get(7, 0))
+            cache._put(7, "workout", make_vectors(3), cache._generations.get(7, 0))
+            cache._put(8, "exercise", make_vectors(3), cache._generations.get(8, 0))
+            yield Notify("7:exercise")
+            received.set()
+            await asyncio.Event().wait()
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+    async def connect(conninfo, autocommit=False):
+        return FakeConnection()
+
+    monkeypatch.setattr(vector_cache.psycopg.AsyncConnection, "connect", connect)
+
+    async def run():
+        listener = asyncio.create_task(cache._listen())
+        await asyncio.wait_for(received.wait(), 1)
+        listener.cancel()
+
+    asyncio.run(run())
+    assert cache._get(7, "exercise") is None
+    assert cache._get(7, "workout") is not None
+    assert cache._get(8, "exercise") is not None
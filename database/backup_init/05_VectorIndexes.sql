@@ -0,0 +1,37 @@
+-- ANN indexes for RAG retrieval
+-- Safe to re-run against an existing database
+
+--denormalized owner so per-user vector search filters without joining workouts
+ALTER TABLE workout_exercises ADD COLUMN IF NOT EXISTS user_id BIGINT;
+
+UPDATE workout_exercises we
+SET user_id = w.user_id
+FROM workouts w
+WHERE we.workout_id = w.id
+AND we.user_id IS DISTINCT FROM w.user_id;
+
+--keep user_id in sync with the parent workout on every insert / re-parent
+CREATE OR REPLACE FUNCTION set_workout_exercise_user_id() RETURNS trigger AS $$
+BEGIN
+    SELECT w.user_id INTO NEW.user_id
+    FROM workouts w
+    WHERE w.id = NEW.workout_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_workout_exercises_user_id ON workout_exercises;
+CREATE TRIGGER trg_workout_exercises_user_id
+    BEFORE INSERT OR UPDATE OF workout_id ON workout_exercises
+    FOR EACH ROW EXECUTE FUNCTION set_workout_exercise_user_id();
+
+ALTER TABLE workout_exercises ALTER COLUMN user_id SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_workout_exercises_user_id ON workout_exercises (user_id);
+CREATE INDEX IF NOT EXISTS idx_workouts_user_id ON workouts (user_id);
+
+--HNSW indexes for cosine distance (<=>)
+CREATE INDEX IF NOT EXISTS idx_workout_exercises_embeddings_hnsw
+    ON workout_exercises USING hnsw (embeddings vector_cosine_ops);
+CREATE INDEX IF NOT EXISTS idx_workouts_embeddings_hnsw
+    ON workouts USING hnsw (embeddings vector_cosine_ops);
@@ -0,0 +1,10 @@
+-- Content-addressed embedding cache
+-- Re-embedding byte-identical text (after an edit that changes nothing, a reset
+-- of embeddings to NULL, ...) is served from here instead of the provider
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model VARCHAR(100) NOT NULL,
+    text_sha256 CHAR(64) NOT NULL, -- hex sha256 of the exact embedded text
+    embedding VECTOR(1024) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (model, text_sha256)
+);
@@ -0,0 +1,12 @@
+-- Progress events for PROGRESS_BACKEND=postgres
+-- Lets /chat and /progress land on different uvicorn workers or replicas;
+-- rows carry the messages, NOTIFY on channel progress_events wakes listeners
+CREATE TABLE IF NOT EXISTS progress_events (
+    id BIGSERIAL PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL, -- user id of the /chat run
+    message TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_progress_events_session_id ON progress_events (session_id, id);
+CREATE INDEX IF NOT EXISTS idx_progress_events_created_at ON progress_events (created_at);
@@ -0,0 +1,12 @@
+-- Persistent tier of the guardrail / routing decision cache
+-- Shared by every API worker and replica; entries older than
+-- DECISION_CACHE_PERSISTENT_TTL_SECONDS are ignored and swept in the background
+CREATE TABLE IF NOT EXISTS classifier_decisions (
+    classifier VARCHAR(50) NOT NULL, -- guardrail, router
+    key_sha256 CHAR(64) NOT NULL,    -- hex sha256 of model, prompt template, prompt and human turns
+    label VARCHAR(50) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (classifier, key_sha256)
+);
+
+CREATE INDEX IF NOT EXISTS idx_classifier_decisions_created_at ON classifier_decisions (created_at);
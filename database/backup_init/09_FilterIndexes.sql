@@ -0,0 +1,16 @@
+-- Composite indexes for RAG pre-filtering (query_filters.py)
+-- Questions naming a date range or an exercise narrow the candidate rows with
+-- these btrees before vectors are ranked
+-- Safe to re-run against an existing database
+
+--date range: w.user_id = ? AND w.workout_date BETWEEN ? AND ?
+CREATE INDEX IF NOT EXISTS idx_workouts_user_id_workout_date ON workouts (user_id, workout_date);
+
+--exercise name (resolved to ids): we.user_id = ? AND we.exercise_id = ANY(?)
+CREATE INDEX IF NOT EXISTS idx_workout_exercises_user_id_exercise_id ON workout_exercises (user_id, exercise_id);
+
+--joins from a filtered set of workouts to their exercises
+CREATE INDEX IF NOT EXISTS idx_workout_exercises_workout_id ON workout_exercises (workout_id);
+
+--a user's exercise vocabulary (global rows are found by is_global)
+CREATE INDEX IF NOT EXISTS idx_exercises_user_id ON exercises (user_id);
@@ -0,0 +1,58 @@
+-- Per-user aggregates for the STATS route (user_stats.py)
+-- Maintained incrementally by embedding_worker on every workout-logged event
+-- Safe to re-run against an existing database
+
+--per-exercise totals and PRs (weight / reps come from the 'weight' and 'reps' metrics)
+CREATE TABLE IF NOT EXISTS user_exercise_stats (
+    user_id BIGINT NOT NULL,
+    exercise_id BIGINT NOT NULL,
+    sessions INT NOT NULL,
+    sets INT NOT NULL,
+    total_reps DOUBLE PRECISION NOT NULL,
+    total_volume DOUBLE PRECISION NOT NULL, -- sum of weight * reps
+    max_weight DOUBLE PRECISION,
+    max_weight_date DATE,
+    max_reps DOUBLE PRECISION,
+    best_e1rm DOUBLE PRECISION,             -- Epley: weight * (1 + reps / 30)
+    first_performed DATE NOT NULL,
+    last_performed DATE NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, exercise_id),
+    CONSTRAINT fk_user_exercise_stats_user
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_user_exercise_stats_exercise
+        FOREIGN KEY (exercise_id) REFERENCES exercises(id)
+        ON DELETE CASCADE
+);
+
+--session counts and volume per week / month
+CREATE TABLE IF NOT EXISTS user_period_stats (
+    user_id BIGINT NOT NULL,
+    period VARCHAR(10) NOT NULL, -- week, month
+    period_start DATE NOT NULL,
+    workouts INT NOT NULL,
+    exercises INT NOT NULL,
+    sets INT NOT NULL,
+    total_reps DOUBLE PRECISION NOT NULL,
+    total_volume DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, period, period_start),
+    CONSTRAINT fk_user_period_stats_user
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        ON DELETE CASCADE
+);
+
+--what each workout last contributed, so an edit or delete also refreshes the
+--old date's periods and the exercises it no longer contains
+CREATE TABLE IF NOT EXISTS user_stats_sources (
+    workout_id BIGINT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    workout_date DATE NOT NULL,
+    exercise_ids BIGINT[] NOT NULL,
+    CONSTRAINT fk_user_stats_sources_user
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_stats_sources_user_id ON user_stats_sources (user_id);
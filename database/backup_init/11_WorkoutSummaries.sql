@@ -0,0 +1,29 @@
+-- Weekly and monthly roll-ups of a user's workouts (summary_embeddings.py)
+-- Built and kept current by embedding_worker; rag.get_data searches them
+-- before individual workouts (coarse-to-fine)
+-- Safe to re-run against an existing database
+
+CREATE TABLE IF NOT EXISTS workout_summaries (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    period VARCHAR(10) NOT NULL, -- week, month
+    period_start DATE NOT NULL,
+    period_end DATE NOT NULL,    -- exclusive
+    workout_ids BIGINT[] NOT NULL, -- the workouts rolled up, for the fine-grained search
+    summary_text TEXT NOT NULL,
+    embeddings VECTOR(1024),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT fk_workout_summaries_user
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        ON DELETE CASCADE,
+    CONSTRAINT workout_summaries_period_uniq
+        UNIQUE (user_id, period, period_start)
+);
+
+--summaries holding a changed workout: workout_ids && ARRAY[...]
+CREATE INDEX IF NOT EXISTS idx_workout_summaries_workout_ids
+    ON workout_summaries USING gin (workout_ids);
+
+--HNSW index for cosine distance (<=>)
+CREATE INDEX IF NOT EXISTS idx_workout_summaries_embeddings_hnsw
+    ON workout_summaries USING hnsw (embeddings vector_cosine_ops);
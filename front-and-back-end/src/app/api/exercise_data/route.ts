@@ -4,6 +4,7 @@ import { editWorkoutExercise } from "@/lib/exercises";
 import { getLastEntryForExercise, getExerciseIdFromWorkoutExercise } from "@/lib/autocomplete";
 import { getServerSession } from "next-auth/next";
 import { authOptions } from "@/app/api/auth/[...nextauth]/route"; // adjust path to your NextAuth config
+import { publishWorkoutLogged } from "@/lib/kafka";
 
 // ==================== GET ====================
 export async function GET(req: NextRequest) {
@@ -73,6 +74,11 @@ export async function POST(req: NextRequest) {
     // 2️⃣ Replace entries & metrics
     const updatedEntries = await replaceEntriesAndMetrics(Number(workoutExerciseId), userId, entries);
 
+    // 3️⃣ Publish Kafka event for embedding worker (non-blocking)
+    publishWorkoutLogged(userId, { workoutExerciseIds: [Number(workoutExerciseId)], change: "updated" }).catch((err) => {
+      console.warn("Failed to publish workout logged event (non-critical):", err.message);
+    });
+
     return NextResponse.json(updatedEntries, { status: 200 });
   } catch (err: any) {
     console.error("Error in POST /api/exercise-entries:", err);
@@ -9,6 +9,7 @@ import {
   editWorkoutExercise  
 } from "@/lib/exercises";
 import { getExercisesByUserId } from "@/lib/autocomplete";
+import { publishWorkoutLogged } from "@/lib/kafka";
 
 /*
 Response shape:
@@ -85,6 +86,12 @@ export async function POST(req: NextRequest) {
     }
 
     const exercise = await addWorkoutExercise(workoutId, { name }, userId);
+
+    // Publish Kafka event for embedding worker (non-blocking)
+    publishWorkoutLogged(userId, { workoutExerciseIds: [exercise.workout_exercise_id], change: "created" }).catch((err) => {
+      console.warn("Failed to publish workout logged event (non-critical):", err.message);
+    });
+
     return NextResponse.json(exercise, { status: 201 });
   } catch (err: any) {
     console.error("Error in POST /api/exercises:", err);
@@ -111,7 +118,13 @@ export async function DELETE(req: NextRequest) {
       return NextResponse.json({ error: "Invalid workoutExerciseId" }, { status: 400 });
     }
 
-    await deleteWorkoutExercise(workoutExerciseId, userId);
+    const workoutId = await deleteWorkoutExercise(workoutExerciseId, userId);
+
+    // Publish Kafka event for embedding worker: the parent workout changed (non-blocking)
+    publishWorkoutLogged(userId, { workoutIds: [workoutId], change: "updated" }).catch((err) => {
+      console.warn("Failed to publish workout logged event (non-critical):", err.message);
+    });
+
     return NextResponse.json({ message: "Exercise removed from workout" }, { status: 200 });
   } catch (err: any) {
     console.error("Error in DELETE /api/exercises:", err);
@@ -138,6 +151,12 @@ export async function PATCH(req: NextRequest) {
     }
 
     const updated = await editWorkoutExercise(Number(workoutExerciseId), { name, note }, userId);
+
+    // Publish Kafka event for embedding worker (non-blocking)
+    publishWorkoutLogged(userId, { workoutExerciseIds: [updated.workout_exercise_id], change: "updated" }).catch((err) => {
+      console.warn("Failed to publish workout logged event (non-critical):", err.message);
+    });
+
     return NextResponse.json(updated, { status: 200 });
   } catch (err: any) {
     console.error("Error in PATCH /api/exercises:", err);
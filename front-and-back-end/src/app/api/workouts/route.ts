@@ -74,7 +74,7 @@ export async function POST(req: NextRequest) {
     const workout = await createWorkout({ user_id: userId, ...parsed.data });
     
     // Publish Kafka event for embedding worker (non-blocking)
-    publishWorkoutLogged(userId).catch((err) => {
+    publishWorkoutLogged(userId, { workoutIds: [workout.id], change: "created" }).catch((err) => {
       console.warn("Failed to publish workout logged event (non-critical):", err.message);
     });
     
@@ -128,7 +128,7 @@ export async function PUT(req: NextRequest) {
     const updatedWorkout = await updateWorkout(workoutId, userId, parsed.data);
     
     // Publish Kafka event for embedding worker (non-blocking)
-    publishWorkoutLogged(userId).catch((err) => {
+    publishWorkoutLogged(userId, { workoutIds: [workoutId], change: "updated" }).catch((err) => {
       console.warn("Failed to publish workout logged event (non-critical):", err.message);
     });
     
@@ -177,6 +177,11 @@ export async function DELETE(req: NextRequest) {
       return NextResponse.json({ error: "Workout not found or not owned by you" }, { status: 404 });
     }
 
+    // Publish Kafka event so the worker drops the workout from the user's aggregates (non-blocking)
+    publishWorkoutLogged(userId, { workoutIds: [workoutId], change: "deleted" }).catch((err) => {
+      console.warn("Failed to publish workout logged event (non-critical):", err.message);
+    });
+
     return NextResponse.json({ message: "Workout deleted successfully" });
   } catch (err: any) {
     console.error("Error in DELETE /api/workouts:", err);
@@ -74,22 +74,26 @@ export async function addWorkoutExercise(
 
 /**
  * Delete a workout_exercise (does not delete exercise itself)
+ * Returns the id of the workout it belonged to
  */
 export async function deleteWorkoutExercise(
   workoutExerciseId: number,
   userId: number
-): Promise<void> {
+): Promise<number> {
   const res = await pool.query(
     `DELETE FROM workout_exercises we
      USING workouts w
-     WHERE we.id = $1 AND we.workout_id = w.id AND w.user_id = $2`,
+     WHERE we.id = $1 AND we.workout_id = w.id AND w.user_id = $2
+     RETURNING we.workout_id`,
     [workoutExerciseId, userId]
   );
   if (res.rowCount === 0) {
     throw new Error('Workout exercise not found or unauthorized');
   }
-  // clear workout embedding
-  await clearWorkoutEmbedding(workoutExerciseId, true);
+  // clear workout embedding (by workout id: the workout_exercise row is already gone)
+  const workoutId = Number(res.rows[0].workout_id);
+  await clearWorkoutEmbedding(workoutId);
+  return workoutId;
 }
 
 // /**
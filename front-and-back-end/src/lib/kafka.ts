@@ -29,13 +29,30 @@ export async function initializeKafka() {
   }
 }
 
+/**
+ * Rows touched by a workout change, sent to the embedding worker
+ */
+export type WorkoutChange = {
+  workoutIds?: number[];
+  workoutExerciseIds?: number[];
+  change?: 'created' | 'updated' | 'deleted';
+};
+
+// Version of the workout-logged message schema understood by the embedding worker
+const WORKOUT_LOGGED_VERSION = 1;
+
 /**
  * Publish workout-logged event to Kafka
  * Called when a workout is created or updated
  * 
+ * The message is JSON: { version, user_id, workout_ids, workout_exercise_ids, change }.
+ * The worker re-embeds exactly those rows; with no ids it falls back to
+ * scanning the user's unembedded rows.
+ * 
  * @param userId - The user who logged the workout
+ * @param changed - The workouts / workout exercises that changed
  */
-export async function publishWorkoutLogged(userId: number) {
+export async function publishWorkoutLogged(userId: number, changed: WorkoutChange = {}) {
   if (!kafkaProducer) {
     console.warn('⚠️  Kafka producer not initialized, skipping event publish');
     return;
@@ -47,7 +64,13 @@ export async function publishWorkoutLogged(userId: number) {
       messages: [
         {
           key: userId.toString(),
-          value: userId.toString(), // Simple message: just the user ID
+          value: JSON.stringify({
+            version: WORKOUT_LOGGED_VERSION,
+            user_id: userId,
+            workout_ids: changed.workoutIds ?? [],
+            workout_exercise_ids: changed.workoutExerciseIds ?? [],
+            change: changed.change ?? 'updated',
+          }),
         },
       ],
     });
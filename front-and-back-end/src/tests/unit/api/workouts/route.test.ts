@@ -28,6 +28,15 @@ jest.mock("@/lib/workouts", () => ({
   updateWorkout: jest.fn(),
 }));
 
+// ------------------------
+// Mock Kafka producer
+// ------------------------
+import { publishWorkoutLogged } from "@/lib/kafka";
+jest.mock("@/lib/kafka", () => ({
+  __esModule: true,
+  publishWorkoutLogged: jest.fn(() => Promise.resolve()),
+}));
+
 // ------------------------
 // Import API handlers after mocks
 // ------------------------
@@ -150,6 +159,24 @@ describe("DELETE /workouts", () => {
     expect(json).toEqual({ message: "Workout deleted successfully" });
   });
 
+  it("publishes a deleted event for the workout", async () => {
+    (workoutsLib.deleteWorkout as jest.Mock).mockResolvedValue(true);
+
+    const req = { url: "http://localhost/api/workouts?workoutId=1" } as unknown as NextRequest;
+    await DELETE(req);
+
+    expect(publishWorkoutLogged).toHaveBeenCalledWith(1, { workoutIds: [1], change: "deleted" });
+  });
+
+  it("does not publish when nothing was deleted", async () => {
+    (workoutsLib.deleteWorkout as jest.Mock).mockResolvedValue(false);
+
+    const req = { url: "http://localhost/api/workouts?workoutId=99" } as unknown as NextRequest;
+    await DELETE(req);
+
+    expect(publishWorkoutLogged).not.toHaveBeenCalled();
+  });
+
   it("returns 500 if deleteWorkout throws", async () => {
     (workoutsLib.deleteWorkout as jest.Mock).mockRejectedValue(new Error("DB error"));
 
@@ -177,8 +177,14 @@ describe("deleteWorkoutExercise unit tests", () => {
   });
 
   it("succeeds when workout_exercise exists", async () => {
-    (pool.query as jest.Mock).mockResolvedValue({ rowCount: 1 });
-    await expect(deleteWorkoutExercise(1, 1)).resolves.toBeUndefined();
+    (pool.query as jest.Mock).mockResolvedValue({ rowCount: 1, rows: [{ workout_id: "7" }] });
+    await expect(deleteWorkoutExercise(1, 1)).resolves.toBe(7);
+  });
+
+  it("clears the parent workout's embedding by workout id", async () => {
+    (pool.query as jest.Mock).mockResolvedValue({ rowCount: 1, rows: [{ workout_id: "7" }] });
+    await deleteWorkoutExercise(1, 1);
+    expect(pool.query).toHaveBeenLastCalledWith(expect.stringContaining("UPDATE workouts"), [7]);
   });
 });
 